@@ -0,0 +1,74 @@
+import os
+import threading
+import config
+from tsbuffer import TSRingBuffer
+from hls import HLSPlaylist, HLSSegmenter
+from profiles import latency_profile, encoder_profile, hls_cut_time, abr_bandwidth
+
+
+def ladder_sizes(level=None):
+    """(width, height) of every rung, top first.
+
+    A stepped-down encoder level caps the ladder at that level's height.
+    """
+    top, *lower = config.ABR_LADDER
+    level_height = encoder_profile().height(level)
+    top_height = min(top["height"], level_height or top["height"])
+    heights = [top_height] + [min(r["height"], top_height) for r in lower]
+    return [(round(h * 16 / 9 / 2) * 2, h) for h in heights]
+
+
+def _codecs(height):
+    """CODECS of a rung: H.264 High at a level that covers its size at 60 fps, AAC-LC"""
+    level = 0x2A if height > 720 else 0x20 if height > 480 else 0x1F
+    return f"avc1.6400{level:02x},mp4a.40.2"
+
+
+class Rendition:
+    """A lower rung of a channel's ABR ladder.
+
+    The channel's encoder writes it to an extra output; the supervisor
+    pumps that into the rendition's own ring, which is cut into its own
+    HLS window under hls_dir/<name>/.
+    """
+
+    def __init__(self, channel, rung):
+        self.name = rung["name"]
+        self.rung = rung
+        self.directory = os.path.join(channel.hls_dir, self.name)
+        self.ring = TSRingBuffer(config.ABR_RING_BYTES)
+        self.playlist = None
+
+    def start(self):
+        _, profile = latency_profile()
+        os.makedirs(self.directory, exist_ok=True)
+        self.playlist = HLSPlaylist(
+            self.directory,
+            list_size=profile["hls_list_size"],
+            target_duration=profile["hls_segment_time"],
+        )
+        segmenter = HLSSegmenter(self.ring, self.playlist, segment_time=hls_cut_time())
+        threading.Thread(target=segmenter.run, daemon=True).start()
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "bytes": self.ring.total_bytes,
+            "segments": len(self.playlist.segments) if self.playlist else 0,
+        }
+
+
+def render_master(channel):
+    """Master playlist over the channel's main HLS output and its renditions,
+    at the sizes the encoder currently produces"""
+    top, *_ = config.ABR_LADDER
+    variants = [(abr_bandwidth(top, top=True), "stream.m3u8")]
+    variants += [(abr_bandwidth(r.rung), f"{r.name}/stream.m3u8") for r in channel.renditions]
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    for (bandwidth, uri), (width, height) in zip(variants, ladder_sizes(channel.encoder_level)):
+        lines.append(
+            f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{height},"
+            f'CODECS="{_codecs(height)}"'
+        )
+        lines.append(uri)
+    return ("\n".join(lines) + "\n").encode()
@@ -0,0 +1,372 @@
+import asyncio
+import io
+import os
+import re
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import unquote
+import config
+import state
+from channels import PRIMARY_CHANNEL
+
+# media routes served natively; everything else goes to the Flask app
+_TS_ROUTE = re.compile(r"^/(?:channel/([^/]+)/)?stream\.ts$")
+# an optional rendition directory selects a lower ABR rung
+_M3U8_ROUTE = re.compile(r"^/(?:channel/([^/]+)/)?(?:([\w-]+)/)?stream\.m3u8$")
+_SEGMENT_ROUTE = re.compile(r"^/(?:channel/([^/]+)/)?((?:[\w-]+/)?seg_\d+\.ts)$")
+_TIMESHIFT_SEGMENT_ROUTE = re.compile(r"^/(?:channel/([^/]+)/)?timeshift/(ts_\d+\.ts)$")
+
+# set on every response, as the Flask app's after_request does
+_COMMON_HEADERS = [("Access-Control-Allow-Origin", "*")]
+
+
+class _Request:
+    def __init__(self, method, target, version, headers, body, peer):
+        self.method = method
+        path, _, self.query = target.partition("?")
+        self.path = unquote(path)
+        self.version = version
+        self.headers = headers  # [(name, value)] as received
+        self.body = body
+        self.peer = peer
+
+    def header(self, name, default=None):
+        name = name.lower()
+        for k, v in self.headers:
+            if k.lower() == name:
+                return v
+        return default
+
+    @property
+    def keep_alive(self):
+        conn = (self.header("connection") or "").lower()
+        if self.version == "HTTP/1.1":
+            return conn != "close"
+        return conn == "keep-alive"
+
+
+class AsyncServer:
+    """asyncio HTTP/1.1 server for the media endpoints, in front of the Flask app.
+
+    Live TS clients are coroutines fed straight from the channel's ring,
+    each with its own bounded write buffer: a slow client only pauses
+    itself and, once it falls out of the ring, skips to the newest
+    keyframe. HLS and time-shift segments go out with sendfile. Every
+    other request is handed to the WSGI app on a bounded thread pool, so
+    the dashboard and API keep working on the same port.
+    """
+
+    def __init__(self, app, host="0.0.0.0", port=None):
+        self.app = app
+        self.host = host
+        self.port = port or config.SERVER_PORT
+        self._pool = ThreadPoolExecutor(
+            max_workers=config.SERVER_WSGI_THREADS, thread_name_prefix="wsgi"
+        )
+
+    # --- connection handling ---
+
+    async def _read_request(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(
+                reader.readuntil(b"\r\n\r\n"), config.SERVER_KEEPALIVE_TIMEOUT
+            )
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            return None
+        except asyncio.LimitOverrunError:
+            await self._send_simple(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+            return None
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            await self._send_simple(writer, HTTPStatus.BAD_REQUEST)
+            return None
+        headers = []
+        for line in lines[1:]:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers.append((k.strip(), v.strip()))
+        request = _Request(method, target, version, headers, b"", writer.get_extra_info("peername"))
+        if request.header("transfer-encoding"):
+            await self._send_simple(writer, HTTPStatus.LENGTH_REQUIRED)
+            return None
+        try:
+            length = int(request.header("content-length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            await self._send_simple(writer, HTTPStatus.BAD_REQUEST)
+            return None
+        if length > config.SERVER_MAX_BODY:
+            await self._send_simple(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            return None
+        expect = (request.header("expect") or "").lower()
+        if expect and expect != "100-continue":
+            await self._send_simple(writer, HTTPStatus.EXPECTATION_FAILED)
+            return None
+        if length:
+            if expect:
+                # the client holds the body back until we ask for it
+                writer.write(f"{request.version} 100 Continue\r\n\r\n".encode("latin-1"))
+                await writer.drain()
+            try:
+                request.body = await reader.readexactly(length)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return None
+        return request
+
+    async def _handle(self, reader, writer):
+        writer.transport.set_write_buffer_limits(high=config.SERVER_CLIENT_BUFFER)
+        try:
+            while True:
+                request = await self._read_request(reader, writer)
+                if request is None:
+                    break
+                if not await self._dispatch(request, writer):
+                    break
+        except ConnectionError:
+            pass
+        except Exception:
+            traceback.print_exc()
+        finally:
+            writer.close()
+
+    async def _dispatch(self, request, writer):
+        """Serve one request; returns True if the connection may be reused."""
+        if request.method in ("GET", "HEAD"):
+            m = _TS_ROUTE.match(request.path)
+            if m:
+                return await self._stream_ts(request, writer, m.group(1))
+            m = _M3U8_ROUTE.match(request.path)
+            if m:
+                return await self._stream_m3u8(request, writer, m.group(1), m.group(2))
+            m = _SEGMENT_ROUTE.match(request.path)
+            if m:
+                return await self._segment(request, writer, m.group(1), m.group(2))
+            m = _TIMESHIFT_SEGMENT_ROUTE.match(request.path)
+            if m:
+                return await self._timeshift_segment(request, writer, m.group(1), m.group(2))
+        return await self._wsgi(request, writer)
+
+    # --- responses ---
+
+    def _write_head(self, writer, status, headers, keep_alive, native=True):
+        lines = [f"HTTP/1.1 {status}"]
+        for k, v in [*headers, *(_COMMON_HEADERS if native else ())]:
+            lines.append(f"{k}: {v}")
+        lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+    async def _send_simple(self, writer, status, keep_alive=False, body=None):
+        body = body if body is not None else status.phrase.encode()
+        self._write_head(
+            writer,
+            f"{status.value} {status.phrase}",
+            [("Content-Type", "text/plain"), ("Content-Length", str(len(body)))],
+            keep_alive,
+        )
+        writer.write(body)
+        await writer.drain()
+        return keep_alive
+
+    def _channel(self, channel_id):
+        return state.channels.get(channel_id or PRIMARY_CHANNEL)
+
+    async def _stream_m3u8(self, request, writer, channel_id, rendition=None):
+        channel = self._channel(channel_id)
+        playlist = channel.media_playlist(rendition) if channel else None
+        if playlist is None:
+            return await self._send_simple(writer, HTTPStatus.NOT_FOUND, request.keep_alive)
+        body = playlist.render()
+        self._write_head(
+            writer,
+            "200 OK",
+            [
+                ("Content-Type", "application/vnd.apple.mpegurl"),
+                ("Content-Length", str(len(body))),
+                ("Cache-Control", "no-cache"),
+            ],
+            request.keep_alive,
+        )
+        if request.method != "HEAD":
+            writer.write(body)
+        await writer.drain()
+        return request.keep_alive
+
+    async def _segment(self, request, writer, channel_id, filename):
+        channel = self._channel(channel_id)
+        if channel is None:
+            return await self._send_simple(writer, HTTPStatus.NOT_FOUND, request.keep_alive)
+        try:
+            f = open(os.path.join(channel.hls_dir, filename), "rb")
+        except OSError:
+            # segment already rotated out of the window
+            return await self._send_simple(writer, HTTPStatus.NOT_FOUND, request.keep_alive)
+        with f:
+            return await self._send_file(request, writer, f, os.fstat(f.fileno()).st_size)
+
+    async def _timeshift_segment(self, request, writer, channel_id, filename):
+        channel = self._channel(channel_id)
+        timeshift = channel.timeshift if channel else None
+        opened = timeshift.acquire(filename) if timeshift else None
+        if opened is None:
+            # not recorded, or its slot has been reused since
+            return await self._send_simple(writer, HTTPStatus.NOT_FOUND, request.keep_alive)
+        f, size = opened
+        try:
+            with f:
+                # the slot file is preallocated; only the segment's own bytes go out
+                return await self._send_file(request, writer, f, size)
+        finally:
+            timeshift.release(filename)
+
+    async def _send_file(self, request, writer, f, size):
+        self._write_head(
+            writer,
+            "200 OK",
+            [("Content-Type", "video/mp2t"), ("Content-Length", str(size))],
+            request.keep_alive,
+        )
+        if request.method != "HEAD":
+            await writer.drain()
+            # zero-copy where the transport allows it
+            await asyncio.get_running_loop().sendfile(writer.transport, f, count=size)
+        await writer.drain()
+        return request.keep_alive
+
+    async def _stream_ts(self, request, writer, channel_id):
+        channel = self._channel(channel_id)
+        ring = channel.ts_buffer if channel else None
+        if ring is None:
+            return await self._send_simple(writer, HTTPStatus.SERVICE_UNAVAILABLE)
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+
+        def notify():
+            loop.call_soon_threadsafe(wake.set)
+
+        ring.add_listener(notify)
+        ring.attach()
+        try:
+            entry = ring.entry()
+            while entry is None:
+                if ring.closed:
+                    return await self._send_simple(writer, HTTPStatus.SERVICE_UNAVAILABLE)
+                wake.clear()
+                try:
+                    await asyncio.wait_for(wake.wait(), 10)
+                except asyncio.TimeoutError:
+                    # no keyframe yet, e.g. the encoder is still starting
+                    return await self._send_simple(writer, HTTPStatus.SERVICE_UNAVAILABLE)
+                entry = ring.entry()
+            seq, data = entry
+            # body runs until the client hangs up, so the connection is not reused
+            self._write_head(
+                writer,
+                "200 OK",
+                [("Content-Type", "video/mp2t"), ("Cache-Control", "no-cache")],
+                False,
+            )
+            if request.method == "HEAD":
+                await writer.drain()
+                return False
+            while not ring.closed:
+                if data:
+                    writer.write(data)
+                    # waits only while this client's own buffer is full
+                    await writer.drain()
+                wake.clear()
+                seq, data = ring.read(seq)
+                if not data:
+                    try:
+                        await asyncio.wait_for(wake.wait(), 10)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            ring.remove_listener(notify)
+            ring.detach()
+        return False
+
+    # --- WSGI bridge ---
+
+    def _environ(self, request):
+        environ = {
+            "REQUEST_METHOD": request.method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": request.path.encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": request.query,
+            "SERVER_NAME": self.host,
+            "SERVER_PORT": str(self.port),
+            "SERVER_PROTOCOL": request.version,
+            "REMOTE_ADDR": request.peer[0] if request.peer else "",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(request.body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for k, v in request.headers:
+            key = k.upper().replace("-", "_")
+            if key == "CONTENT_TYPE":
+                environ["CONTENT_TYPE"] = v
+            elif key == "CONTENT_LENGTH":
+                environ["CONTENT_LENGTH"] = v
+            else:
+                key = f"HTTP_{key}"
+                environ[key] = f"{environ[key]},{v}" if key in environ else v
+        return environ
+
+    def _call_wsgi(self, environ):
+        """Run the app in a pool thread; returns (status, headers, body)."""
+        response = {}
+        chunks = []
+
+        def start_response(status, headers, exc_info=None):
+            response["status"], response["headers"] = status, headers
+            return chunks.append
+
+        result = self.app(environ, start_response)
+        try:
+            for chunk in result:
+                chunks.append(chunk)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return response["status"], response["headers"], b"".join(chunks)
+
+    async def _wsgi(self, request, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            status, headers, body = await loop.run_in_executor(
+                self._pool, self._call_wsgi, self._environ(request)
+            )
+        except Exception:
+            # the response is buffered, so nothing has been sent yet
+            traceback.print_exc()
+            return await self._send_simple(writer, HTTPStatus.INTERNAL_SERVER_ERROR)
+        skip = {"content-length", "connection", "transfer-encoding"}
+        headers = [(k, v) for k, v in headers if k.lower() not in skip]
+        headers.append(("Content-Length", str(len(body))))
+        self._write_head(writer, status, headers, request.keep_alive, native=False)
+        if request.method != "HEAD":
+            writer.write(body)
+        await writer.drain()
+        return request.keep_alive
+
+    async def _serve(self):
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        print(f"⚡ Async server on {self.host}:{self.port} ({config.SERVER_WSGI_THREADS} WSGI threads)")
+        asyncio.run(self._serve())
+
+
+def serve(app, host="0.0.0.0", port=None):
+    AsyncServer(app, host, port).run()
@@ -0,0 +1 @@
+"""Benchmark and soak harness: python -m bench --help"""
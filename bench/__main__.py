@@ -0,0 +1,149 @@
+"""python -m bench [run|compare] ...
+
+run: starts the real pipeline against a fake Twitch and local filler in a
+scratch directory, runs the chosen scenarios and writes
+bench/results/<timestamp>-<commit>.json.
+compare: diffs two such files and exits non-zero on regressions.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO, "bench", "results")
+SCENARIOS = ("switch_latency", "glass_to_glass", "cpu_per_channel", "clients", "soak")
+
+
+def _git(*args):
+    try:
+        return subprocess.run(
+            ["git", *args], cwd=REPO, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _host():
+    ffmpeg = None
+    try:
+        out = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout
+        ffmpeg = out.splitlines()[0] if out else None
+    except OSError:
+        pass
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "ffmpeg": ffmpeg,
+    }
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m bench")
+    sub = parser.add_subparsers(dest="command")
+
+    run = sub.add_parser("run", help="run scenarios (default)")
+    run.add_argument("scenarios", nargs="*", default=None, help=f"any of {', '.join(SCENARIOS)} (default: all but soak)")
+    run.add_argument("--channels", type=int, default=1)
+    run.add_argument("--clients", type=int, default=20)
+    run.add_argument("--duration", type=int, default=60, help="seconds per scenario")
+    run.add_argument("--soak-hours", type=float, default=24)
+    run.add_argument("--soak-interval", type=int, default=60)
+    run.add_argument("--live-for", type=int, default=60)
+    run.add_argument("--offline-for", type=int, default=60)
+    run.add_argument("--server", choices=("async", "dev"), default="async")
+    run.add_argument("--port", type=int, default=3900)
+    run.add_argument("--workdir", default="/tmp/twitch-jellyfin-bench")
+    run.add_argument("--output", help="results file (default: bench/results/<timestamp>-<commit>.json)")
+
+    comp = sub.add_parser("compare", help="compare two results files")
+    comp.add_argument("old")
+    comp.add_argument("new")
+    comp.add_argument("--threshold", type=float, default=0.1, help="relative change that counts as a regression")
+
+    if not argv or argv[0] not in ("run", "compare", "-h", "--help"):
+        argv = ["run", *argv]
+    return parser.parse_args(argv)
+
+
+def _run(args):
+    # config derives its paths from the cwd at import time, so move into
+    # the scratch directory before any repo module is imported
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    sys.path.insert(0, REPO)
+    from bench import scenarios
+    from bench.harness import Harness
+
+    chosen = args.scenarios or [s for s in SCENARIOS if s != "soak"]
+    unknown = set(chosen) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    results = {}
+    for i, name in enumerate(chosen):
+        # each scenario gets a fresh pipeline; servers can't be torn down
+        # cleanly in every mode, so each one also gets its own port
+        harness = Harness(
+            channels=args.channels,
+            port=args.port + i,
+            server_mode=args.server,
+            live_for=args.live_for,
+            offline_for=args.offline_for,
+        )
+        print(f"▶ {name}")
+        harness.start()
+        try:
+            if name == "switch_latency":
+                # enough time for several live/offline cycles
+                cycle = args.live_for + args.offline_for
+                results[name] = scenarios.switch_latency(harness, max(args.duration, 3 * cycle))
+            elif name == "glass_to_glass":
+                results[name] = scenarios.glass_to_glass(harness, args.duration)
+            elif name == "cpu_per_channel":
+                results[name] = scenarios.cpu_per_channel(harness, args.duration)
+            elif name == "clients":
+                results[name] = scenarios.clients(harness, args.duration, args.clients)
+            elif name == "soak":
+                results[name] = scenarios.soak(
+                    harness, int(args.soak_hours * 3600), args.soak_interval
+                )
+        except Exception as e:
+            results[name] = {"error": repr(e)}
+        finally:
+            harness.stop()
+        print(f"  {json.dumps(results[name])[:400]}")
+
+    commit = _git("rev-parse", "--short", "HEAD") or "unknown"
+    report = {
+        "commit": commit,
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": _host(),
+        "params": {k: v for k, v in vars(args).items() if k != "command"},
+        "results": results,
+    }
+    path = args.output
+    if not path:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Results written to {path}")
+
+
+def main(argv=None):
+    args = _parse_args(sys.argv[1:] if argv is None else argv)
+    if args.command == "compare":
+        from bench.compare import main as compare
+
+        sys.exit(compare(args.old, args.new, args.threshold))
+    _run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Compare two bench result files and flag regressions."""
+import json
+
+# metric name fragments where a larger number is better; everything else
+# numeric (latency, delay, cpu, rss, growth, gaps) is better when smaller
+HIGHER_IS_BETTER = ("bytes_per_second", "keeping_up", "flashes")
+# sample and schedule sizes, not scores
+COUNTS = ("/n", "/edges")
+
+
+def _flatten(node, prefix=""):
+    if isinstance(node, dict):
+        for k, v in node.items():
+            yield from _flatten(v, f"{prefix}/{k}" if prefix else k)
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        yield prefix, node
+
+
+def compare(old, new, threshold=0.1):
+    """Return (key, old, new, change) for every metric that got worse by more than threshold."""
+    before = dict(_flatten(old["results"]))
+    regressions = []
+    for key, value in _flatten(new["results"]):
+        if key not in before or key.endswith(COUNTS):
+            continue
+        base = before[key]
+        if not base:
+            continue
+        change = (value - base) / abs(base)
+        if any(s in key for s in HIGHER_IS_BETTER):
+            change = -change
+        if change > threshold:
+            regressions.append((key, base, value, change))
+    return regressions
+
+
+def main(old_path, new_path, threshold):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    regressions = compare(old, new, threshold)
+    for key, base, value, change in regressions:
+        print(f"  REGRESSION {key}: {base} -> {value} ({change:+.0%})")
+    if not regressions:
+        print(f"  no regressions over {threshold:.0%}")
+    return 1 if regressions else 0
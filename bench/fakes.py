@@ -0,0 +1,159 @@
+"""Local stand-ins for Twitch and YouTube so the pipeline can be benchmarked offline."""
+import os
+import socket
+import subprocess
+import threading
+import time
+import config
+from profiles import output_video_args, output_audio_args, output_mux_args
+
+FLASH_PERIOD = 10  # seconds between white flash frames in the fake live source
+FLASH_LENGTH = 0.2
+
+
+def _free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def live_source_cmd(url):
+    """ffmpeg producing a paced 'live stream': black video with a white flash
+    every FLASH_PERIOD seconds of content, encoded with the output profile so
+    the passthrough path is exercised."""
+    video = (
+        "color=c=black:s=1280x720:r=30,"
+        f"drawbox=x=0:y=0:w=iw:h=ih:color=white:t=fill:"
+        f"enable='lt(mod(t\\,{FLASH_PERIOD})\\,{FLASH_LENGTH})'"
+    )
+    return [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-re",
+        "-f", "lavfi", "-i", video,
+        "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000",
+        *output_video_args(),
+        *output_audio_args(),
+        *output_mux_args(),
+        url,
+    ]
+
+
+class FakeTwitchProbe:
+    """Drop-in for twitch.TwitchProbe driven by a fixed live/offline schedule.
+
+    Each channel starts offline, goes live after offline_for seconds, stays
+    live for live_for seconds and repeats. While live, a lavfi source is
+    streamed over loopback UDP and resolve() returns its URL, so the real
+    writer, switcher and encoder run unchanged. edges records when each
+    channel was scheduled to flip, for latency measurements.
+    """
+
+    def __init__(self, live_for=60, offline_for=60):
+        self.live_for = live_for
+        self.offline_for = offline_for
+        self.t0 = time.time()
+        self.last_latency = 0.0
+        self.probes = 0
+        self.probe_seconds = 0.0
+        self.stream_info = {}
+        self.sources = {}  # login -> {"proc", "url", "started"}
+        self._lock = threading.Lock()
+
+    def live_at(self, t):
+        phase = (t - self.t0) % (self.live_for + self.offline_for)
+        return phase >= self.offline_for
+
+    def edges(self, until):
+        """Scheduled (time, live) flips between start and until."""
+        out, cycle = [], self.live_for + self.offline_for
+        t = self.t0 + self.offline_for
+        while t <= until:
+            out.append((t, True))
+            if t + self.live_for <= until:
+                out.append((t + self.live_for, False))
+            t += cycle
+        return out
+
+    def _start_source(self, login):
+        port = _free_udp_port()
+        url = f"udp://127.0.0.1:{port}"
+        proc = subprocess.Popen(
+            live_source_cmd(f"{url}?pkt_size=1316"),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        self.sources[login] = {
+            "proc": proc,
+            # the reader side must not die on a burst it can't keep up with
+            "url": f"{url}?overrun_nonfatal=1&fifo_size=50000",
+            "started": time.time(),
+        }
+
+    def _stop_source(self, login):
+        source = self.sources.pop(login, None)
+        if source and source["proc"].poll() is None:
+            source["proc"].terminate()
+            source["proc"].wait()
+
+    def is_live(self, channel):
+        start = time.monotonic()
+        live = self.live_at(time.time())
+        with self._lock:
+            if live and channel not in self.sources:
+                self._start_source(channel)
+                self.stream_info[channel] = {"title": "bench", "category": "bench"}
+            elif not live and channel in self.sources:
+                self._stop_source(channel)
+                self.stream_info.pop(channel, None)
+        self.last_latency = time.monotonic() - start
+        self.probes += 1
+        self.probe_seconds += self.last_latency
+        return live
+
+    def resolve(self, channel, fresh=False):
+        with self._lock:
+            source = self.sources.get(channel)
+            return source["url"] if source else None
+
+    def invalidate(self, channel):
+        pass
+
+    def stop(self):
+        with self._lock:
+            for login in list(self.sources):
+                self._stop_source(login)
+
+    def stats(self):
+        return {"probe_latency_ms": round(self.last_latency * 1000), "live": dict(self.stream_info)}
+
+
+def make_filler_videos(count=3, seconds=30):
+    """Write local mp4s into YOUTUBE_DIR in place of yt-dlp downloads."""
+    files, meta = [], []
+    for i in range(count):
+        video_id = f"bench{i:02d}"
+        path = os.path.join(config.YOUTUBE_DIR, f"{video_id}.mp4")
+        if not os.path.exists(path):
+            subprocess.run(
+                [
+                    "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+                    "-f", "lavfi", "-i", f"testsrc2=s=1280x720:r=30:d={seconds}",
+                    "-f", "lavfi", "-i", f"sine=frequency={300 + 100 * i}:duration={seconds}",
+                    "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+                    "-c:a", "aac", "-shortest", path,
+                ],
+                check=True,
+            )
+        files.append(path)
+        meta.append(
+            {
+                "id": video_id,
+                "title": f"Bench filler {i}",
+                "duration": f"0:{seconds:02d}",
+                "url": "",
+                "channel": "bench",
+            }
+        )
+    return files, meta
@@ -0,0 +1,123 @@
+"""Runs the real pipeline in-process against the fakes in bench.fakes."""
+import json
+import os
+import threading
+import time
+import config
+import state
+from utils import cleanup, playing_files
+from channels import sync_channels, PRIMARY_CHANNEL
+from transcode_cache import TranscodeCache
+from video_index import VideoIndex
+from video_cache import VideoCache
+from jobs import JobQueue
+from youtube import _set_playlist
+from bench.fakes import FakeTwitchProbe, make_filler_videos
+
+
+def _rss(pid="self"):
+    """Resident set size in bytes from /proc, or None."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class Harness:
+    """One benchmark run: N channels, fake Twitch, local filler, HTTP on port.
+
+    Must be created after the working directory is set, since config
+    derives its paths from the cwd at import time.
+    """
+
+    def __init__(self, channels=1, port=3900, server_mode="async", live_for=60, offline_for=60):
+        self.channels = channels
+        self.port = port
+        self.server_mode = server_mode
+        self.probe = FakeTwitchProbe(live_for=live_for, offline_for=offline_for)
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def stream_url(self, channel_id=PRIMARY_CHANNEL):
+        return f"{self.base_url}/channel/{channel_id}/stream.ts"
+
+    def _write_config(self):
+        cfg = {
+            "twitch_channel": "bench0",
+            "channel_name": "Bench 0",
+            "channel_logo": "",
+            "youtube_channels": [],
+            "channels": [
+                {
+                    "id": f"bench{i}",
+                    "twitch_channel": f"bench{i}",
+                    "channel_name": f"Bench {i}",
+                    "channel_logo": "",
+                    "custom_logo": False,
+                }
+                for i in range(1, self.channels)
+            ],
+        }
+        with open(config.CONFIG_FILE, "w") as f:
+            json.dump(cfg, f, indent=2)
+
+    def _serve(self):
+        from server import app
+
+        if self.server_mode == "async":
+            from async_server import AsyncServer
+
+            AsyncServer(app, "127.0.0.1", self.port).run()
+        else:
+            from werkzeug.serving import make_server
+
+            self._server = make_server("127.0.0.1", self.port, app, threaded=True)
+            self._server.serve_forever()
+
+    def start(self):
+        cleanup()
+        self._write_config()
+        state.transcode_cache = TranscodeCache(config.TRANSCODE_DIR, in_use=playing_files)
+        state.video_index = VideoIndex(config.VIDEO_INDEX)
+        state.video_cache = VideoCache(config.YOUTUBE_DIR)
+        state.jobs = JobQueue()
+        threading.Thread(target=state.jobs.run, daemon=True).start()
+        state.twitch_probe = self.probe
+        # local files stand in for yt-dlp; the refresh loop is not started
+        _set_playlist(*make_filler_videos())
+        self.probe.t0 = time.time()
+        sync_channels()
+        threading.Thread(target=self._serve, daemon=True).start()
+        time.sleep(1)
+
+    def stop(self):
+        for channel in list(state.channels.values()):
+            channel.stop()
+        state.channels.clear()
+        self.probe.stop()
+        if self._server is not None:
+            self._server.shutdown()
+
+    def process_pids(self):
+        """channel id -> pids of its ffmpeg children."""
+        out = {}
+        for cid, ch in list(state.channels.items()):
+            pids = []
+            sup = ch.supervisor
+            for managed in (sup.encoder, sup.writer) if sup else ():
+                if managed is not None and managed.proc is not None:
+                    pids.append(managed.proc.pid)
+            out[cid] = pids
+        return out
+
+    def memory(self):
+        """RSS of this process and of each channel's ffmpeg children, in bytes."""
+        children = {
+            cid: sum(r for r in (_rss(p) for p in pids) if r)
+            for cid, pids in self.process_pids().items()
+        }
+        return {"server": _rss(), "channels": children}
@@ -0,0 +1,223 @@
+"""Benchmark scenarios. Each takes a started Harness and returns a JSON-able dict."""
+import http.client
+import os
+import re
+import subprocess
+import threading
+import time
+from urllib.parse import urlparse
+import state
+from channels import PRIMARY_CHANNEL
+from bench.fakes import FLASH_PERIOD
+
+_YAVG = re.compile(r"lavfi\.signalstats\.YAVG=([\d.]+)")
+
+
+def summarize(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return {"n": 0}
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {
+        "n": len(values),
+        "min": round(values[0], 3),
+        "median": round(pick(0.5), 3),
+        "p95": round(pick(0.95), 3),
+        "max": round(values[-1], 3),
+        "mean": round(sum(values) / len(values), 3),
+    }
+
+
+def _cpu_seconds():
+    t = os.times()
+    return t.user + t.system
+
+
+def switch_latency(harness, duration):
+    """Time from a scheduled live/offline flip to the new source being on air."""
+    time.sleep(duration)
+    edges = harness.probe.edges(time.time())
+    detection, ttff, total, failed = [], [], [], 0
+    for cid, ch in list(state.channels.items()):
+        for t in ch.orchestrator.transitions:
+            if not t.get("ok", True):
+                failed += 1
+                continue
+            to_live = t["to"] == "twitch"
+            if t["from"] is None or (t["from"] != "twitch" and not to_live):
+                continue  # startup or filler <-> fallback, not a scheduled flip
+            before = [e for e, live in edges if live == to_live and e <= t["at"]]
+            if not before:
+                continue
+            on_air = t["at"] + t["switch_duration"]
+            detection.append(t["at"] - before[-1])
+            ttff.append(t.get("time_to_first_frame"))
+            total.append(on_air - before[-1])
+    return {
+        "edges": len(edges),
+        "failed_switches": failed,
+        "detection_seconds": summarize(detection),
+        "time_to_first_frame_seconds": summarize(ttff),
+        "flip_to_on_air_seconds": summarize(total),
+    }
+
+
+def glass_to_glass(harness, duration):
+    """Delay from a flash frame leaving the fake live source to a client decoding it.
+
+    The client decodes /stream.ts with ffmpeg and reports the mean luma of
+    every frame; a jump to white marks a flash. Flashes are FLASH_PERIOD
+    apart, so delays must stay below that. Includes the client's own
+    decode latency and the source's startup, so it is an upper bound.
+    """
+    channel = state.channels[PRIMARY_CHANNEL]
+    deadline = time.time() + 120
+    while channel.current_source != "twitch" and time.time() < deadline:
+        time.sleep(0.5)
+    source = harness.probe.sources.get("bench0")
+    if channel.current_source != "twitch" or source is None:
+        return {"error": "channel never went live"}
+    started = source["started"]
+    client = subprocess.Popen(
+        [
+            "ffmpeg", "-hide_banner", "-nostats",
+            "-fflags", "nobuffer", "-probesize", "65536", "-analyzeduration", "0",
+            "-i", harness.stream_url(),
+            "-an", "-vf", "scale=32:18,signalstats,metadata=print:key=lavfi.signalstats.YAVG",
+            "-f", "null", "-",
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    delays = []
+    stop_at = time.time() + duration
+    timer = threading.Timer(duration, client.terminate)
+    timer.start()
+    bright = False
+    try:
+        for raw in client.stderr:
+            now = time.time()
+            m = _YAVG.search(raw.decode("utf-8", "replace"))
+            if not m:
+                continue
+            is_bright = float(m.group(1)) > 200
+            if is_bright and not bright:
+                flash_at = started + ((now - started) // FLASH_PERIOD) * FLASH_PERIOD
+                delays.append(now - flash_at)
+            bright = is_bright
+            if now > stop_at:
+                break
+    finally:
+        timer.cancel()
+        client.terminate()
+        client.wait()
+    return {"flashes": len(delays), "delay_seconds": summarize(delays)}
+
+
+def cpu_per_channel(harness, duration):
+    """CPU used by each channel's ffmpeg children, per pipeline mode, plus the server."""
+    cpu0, wall0 = _cpu_seconds(), time.time()
+    time.sleep(duration)
+    wall = time.time() - wall0
+    return {
+        "server_cpu_percent": round(100 * (_cpu_seconds() - cpu0) / wall, 1),
+        "channels": {
+            cid: ch.supervisor.cpu_stats() for cid, ch in list(state.channels.items())
+        },
+    }
+
+
+def _slope_per_hour(samples):
+    """Least-squares slope of (t, value) samples, in value per hour."""
+    points = [(t, v) for t, v in samples if v is not None]
+    if len(points) < 2:
+        return None
+    n = len(points)
+    mt = sum(t for t, _ in points) / n
+    mv = sum(v for _, v in points) / n
+    den = sum((t - mt) ** 2 for t, _ in points)
+    if not den:
+        return None
+    return sum((t - mt) * (v - mv) for t, v in points) / den * 3600
+
+
+def soak(harness, duration, interval=60):
+    """Memory and open file descriptors sampled over a long run (24 h by default)."""
+    start = time.time()
+    series = []
+    while True:
+        mem = harness.memory()
+        series.append(
+            {
+                "t": round(time.time() - start, 1),
+                "server_rss": mem["server"],
+                "children_rss": mem["channels"],
+                "fds": len(os.listdir("/proc/self/fd")),
+            }
+        )
+        if time.time() - start >= duration:
+            break
+        time.sleep(min(interval, max(0, duration - (time.time() - start))))
+    return {
+        "samples": series,
+        "server_rss_growth_bytes_per_hour": _slope_per_hour(
+            [(s["t"], s["server_rss"]) for s in series]
+        ),
+        "fd_growth_per_hour": _slope_per_hour([(s["t"], s["fds"]) for s in series]),
+        "children_rss_growth_bytes_per_hour": {
+            cid: _slope_per_hour([(s["t"], s["children_rss"].get(cid)) for s in series])
+            for cid in series[-1]["children_rss"]
+        },
+    }
+
+
+def _client(url, duration, result):
+    parsed = urlparse(url)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=15)
+    received, max_gap = 0, 0.0
+    try:
+        conn.request("GET", parsed.path)
+        resp = conn.getresponse()
+        last = start = time.time()
+        while time.time() - start < duration:
+            data = resp.read1(65536)
+            if not data:
+                break
+            now = time.time()
+            max_gap = max(max_gap, now - last)
+            last = now
+            received += len(data)
+    except OSError as e:
+        result["error"] = str(e)
+    finally:
+        conn.close()
+    result["bytes"] = received
+    result["max_gap"] = max_gap
+
+
+def clients(harness, duration, count):
+    """Throughput of N concurrent /stream.ts clients on the primary channel."""
+    ring = state.channels[PRIMARY_CHANNEL].ts_buffer
+    produced0, cpu0 = ring.total_bytes, _cpu_seconds()
+    results = [{} for _ in range(count)]
+    threads = [
+        threading.Thread(target=_client, args=(harness.stream_url(), duration, r))
+        for r in results
+    ]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.time() - start
+    produced = (ring.total_bytes - produced0) / wall
+    rates = [r["bytes"] / wall for r in results]
+    return {
+        "clients": count,
+        "stream_bytes_per_second": round(produced),
+        "client_bytes_per_second": summarize(rates),
+        "clients_keeping_up": sum(1 for r in rates if produced and r >= 0.95 * produced),
+        "max_gap_seconds": summarize([r["max_gap"] for r in results]),
+        "errors": [r["error"] for r in results if "error" in r],
+        "server_cpu_percent": round(100 * (_cpu_seconds() - cpu0) / wall, 1),
+    }
@@ -0,0 +1,142 @@
+import os
+import shutil
+import threading
+import config
+import state
+from utils import get_config, wait_for_playlist
+from streaming import start_ffmpeg, start_hls, start_timeshift, write_fallback
+from orchestrator import Orchestrator
+
+# tvg-id of the original single channel, kept so existing guide mappings survive
+PRIMARY_CHANNEL = "twitch"
+
+_lock = threading.Lock()
+
+
+def configured_channels(cfg):
+    """Settings of every channel: the primary one first, then cfg["channels"].
+
+    The primary channel keeps using the top-level twitch_channel and
+    branding keys; further channels are dicts with the same keys plus id.
+    """
+    primary = {
+        "id": PRIMARY_CHANNEL,
+        "twitch_channel": cfg["twitch_channel"],
+        "channel_name": cfg["channel_name"],
+        "channel_logo": cfg.get("channel_logo"),
+        "custom_logo": cfg.get("custom_logo", False),
+        "twitch_schedule": cfg.get("twitch_schedule", []),
+    }
+    return [primary, *cfg.get("channels", [])]
+
+
+def channel_settings(cfg, channel_id):
+    for settings in configured_channels(cfg):
+        if settings["id"] == channel_id:
+            return settings
+    return None
+
+
+def channel_id_for(login):
+    """Channel id for a new Twitch channel; logins are already URL safe."""
+    return "".join(c for c in login.lower() if c.isalnum() or c == "_")
+
+
+class Channel:
+    """One output channel with its own FIFO, encoder, TS ring, HLS window,
+    time-shift buffer and orchestrator.
+
+    YouTube filler, the video caches and the Twitch probe are shared by
+    all channels through state.
+    """
+
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.fifo_path = os.path.join(config.PIPE_DIR, f"{channel_id}.ts")
+        self.hls_dir = os.path.join(config.HLS_DIR, channel_id)
+        self.timeshift_dir = os.path.join(config.TIMESHIFT_DIR, channel_id)
+        self.ts_buffer = None
+        self.supervisor = None
+        self.hls_playlist = None
+        self.renditions = []  # abr.Rendition per lower ABR rung
+        self.timeshift = None
+        self.orchestrator = None
+        self.current_source = None
+        self.playing_files = set()  # files this channel's writer will read
+        self.encoder_level = None  # None = the probed level; raised when it falls behind
+        self.playout = None  # playout.Playout once filler has been on air
+
+    def media_playlist(self, rendition=None):
+        """HLSPlaylist of the main output, or of a lower ABR rendition by name"""
+        if rendition is None:
+            return self.hls_playlist
+        for r in self.renditions:
+            if r.name == rendition:
+                return r.playlist
+        return None
+
+    def settings(self):
+        return channel_settings(get_config(), self.id)
+
+    def start(self):
+        os.makedirs(self.hls_dir, exist_ok=True)
+        if os.path.exists(self.fifo_path):
+            os.remove(self.fifo_path)
+        os.mkfifo(self.fifo_path)
+        start_ffmpeg(self)
+        start_hls(self)
+        start_timeshift(self)
+        write_fallback(self)
+        self.orchestrator = Orchestrator(self)
+        threading.Thread(target=self.orchestrator.run, daemon=True).start()
+
+    def stop(self):
+        if self.orchestrator is not None:
+            self.orchestrator.stop()
+        if self.supervisor is not None:
+            self.supervisor.shutdown()
+        if self.ts_buffer is not None:
+            self.ts_buffer.close()
+        for rendition in self.renditions:
+            rendition.ring.close()
+        self.playing_files = set()
+        if os.path.exists(self.fifo_path):
+            os.remove(self.fifo_path)
+        shutil.rmtree(self.hls_dir, ignore_errors=True)
+        shutil.rmtree(self.timeshift_dir, ignore_errors=True)
+
+    def stats(self):
+        return {
+            "source": self.current_source,
+            "encoder_level": self.encoder_level,
+            "processes": self.supervisor.stats() if self.supervisor else None,
+            "orchestrator": self.orchestrator.stats() if self.orchestrator else None,
+            "playout": self.playout.stats() if self.playout else None,
+            "renditions": [r.stats() for r in self.renditions],
+            "timeshift": self.timeshift.stats() if self.timeshift else None,
+        }
+
+
+def sync_channels():
+    """Start pipelines for newly configured channels and stop removed ones."""
+    with _lock:
+        wanted = [c["id"] for c in configured_channels(get_config())]
+        for channel_id in list(state.channels):
+            if channel_id not in wanted:
+                print(f"⏹️ Stopping channel {channel_id}")
+                state.channels.pop(channel_id).stop()
+        started = []
+        for channel_id in wanted:
+            if channel_id in state.channels:
+                continue
+            print(f"▶️ Starting channel {channel_id}")
+            channel = Channel(channel_id)
+            state.channels[channel_id] = channel
+            channel.start()
+            started.append(channel)
+        for channel in started:
+            wait_for_playlist(channel)
+
+
+def primary_channel():
+    return state.channels.get(PRIMARY_CHANNEL)
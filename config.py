@@ -2,10 +2,181 @@ import os
 
 BASE_DIR = os.path.join(os.getcwd(), "tmp")
 HLS_DIR = os.path.join(BASE_DIR, "hls")
-PIPE_PATH = os.path.join(BASE_DIR, "input.ts")
+TIMESHIFT_DIR = os.environ.get("TIMESHIFT_DIR", os.path.join(BASE_DIR, "timeshift"))
+PIPE_DIR = os.path.join(BASE_DIR, "pipes")  # one encoder input FIFO per channel
 YOUTUBE_DIR = os.path.join(BASE_DIR, "youtube")
+TRANSCODE_DIR = os.path.join(BASE_DIR, "youtube_ts")
 FFMPEG_LOG = os.path.join(BASE_DIR, "ffmpeg.log")
 CONFIG_FILE = os.path.join(BASE_DIR, "config.json")
+VIDEO_INDEX = os.path.join(BASE_DIR, "video_index.sqlite3")
 
-CHECK_INTERVAL = 15
+CHECK_INTERVAL = 15  # poll interval while live or recently changed
+CHECK_INTERVAL_FAST = 3  # while confirming a change / near expected go-live
+CHECK_INTERVAL_MAX = 60  # ceiling of the backoff while stably offline
+SWITCH_CONFIRMATIONS = 2  # consistent observations needed before switching
+OFFLINE_FAST_WINDOW = 300  # seconds of fast polling after going offline
+SCHEDULE_WINDOW = 600  # seconds around an expected go-live time to poll fast
+TWITCH_PROBE_TIMEOUT = 5  # seconds for the GQL liveness request
+TWITCH_URL_TTL = 300  # seconds a resolved Twitch playlist URL is reused
+CONFIG_RELOAD_INTERVAL = 1.0  # seconds between config.json mtime checks
+
+# HTTP serving: "dev" is Flask's built-in server, "async" serves media
+# natively from an asyncio loop and runs the rest of the app in a
+# bounded WSGI thread pool, on the same port
+SERVER_MODE = os.environ.get("SERVER_MODE", "dev")
+SERVER_PORT = 3000
+BASE_URL = os.environ.get("BASE_URL")  # e.g. http://tv.lan:3000; else from the request / LAN IP
+BASE_URL_PROBE_TTL = 300  # seconds the probed LAN IP is reused
+BASE_URL_CACHE_SIZE = 8  # request-derived base URLs whose playlist/guide state is kept
+SERVER_WSGI_THREADS = 8
+SERVER_KEEPALIVE_TIMEOUT = 15  # seconds an idle keep-alive connection is kept
+SERVER_CLIENT_BUFFER = 2 * 1024 * 1024  # unsent bytes per client before it is paused
+SERVER_MAX_BODY = 32 * 1024 * 1024  # request bodies (logo/cookie uploads)
+
+# Output encoder profile: the single source of truth for encode settings.
+# Writers either stream-copy into the encoder or, when their output
+# already matches this profile, bypass it entirely (passthrough).
+# The H.264 encoder and its level are picked at startup by encoders.py.
+OUTPUT_VIDEO_CODEC = "libx264"  # used when probing is off or finds nothing faster
+OUTPUT_VIDEO_QUALITY = 20  # CRF (or the encoder's equivalent) for pre-transcodes
+OUTPUT_AUDIO_CODEC = "aac"
+OUTPUT_AUDIO_BITRATE = "192k"
+# codec names (as reported by ffprobe) that the profile above produces
+OUTPUT_CODEC_NAMES = {"video": "h264", "audio": "aac"}
+
+# H.264 encoders in order of preference; each lists its presets from
+# best quality to fastest. Levels step through the presets at the
+# source resolution, then scale down with the fastest preset.
+ENCODER_PREFERENCE = ["h264_nvenc", "h264_qsv", "h264_videotoolbox", "libx264"]
+ENCODERS = {
+    "libx264": {
+        "presets": ["veryfast", "superfast", "ultrafast"],
+        "args": ["-tune", "zerolatency"],
+        "no_scenecut": ["-sc_threshold", "0"],
+        "quality": "-crf",
+        "pix_fmt": "yuv420p",
+    },
+    "h264_nvenc": {
+        "presets": ["p4", "p2", "p1"],
+        "args": ["-tune", "ll", "-zerolatency", "1"],
+        "no_scenecut": ["-no-scenecut", "1"],
+        "quality": "-cq",
+        "pix_fmt": "yuv420p",
+    },
+    "h264_qsv": {
+        "presets": ["faster", "veryfast"],
+        "args": ["-look_ahead", "0"],
+        "no_scenecut": [],  # only inserts keyframes where asked
+        "quality": "-global_quality",
+        "pix_fmt": "nv12",
+    },
+    "h264_videotoolbox": {
+        "presets": [None],
+        "args": ["-realtime", "1"],
+        "no_scenecut": [],
+        "quality": "-q:v",
+        "pix_fmt": "yuv420p",
+    },
+}
+OUTPUT_HEIGHTS = [720, 540]  # scaled-down steps below the source resolution
+ENCODER_PROBE = True  # speed-test encoders at startup instead of using the default
+ENCODER_TEST_SOURCE = "testsrc2=size=1920x1080:rate=30"  # a typical Twitch source
+ENCODER_TEST_SECONDS = 3
+ENCODER_SPEED_MARGIN = 1.5  # speed a level must reach in the test to be picked
+ENCODER_MIN_SPEED = 1.0  # below this, with the FIFO backing up, step down
+ENCODER_SPEED_WINDOW = 10  # seconds of -progress reports averaged for that check
+ENCODER_BACKLOG_FRACTION = 0.25  # share of that window writers spent blocked on the FIFO
+
+# Process supervisor (encoder + writers)
+SUPERVISOR_INTERVAL = 0.5
+SUPERVISOR_BACKOFF_MIN = 1
+SUPERVISOR_BACKOFF_MAX = 30
+SUPERVISOR_STABLE_AFTER = 30  # seconds of uptime that reset the backoff
+CPU_SAMPLE_INTERVAL = 5  # seconds between per-mode CPU samples
+FFMPEG_LOG_MAX_BYTES = 10 * 1024 * 1024  # ffmpeg.log is rotated at this size
+FFMPEG_LOG_BACKUPS = 3  # rotated copies kept (ffmpeg.log.1 ...)
+FFMPEG_TAIL_LINES = 200  # recent stderr lines kept in memory per process
+FFMPEG_PROGRESS_HISTORY = 120  # recent -progress reports kept per process
+ENCODER_PIN_CPUS = True  # give each channel's encoder its own slice of cores
+ENCODER_THREADS = 0  # 0 = one thread per core in the channel's slice
+SWITCH_TIMEOUT = 20  # seconds a new writer gets to produce its first keyframe
+SWITCH_STAGE_BYTES = 4 * 1024 * 1024  # staged output of a writer waiting to go on air
+FIFO_WRITE_TIMEOUT = 2  # seconds a write may wait on a full FIFO before the data is dropped
+
+# In-memory MPEG-TS fan-out for /stream.ts
+TS_BUFFER_BYTES = 16 * 1024 * 1024  # ~16s of history at 8 Mbit/s
+TS_READ_SIZE = 188 * 348  # ~64 KiB per read from the encoder
+
+# Latency profiles: keyframe interval, HLS segmenting and mux buffering
+# tuned together. Sources are paced once, by the writer reading them
+# (live sources pace themselves); the output encoder is never paced.
+LATENCY_PROFILE = os.environ.get("LATENCY_PROFILE", "low")
+LATENCY_PROFILES = {
+    "standard": {
+        # seconds between keyframes at any frame rate; divides hls_segment_time
+        "keyframe_interval": 2,
+        "hls_segment_time": 4,  # seconds, cut at the first keyframe after this
+        "hls_list_size": 6,  # segments listed in stream.m3u8
+        "muxrate": "8000k",  # constant mux rate (null padding) for IPTV, or None
+        "mux_delay": 0.7,  # seconds of demux/decode buffering announced in the TS
+        "live_start_segments": 3,  # segments behind the live edge a Twitch read starts
+        "analyzeduration": 5_000_000,  # microseconds spent probing encoder/Twitch input
+    },
+    "low": {
+        "keyframe_interval": 1,
+        "hls_segment_time": 1,
+        "hls_list_size": 8,
+        "muxrate": None,
+        "mux_delay": 0.1,
+        "live_start_segments": 1,
+        "analyzeduration": 1_000_000,
+    },
+}
+
+# Rolling HLS output cut from the same ring
+HLS_ENABLED = True
+HLS_DELETE_DELAY = 2  # expired segments kept on disk for late fetches
+
+# Adaptive bitrate ladder (/master.m3u8): the output encoder decodes once
+# and splits into scaled renditions, each cut into its own HLS window on
+# a shared keyframe grid. The first rung is the channel's main output
+# (stream.ts / stream.m3u8). Needs HLS_ENABLED; every source then goes
+# through the encoder, as passthrough would starve the lower rungs.
+# Each rung is a 16:9 box of its height that the picture is fitted into.
+ABR_ENABLED = os.environ.get("ABR_ENABLED", "0") == "1"
+ABR_LADDER = [
+    {"name": "1080p", "height": 1080, "maxrate": "6000k", "audio_bitrate": "192k"},
+    {"name": "720p", "height": 720, "maxrate": "3000k", "audio_bitrate": "128k"},
+    {"name": "480p", "height": 480, "maxrate": "1200k", "audio_bitrate": "96k"},
+]
+ABR_RING_BYTES = 4 * 1024 * 1024  # TS ring of each lower rung, read only by its segmenter
+ABR_CUT_EARLY = 0.2  # seconds before the keyframe grid a segmenter may cut
+
+# Time-shift buffer (/timeshift.m3u8): the last TIMESHIFT_MINUTES of each
+# channel on disk, in a fixed set of preallocated slot files reused in turn
+TIMESHIFT_ENABLED = os.environ.get("TIMESHIFT_ENABLED", "0") == "1"
+TIMESHIFT_MINUTES = int(os.environ.get("TIMESHIFT_MINUTES", "30"))
+TIMESHIFT_SEGMENT_TIME = 6  # seconds, cut at the first keyframe after this
+TIMESHIFT_SLOT_BYTES = 8 * 1024 * 1024  # preallocated per slot, ~6s at 10 Mbit/s
+TIMESHIFT_SPARE_SLOTS = 2  # unlisted slots kept intact for late fetches
 YOUTUBE_REFRESH = 3600  # refresh every hour
+PLAYOUT_QUEUE_SIZE = 5  # filler items planned ahead per channel
+PLAYOUT_NO_REPEAT = 3600  # seconds before a filler video may play again (if others are available)
+PLAYOUT_MAX_FAILURES = 3  # filler items in a row that fail to play before the filler ends
+
+# XMLTV guide (/guide.xml)
+EPG_LOOKAHEAD = 6 * 3600  # seconds of programmes listed ahead of now
+EPG_MAX_AGE = 900  # seconds before an unchanged guide is re-rendered anyway
+EPG_DEFAULT_DURATION = 600  # seconds assumed for a video with no known duration
+EPG_LIVE_ASSUMED = 3600  # seconds a live Twitch stream is listed ahead of now
+TRANSCODE_WORKERS = 1  # background pre-transcodes running at once
+# pre-transcodes run niced in the background, so they use a fixed level of
+# OUTPUT_VIDEO_CODEC (0 = its best preset at source size) instead of the
+# probed real-time one; that also keeps their cache key stable
+TRANSCODE_LEVEL = 0
+YOUTUBE_DOWNLOAD_WORKERS = 4  # channels fetched in parallel
+YOUTUBE_CHANNEL_BURST = 2  # requests a channel may make back to back
+YOUTUBE_HOST_RATE = 1.0  # requests per second per host, across all channels
+YOUTUBE_HOST_BURST = 4
+YOUTUBE_CACHE_MAX_BYTES = 20 * 1024**3  # disk quota for downloaded videos
+YOUTUBE_CACHE_MAX_AGE = 14 * 24 * 3600  # unpinned videos older than this are evicted
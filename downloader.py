@@ -0,0 +1,111 @@
+import queue
+import threading
+import time
+from urllib.parse import urlparse
+import config
+import state
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._last) * self.rate
+                )
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_host_buckets = {}
+_host_lock = threading.Lock()
+
+
+def _host_bucket(host):
+    # shared across refreshes so back-to-back refreshes can't double the rate
+    with _host_lock:
+        if host not in _host_buckets:
+            _host_buckets[host] = TokenBucket(
+                config.YOUTUBE_HOST_RATE, config.YOUTUBE_HOST_BURST
+            )
+        return _host_buckets[host]
+
+
+class RateLimiter:
+    """Per-host and per-channel token buckets for yt-dlp requests."""
+
+    def __init__(self, channel_interval=10):
+        self.channel_rate = 1 / channel_interval if channel_interval else float("inf")
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def _channel_bucket(self, channel):
+        with self._lock:
+            if channel not in self._channels:
+                self._channels[channel] = TokenBucket(
+                    self.channel_rate, config.YOUTUBE_CHANNEL_BURST
+                )
+            return self._channels[channel]
+
+    def acquire(self, url, channel):
+        self._channel_bucket(channel).acquire()
+        _host_bucket(urlparse(url).hostname or "").acquire()
+
+
+def _publish(event):
+    """Push a progress event, dropping the oldest one if nobody is reading."""
+    while True:
+        try:
+            state.download_progress.put_nowait(event)
+            return
+        except queue.Full:
+            try:
+                state.download_progress.get_nowait()
+            except queue.Empty:
+                pass
+
+
+def progress_hook(channel):
+    """Return a yt-dlp progress hook that reports to the shared progress queue."""
+
+    def hook(d):
+        info = d.get("info_dict") or {}
+        event = {
+            "channel": channel,
+            "video_id": info.get("id"),
+            "status": d.get("status"),
+            "downloaded_bytes": d.get("downloaded_bytes"),
+            "total_bytes": d.get("total_bytes") or d.get("total_bytes_estimate"),
+            "speed": d.get("speed"),
+            "eta": d.get("eta"),
+            "time": time.time(),
+        }
+        if event["video_id"]:
+            if event["status"] == "downloading":
+                state.download_status[event["video_id"]] = event
+            else:
+                # finished or failed: only downloads in flight are kept
+                state.download_status.pop(event["video_id"], None)
+        if event["status"] == "finished":
+            totals = state.download_totals
+            totals["files"] += 1
+            totals["bytes"] += event["total_bytes"] or event["downloaded_bytes"] or 0
+            totals["seconds"] += d.get("elapsed") or 0.0
+        _publish(event)
+
+    return hook
@@ -0,0 +1,171 @@
+import re
+import subprocess
+import time
+import config
+
+_ENCODER_LINE = re.compile(r"^\s*V\S*\s+(\S+)")
+CPU_FEATURES = ("sse4_2", "avx", "avx2", "avx512f", "neon", "asimd")
+
+
+def available_encoders():
+    """Names of the H.264 encoders compiled into the local ffmpeg"""
+    try:
+        out = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            capture_output=True, text=True, timeout=15,
+        ).stdout
+    except (subprocess.SubprocessError, OSError) as e:
+        print(f"⚠️ Could not list ffmpeg encoders: {e}")
+        return []
+    names = []
+    for line in out.splitlines():
+        m = _ENCODER_LINE.match(line)
+        if m and m.group(1) in config.ENCODERS:
+            names.append(m.group(1))
+    return names
+
+
+def cpu_features():
+    """SIMD flags from /proc/cpuinfo that matter to software encoding"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            text = f.read()
+    except OSError:
+        return []
+    flags = set()
+    for line in text.splitlines():
+        key, _, value = line.partition(":")
+        if key.strip() in ("flags", "Features"):
+            flags.update(value.split())
+    return [f for f in CPU_FEATURES if f in flags]
+
+
+def levels_for(encoder):
+    """(preset, height) steps from best quality to cheapest; height None keeps the source size"""
+    presets = config.ENCODERS[encoder]["presets"]
+    return [(p, None) for p in presets] + [(presets[-1], h) for h in config.OUTPUT_HEIGHTS]
+
+
+def video_args(encoder, level, crf=None, threads=None, scale=True):
+    """Video encode args for one encoder at one level (scale=False leaves
+    sizing to the caller's filter graph)"""
+    spec = config.ENCODERS[encoder]
+    preset, height = levels_for(encoder)[level]
+    args = ["-c:v", encoder]
+    if preset is not None:
+        args += ["-preset", preset]
+    args += [*spec["args"], "-pix_fmt", spec["pix_fmt"]]
+    if height is not None and scale:
+        args += ["-vf", f"scale=-2:{height}"]
+    if threads:
+        args += ["-threads", str(threads)]
+    if crf is not None:
+        args += [spec["quality"], str(crf)]
+    return args
+
+
+class EncoderProfile:
+    """The H.264 encoder and settings this machine can run in real time.
+
+    probe() lists the encoders of the ffmpeg build and, in order of
+    preference, encodes a few seconds of a test pattern at each level
+    until one beats ENCODER_SPEED_MARGIN. Every encoding stage takes its
+    video args from here. A channel's output encoder starts at the
+    chosen level and is stepped down, one level at a time, when it can't
+    keep up at run time.
+    """
+
+    def __init__(self):
+        self.encoder = config.OUTPUT_VIDEO_CODEC
+        self.level = 0
+        self.encoders = []
+        self.cpu_features = []
+        self.tests = []  # speed test results, in the order they ran
+        self.probed_at = None
+
+    @property
+    def levels(self):
+        return levels_for(self.encoder)
+
+    def video_args(self, level=None, crf=None, scale=True):
+        """Video encode args at level (default: the probed one)"""
+        level = self.level if level is None else level
+        return video_args(self.encoder, level, crf=crf, scale=scale)
+
+    def height(self, level=None):
+        """Output height the level scales to, or None for the source size"""
+        return self.levels[self.level if level is None else level][1]
+
+    def step_down(self, level):
+        """The next cheaper level after level, or None at the bottom"""
+        level = self.level if level is None else level
+        return level + 1 if level + 1 < len(self.levels) else None
+
+    def describe(self, level=None):
+        preset, height = self.levels[self.level if level is None else level]
+        size = f"{height}p" if height else "source size"
+        return f"{self.encoder} {preset or 'default'} @ {size}"
+
+    @staticmethod
+    def _speed_test(encoder, level, threads):
+        """Encode the test pattern at a level; returns speed (x real time) or None."""
+        cmd = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin",
+            "-f", "lavfi", "-i", config.ENCODER_TEST_SOURCE,
+            "-t", str(config.ENCODER_TEST_SECONDS),
+            *video_args(encoder, level, threads=threads),
+            "-f", "null", "-",
+        ]
+        start = time.monotonic()
+        try:
+            result = subprocess.run(
+                cmd, capture_output=True, timeout=config.ENCODER_TEST_SECONDS * 10
+            )
+        except (subprocess.SubprocessError, OSError):
+            return None
+        if result.returncode != 0:
+            return None  # listed but unusable here, e.g. no GPU
+        return config.ENCODER_TEST_SECONDS / (time.monotonic() - start)
+
+    def probe(self, threads=None):
+        """Pick the encoder and level; threads is one channel's share of the cores."""
+        self.cpu_features = cpu_features()
+        self.encoders = available_encoders()
+        self.tests = []
+        candidates = [e for e in config.ENCODER_PREFERENCE if e in self.encoders]
+        best = None  # (speed, encoder, level) of the fastest run that was still real time
+        for encoder in candidates:
+            for level in range(len(levels_for(encoder))):
+                speed = self._speed_test(encoder, level, threads)
+                self.tests.append(
+                    {
+                        "encoder": encoder,
+                        "level": level,
+                        "speed": round(speed, 2) if speed is not None else None,
+                    }
+                )
+                if speed is None:
+                    break  # the encoder doesn't work at all
+                if speed >= config.ENCODER_SPEED_MARGIN:
+                    self.encoder, self.level = encoder, level
+                    self.probed_at = time.time()
+                    return
+                if speed >= 1.0 and (best is None or speed > best[0]):
+                    best = (speed, encoder, level)
+        if best is not None:
+            _, self.encoder, self.level = best
+        elif any(t["speed"] is not None for t in self.tests):
+            # nothing kept up: the cheapest software level is the best bet
+            self.encoder = config.OUTPUT_VIDEO_CODEC
+            self.level = len(self.levels) - 1
+        self.probed_at = time.time()
+
+    def stats(self):
+        return {
+            "encoder": self.encoder,
+            "level": self.level,
+            "settings": self.describe(),
+            "available": self.encoders,
+            "cpu_features": self.cpu_features,
+            "tests": self.tests,
+        }
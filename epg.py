@@ -0,0 +1,168 @@
+import calendar
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from xml.sax.saxutils import escape, quoteattr
+import config
+import state
+from utils import get_config
+from channels import configured_channels
+
+
+def _xmltv_time(t):
+    return time.strftime("%Y%m%d%H%M%S +0000", time.gmtime(t))
+
+
+def _programme(channel_id, start, stop, title, desc=None, category=None):
+    lines = [
+        f"  <programme start={quoteattr(_xmltv_time(start))} "
+        f"stop={quoteattr(_xmltv_time(stop))} channel={quoteattr(channel_id)}>",
+        f"    <title>{escape(title)}</title>",
+    ]
+    if desc:
+        lines.append(f"    <desc>{escape(desc)}</desc>")
+    if category:
+        lines.append(f"    <category>{escape(category)}</category>")
+    lines.append("  </programme>")
+    return "\n".join(lines)
+
+
+def _name(ch):
+    return ch.get("channel_name") or ch["id"]
+
+
+def _filler_programmes(ch, running, now, end):
+    """The planned playout queue, then one generic block to the end of the window."""
+    out = []
+    t = now
+    current, upcoming = running.playout.schedule() if running.playout else (None, [])
+    items = []
+    if current is not None:
+        items.append((current["started"], current))
+    items += [(None, info) for _, info in upcoming]
+    for started, info in items:
+        start = started if started is not None else t
+        stop = start + (info["duration"] or config.EPG_DEFAULT_DURATION)
+        if stop <= now:
+            continue  # ran over its listed duration; the next item follows
+        if start >= end:
+            break
+        desc = f"From {info['channel']}" if info.get("channel") else None
+        out.append(_programme(ch["id"], start, stop, info["title"], desc))
+        t = stop
+    if t < end:
+        out.append(_programme(ch["id"], t, end, f"{_name(ch)} filler"))
+    return out
+
+
+def _channel_programmes(ch, now, end):
+    running = state.channels.get(ch["id"])
+    source = running.current_source if running else None
+    probe = state.twitch_probe
+    if source == "twitch":
+        info = (probe.stream_info.get(ch["twitch_channel"]) if probe else None) or {}
+        started = now
+        if info.get("started_at"):
+            try:
+                started = calendar.timegm(
+                    time.strptime(info["started_at"], "%Y-%m-%dT%H:%M:%SZ")
+                )
+            except ValueError:
+                pass
+        live_end = min(now + config.EPG_LIVE_ASSUMED, end)
+        out = [
+            _programme(
+                ch["id"],
+                started,
+                live_end,
+                info.get("title") or f"{_name(ch)} Live",
+                f"Live on Twitch: {ch['twitch_channel']}",
+                info.get("category"),
+            )
+        ]
+        if live_end < end:
+            out.append(_programme(ch["id"], live_end, end, f"{_name(ch)} filler"))
+        return out
+    if source == "youtube":
+        return _filler_programmes(ch, running, now, end)
+    return [_programme(ch["id"], now, end, f"{_name(ch)} (off air)")]
+
+
+class Guide:
+    """The XMLTV guide, re-rendered only when something in it can have changed.
+
+    The cache key covers the config, each channel's source, its playout
+    queue version and the live Twitch title/category, plus a coarse time
+    bucket so the look-ahead window keeps moving. Requests in between get
+    the same bytes and ETag. One guide is kept per base URL (custom logos
+    are served by us), for the BASE_URL_CACHE_SIZE most recently used.
+    """
+
+    def __init__(self):
+        self.renders = 0
+        self._cache = OrderedDict()  # base url -> (key, cfg, body, etag)
+        self._lock = threading.Lock()
+
+    def _current_key(self, cfg):
+        probe = state.twitch_probe
+        parts = []
+        for ch in configured_channels(cfg):
+            running = state.channels.get(ch["id"])
+            live = probe.stream_info.get(ch["twitch_channel"]) if probe else None
+            parts.append(
+                (
+                    ch["id"],
+                    running.current_source if running else None,
+                    running.playout.version if running and running.playout else None,
+                    (live.get("title"), live.get("category")) if live else None,
+                )
+            )
+        return (tuple(parts), int(time.time() // config.EPG_MAX_AGE))
+
+    def _render(self, cfg, base_url):
+        now = time.time()
+        end = now + config.EPG_LOOKAHEAD
+        channels, programmes = [], []
+        for ch in configured_channels(cfg):
+            # tvg-id in playlist.m3u is the channel id
+            logo_url = ch.get("channel_logo") or ""
+            if ch.get("custom_logo"):
+                logo_url = base_url + logo_url
+            channels.append(
+                f"  <channel id={quoteattr(ch['id'])}>\n"
+                f"    <display-name>{escape(_name(ch))}</display-name>\n"
+                f"    <icon src={quoteattr(logo_url)}/>\n"
+                f"  </channel>"
+            )
+            programmes += _channel_programmes(ch, now, end)
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<tv generator-info-name="twitch-jellyfin">\n'
+            + "\n".join(channels + programmes)
+            + "\n</tv>\n"
+        ).encode()
+
+    def get(self, base_url):
+        """Return (body bytes, etag) of the guide as seen from base_url."""
+        cfg = get_config()
+        key = self._current_key(cfg)
+        with self._lock:
+            cached = self._cache.get(base_url)
+            if cached is None or key != cached[0] or cfg is not cached[1]:
+                body = self._render(cfg, base_url)
+                cached = (key, cfg, body, hashlib.sha1(body).hexdigest()[:16])
+                self.renders += 1
+            self._cache[base_url] = cached
+            self._cache.move_to_end(base_url)
+            while len(self._cache) > config.BASE_URL_CACHE_SIZE:
+                self._cache.popitem(last=False)
+            return cached[2], cached[3]
+
+
+_guide = Guide()
+
+
+def render_guide(base_url):
+    """Cached XMLTV bytes and ETag for /guide.xml"""
+    return _guide.get(base_url)
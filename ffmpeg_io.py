@@ -0,0 +1,134 @@
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from collections import deque
+import config
+
+# one size-capped, rotated log shared by every ffmpeg child; each line is
+# prefixed with the process name
+_log = logging.getLogger("ffmpeg")
+_log.propagate = False
+_log.setLevel(logging.INFO)
+_handler = None
+_handler_lock = threading.Lock()
+
+
+def _logger():
+    global _handler
+    with _handler_lock:
+        if _handler is None:
+            _handler = logging.handlers.RotatingFileHandler(
+                config.FFMPEG_LOG,
+                maxBytes=config.FFMPEG_LOG_MAX_BYTES,
+                backupCount=config.FFMPEG_LOG_BACKUPS,
+                delay=True,
+            )
+            _handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            _log.addHandler(_handler)
+    return _log
+
+
+def _number(value, suffix=""):
+    """Parse an ffmpeg progress value such as '1.02x' or '2411.3kbits/s'."""
+    value = value.strip()
+    if suffix and value.endswith(suffix):
+        value = value[: -len(suffix)]
+    try:
+        return float(value)
+    except ValueError:
+        return None  # "N/A" before the first frame
+
+
+def parse_progress(block):
+    """Turn one ffmpeg -progress block (key=value lines) into stats."""
+    out_time_us = _number(block.get("out_time_us", ""))
+    return {
+        "frame": int(_number(block.get("frame", "")) or 0),
+        "fps": _number(block.get("fps", "")),
+        "speed": _number(block.get("speed", ""), "x"),
+        "bitrate_kbps": _number(block.get("bitrate", ""), "kbits/s"),
+        "total_size": int(_number(block.get("total_size", "")) or 0),
+        "out_time": out_time_us / 1e6 if out_time_us is not None else None,
+        "drop_frames": int(_number(block.get("drop_frames", "")) or 0),
+        "dup_frames": int(_number(block.get("dup_frames", "")) or 0),
+        "at": time.time(),
+    }
+
+
+class ProcessOutput:
+    """Background readers for one ffmpeg child.
+
+    stderr is read line by line into a bounded tail and the rotating
+    ffmpeg log; -progress reports arrive on a separate pipe and are
+    parsed into the latest stats plus a short history. Nothing is held
+    open once the child exits.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.tail = deque(maxlen=config.FFMPEG_TAIL_LINES)
+        self.history = deque(maxlen=config.FFMPEG_PROGRESS_HISTORY)
+        self.progress = None
+        self._progress_r = None
+        self._progress_w = None
+
+    def command(self, cmd):
+        """Return cmd with progress reporting on a pipe, and the fds to pass."""
+        self._progress_r, self._progress_w = os.pipe()
+        cmd = [cmd[0], "-nostats", "-progress", f"pipe:{self._progress_w}", *cmd[1:]]
+        return cmd, (self._progress_w,)
+
+    def start(self, proc):
+        """Attach the readers to a just-started child (stderr must be a PIPE)."""
+        if self._progress_w is not None:
+            os.close(self._progress_w)  # only the child writes
+            self._progress_w = None
+            threading.Thread(
+                target=self._read_progress, args=(self._progress_r,), daemon=True
+            ).start()
+        threading.Thread(target=self._read_stderr, args=(proc.stderr,), daemon=True).start()
+
+    def abandon(self):
+        """Close the progress pipe if the child never started."""
+        for fd in (self._progress_r, self._progress_w):
+            if fd is not None:
+                os.close(fd)
+        self._progress_r = self._progress_w = None
+
+    def _read_stderr(self, pipe):
+        log = _logger()
+        with pipe:
+            for raw in pipe:
+                line = raw.decode("utf-8", "replace").rstrip()
+                if line:
+                    self.tail.append(line)
+                    log.info("[%s] %s", self.name, line)
+
+    def _read_progress(self, fd):
+        block = {}
+        with os.fdopen(fd, "r", errors="replace") as f:
+            for line in f:
+                key, _, value = line.strip().partition("=")
+                block[key] = value
+                if key == "progress":
+                    self.progress = parse_progress(block)
+                    self.history.append(self.progress)
+                    block = {}
+
+    def stats(self, lines=5):
+        return {"progress": self.progress, "stderr_tail": list(self.tail)[-lines:]}
+
+
+def reset_log():
+    """Remove the ffmpeg log and its rotated copies (at startup)."""
+    with _handler_lock:
+        if _handler is not None:
+            _handler.close()
+    paths = [config.FFMPEG_LOG] + [
+        f"{config.FFMPEG_LOG}.{i}" for i in range(1, config.FFMPEG_LOG_BACKUPS + 1)
+    ]
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,149 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+import config
+from profiles import latency_profile
+
+PCR_WRAP = 1 << 33
+
+
+class HLSPlaylist:
+    """Rolling window of HLS segments with a pre-rendered media playlist.
+
+    The playlist text is rebuilt only when a segment is added, so serving
+    /stream.m3u8 is a plain read no matter how many clients poll it.
+    """
+
+    def __init__(self, directory, list_size=None, target_duration=None):
+        self.directory = directory
+        _, profile = latency_profile()
+        self.list_size = list_size or profile["hls_list_size"]
+        self.target_duration = target_duration or profile["hls_segment_time"]
+        self.segments = deque()  # (sequence, filename, duration, discontinuity)
+        self.media_sequence = 0
+        self.discontinuity_sequence = 0
+        self.ready = threading.Event()
+        self._expired = deque()
+        self._next_seq = 0
+        self._added_at = None
+        self._lock = threading.Lock()
+        self._rendered = self._render()
+
+    def open_segment(self, index):
+        """Return (filename, file) for the segmenter's next segment."""
+        filename = f"seg_{index}.ts"
+        return filename, open(os.path.join(self.directory, filename), "wb")
+
+    def add_segment(self, filename, duration, discontinuity=False):
+        """Append a finished segment, expire old ones and re-render."""
+        with self._lock:
+            self.segments.append((self._next_seq, filename, duration, discontinuity))
+            self._next_seq += 1
+            self._added_at = time.monotonic()
+            self.target_duration = max(self.target_duration, math.ceil(duration))
+            while len(self.segments) > self.list_size:
+                _, old, _, disc = self.segments.popleft()
+                self.media_sequence += 1
+                if disc:
+                    self.discontinuity_sequence += 1
+                self._expired.append(old)
+            # keep a couple of expired segments on disk for clients that
+            # fetched the previous playlist just before it rolled over
+            while len(self._expired) > config.HLS_DELETE_DELAY:
+                self.remove_file(self._expired.popleft())
+            self._rendered = self._render()
+        self.ready.set()
+
+    def edge_delay(self, behind=3):
+        """Seconds behind live of a player starting behind segments from the
+        end (the usual default): those segments plus the one being cut."""
+        with self._lock:
+            if len(self.segments) < behind:
+                return None
+            listed = sum(d for _, _, d, _ in list(self.segments)[-behind:])
+            return listed + time.monotonic() - self._added_at
+
+    def remove_file(self, filename):
+        try:
+            os.remove(os.path.join(self.directory, filename))
+        except OSError:
+            pass
+
+    def _render(self):
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}",
+            f"#EXT-X-MEDIA-SEQUENCE:{self.media_sequence}",
+        ]
+        if self.discontinuity_sequence:
+            lines.append(f"#EXT-X-DISCONTINUITY-SEQUENCE:{self.discontinuity_sequence}")
+        for _, filename, duration, discontinuity in self.segments:
+            if discontinuity:
+                lines.append("#EXT-X-DISCONTINUITY")
+            lines.append(f"#EXTINF:{duration:.3f},")
+            lines.append(filename)
+        return ("\n".join(lines) + "\n").encode()
+
+    def render(self):
+        """Return the cached playlist bytes."""
+        return self._rendered
+
+
+class HLSSegmenter:
+    """Cut the shared TS ring into segments at keyframe boundaries.
+
+    Segments are opened with playlist.open_segment() and handed back with
+    add_segment() once complete, so the same cutter feeds both the rolling
+    HLS window and the time-shift buffer.
+    """
+
+    def __init__(self, ring, playlist, segment_time=None):
+        self.ring = ring
+        self.playlist = playlist
+        self.segment_time = segment_time or latency_profile()[1]["hls_segment_time"]
+        self._index = 0
+        self._file = None
+        self._name = None
+        self._start_pcr = None
+        self._discontinuity = False
+
+    def _open(self, pcr, header, discontinuity):
+        """Start a new segment with a fresh PAT/PMT so it decodes on its own."""
+        self._name, self._file = self.playlist.open_segment(self._index)
+        self._index += 1
+        self._file.write(header)
+        self._start_pcr = pcr
+        self._discontinuity = discontinuity
+
+    def _close(self, pcr):
+        self._file.close()
+        duration = ((pcr - self._start_pcr) % PCR_WRAP) / 90000
+        self.playlist.add_segment(self._name, duration, self._discontinuity)
+        self._file = None
+
+    def run(self):
+        for data, syncs, jumped in self.ring.chunks():
+            pos = 0
+            if jumped and self._file is not None:
+                # lost our place in the ring: drop the partial segment
+                self._file.close()
+                self.playlist.remove_file(self._name)
+                self._file = None
+            for off, pcr, header in syncs:
+                if pcr is None:
+                    continue
+                if self._file is None:
+                    self._open(pcr, header, jumped and self._index > 0)
+                    pos = off
+                    continue
+                if ((pcr - self._start_pcr) % PCR_WRAP) / 90000 < self.segment_time:
+                    continue
+                self._file.write(data[pos:off])
+                self._close(pcr)
+                self._open(pcr, header, False)
+                pos = off
+            if self._file is not None:
+                self._file.write(data[pos:])
@@ -0,0 +1,80 @@
+import itertools
+import queue
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+MAX_HISTORY = 50
+
+
+class JobQueue:
+    """Single background worker for download, refresh and clear jobs.
+
+    Jobs run one at a time, so a refresh can never race a cache clear.
+    A job submitted with a key that is already queued or running is not
+    added again; the caller gets the existing job instead.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict()  # id -> job dict, oldest first
+        self._active = {}  # dedup key -> job id
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, key=None):
+        """Queue fn(*args) and return its job, or the running duplicate."""
+        key = key or kind
+        with self._lock:
+            if key in self._active:
+                return self._jobs[self._active[key]]
+            job = {
+                "id": next(self._ids),
+                "kind": kind,
+                "key": key,
+                "status": "queued",
+                "created": time.time(),
+                "started": None,
+                "finished": None,
+                "error": None,
+                "result": None,
+            }
+            self._jobs[job["id"]] = job
+            self._active[key] = job["id"]
+            while len(self._jobs) > MAX_HISTORY:
+                oldest = next(iter(self._jobs))
+                if self._jobs[oldest]["status"] in ("queued", "running"):
+                    break
+                self._jobs.popitem(last=False)
+        self._queue.put((job, fn, args))
+        print(f"📋 Job {job['id']} queued: {key}")
+        return job
+
+    def run(self):
+        """Worker loop; run in a daemon thread."""
+        while True:
+            job, fn, args = self._queue.get()
+            job["status"] = "running"
+            job["started"] = time.time()
+            try:
+                job["result"] = fn(*args)
+                job["status"] = "done"
+            except Exception as e:
+                job["status"] = "failed"
+                job["error"] = str(e)
+                traceback.print_exc()
+            finally:
+                job["finished"] = time.time()
+                with self._lock:
+                    self._active.pop(job["key"], None)
+            print(f"📋 Job {job['id']} {job['status']}: {job['key']}")
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self):
+        with self._lock:
+            return [dict(j) for j in reversed(self._jobs.values())]
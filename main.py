@@ -1,21 +1,45 @@
+import os
 import threading
 import config
+import state
 from server import app
-from utils import cleanup, wait_for_playlist
-from streaming import start_ffmpeg, write_fallback, orchestrator
+from utils import cleanup, playing_files, get_config
+from channels import sync_channels, configured_channels
+from encoders import EncoderProfile
+from twitch import TwitchProbe
 from youtube import refresh_youtube_cache
+from transcode_cache import TranscodeCache
+from video_index import VideoIndex
+from video_cache import VideoCache
+from jobs import JobQueue
+from async_server import serve
 
 if __name__ == "__main__":
     cleanup()
-    start_ffmpeg()
-    write_fallback()
-    wait_for_playlist()
-    
-    threading.Thread(target=orchestrator, daemon=True).start()
+    state.transcode_cache = TranscodeCache(
+        config.TRANSCODE_DIR, in_use=playing_files
+    )
+    state.video_index = VideoIndex(config.VIDEO_INDEX)
+    state.video_cache = VideoCache(config.YOUTUBE_DIR)
+    state.jobs = JobQueue()
+    threading.Thread(target=state.jobs.run, daemon=True).start()
+    state.twitch_probe = TwitchProbe()
+    state.encoder_profile = EncoderProfile()
+    if config.ENCODER_PROBE:
+        # test with one channel's share of the cores, as each encoder gets
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        per_channel = max(1, (cores or 1) // max(1, len(configured_channels(get_config()))))
+        print("🧪 Probing encoders...")
+        state.encoder_profile.probe(threads=config.ENCODER_THREADS or per_channel)
+        print(f"🎛️ Output encoder: {state.encoder_profile.describe()}")
+    sync_channels()
     threading.Thread(target=refresh_youtube_cache, daemon=True).start()
 
-    print("🚀 Server running at http://localhost:3000")
-    print("📺 Open http://localhost:3000/stream.m3u8 in VLC or Jellyfin")
+    print(f"🚀 Server running at http://localhost:{config.SERVER_PORT}")
+    print(f"📺 Add http://localhost:{config.SERVER_PORT}/playlist.m3u to Jellyfin (one entry per channel)")
     print("📝 FFmpeg logs →", config.FFMPEG_LOG)
-    
-    app.run(host="0.0.0.0", port=3000)
+
+    if config.SERVER_MODE == "async":
+        serve(app, host="0.0.0.0", port=config.SERVER_PORT)
+    else:
+        app.run(host="0.0.0.0", port=config.SERVER_PORT, threaded=True)
@@ -0,0 +1,147 @@
+import state
+
+PREFIX = "twitch_jellyfin"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels.items():
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class _Exposition:
+    """Collects metric families and renders the Prometheus text format."""
+
+    def __init__(self):
+        self.lines = []
+
+    def add(self, name, kind, help_text, samples):
+        """samples: (labels dict, value) pairs; None values are skipped."""
+        samples = [(labels, value) for labels, value in samples if value is not None]
+        if not samples:
+            return
+        name = f"{PREFIX}_{name}"
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            value = value if isinstance(value, int) else float(value)
+            self.lines.append(f"{name}{_labels(labels)} {value}")
+
+    def render(self):
+        return "\n".join(self.lines) + "\n"
+
+
+def _channel_metrics(out, channels):
+    encoder = []
+    fifo, clients, sent, ring = [], [], [], []
+    switches, switch_seconds = [], []
+    for cid, ch in channels:
+        sup = ch.supervisor
+        if sup is not None:
+            progress = sup.encoder.progress if sup.encoder else None
+            if progress:
+                encoder.append((cid, progress))
+            fifo.append(({"channel": cid}, sup.fifo_bytes))
+            for (source, ok), (count, seconds) in list(sup.switch_totals.items()):
+                labels = {"channel": cid, "source": source, "ok": str(ok).lower()}
+                switches.append((labels, count))
+                switch_seconds.append((labels, seconds))
+        if ch.ts_buffer is not None:
+            clients.append(({"channel": cid}, ch.ts_buffer.clients))
+            sent.append(({"channel": cid}, ch.ts_buffer.bytes_sent))
+            ring.append(({"channel": cid}, ch.ts_buffer.total_bytes))
+
+    out.add(
+        "encoder_fps", "gauge", "Frames per second reported by the encoder.",
+        [({"channel": c}, p["fps"]) for c, p in encoder],
+    )
+    out.add(
+        "encoder_speed", "gauge", "Encoder speed relative to real time.",
+        [({"channel": c}, p["speed"]) for c, p in encoder],
+    )
+    out.add(
+        "encoder_bitrate_kbps", "gauge", "Output bitrate reported by the encoder.",
+        [({"channel": c}, p["bitrate_kbps"]) for c, p in encoder],
+    )
+    out.add(
+        "encoder_dropped_frames_total", "counter", "Frames dropped by the current encoder.",
+        [({"channel": c}, p["drop_frames"]) for c, p in encoder],
+    )
+    out.add("fifo_bytes_total", "counter", "Bytes written into the encoder FIFO.", fifo)
+    out.add("ring_bytes_total", "counter", "Bytes produced into the TS ring.", ring)
+    out.add("stream_clients", "gauge", "Connected live TS clients.", clients)
+    out.add("stream_bytes_sent_total", "counter", "Bytes handed to live TS clients.", sent)
+    out.add("source_switches_total", "counter", "Source switches by target source.", switches)
+    out.add(
+        "source_switch_seconds_total", "counter",
+        "Summed time to first frame of source switches.", switch_seconds,
+    )
+
+
+def render_metrics():
+    """Build the /metrics page from counters the pipeline already keeps.
+
+    Everything here is read at scrape time; nothing is computed on the
+    streaming path.
+    """
+    out = _Exposition()
+    channels = list(state.channels.items())
+    out.add(
+        "channels", "gauge", "Configured channels with a running pipeline.",
+        [({}, len(channels))],
+    )
+    out.add(
+        "channel_source", "gauge", "1 for the source each channel is playing.",
+        [
+            ({"channel": cid, "source": ch.current_source}, 1)
+            for cid, ch in channels
+            if ch.current_source
+        ],
+    )
+    _channel_metrics(out, channels)
+
+    probe = state.twitch_probe
+    if probe is not None:
+        out.add(
+            "twitch_probe_seconds", "gauge", "Latency of the last Twitch liveness check.",
+            [({}, probe.last_latency)],
+        )
+        out.add(
+            "twitch_probes_total", "counter", "Twitch liveness checks made.",
+            [({}, probe.probes)],
+        )
+        out.add(
+            "twitch_probe_seconds_total", "counter", "Summed Twitch liveness check latency.",
+            [({}, probe.probe_seconds)],
+        )
+
+    totals = state.download_totals
+    out.add(
+        "youtube_downloads_total", "counter", "Finished YouTube downloads (files).",
+        [({}, totals["files"])],
+    )
+    out.add(
+        "youtube_download_bytes_total", "counter", "Bytes of finished YouTube downloads.",
+        [({}, totals["bytes"])],
+    )
+    out.add(
+        "youtube_download_seconds_total", "counter", "Time spent on finished YouTube downloads.",
+        [({}, totals["seconds"])],
+    )
+
+    if state.video_cache is not None:
+        cache = state.video_cache.stats()
+        out.add("video_cache_bytes", "gauge", "Bytes of downloaded videos on disk.", [({}, cache["bytes"])])
+        out.add("video_cache_max_bytes", "gauge", "Disk quota for downloaded videos.", [({}, cache["max_bytes"])])
+        out.add("video_cache_hits_total", "counter", "Video cache hits.", [({}, cache["hits"])])
+        out.add("video_cache_misses_total", "counter", "Video cache misses.", [({}, cache["misses"])])
+        out.add("video_cache_evictions_total", "counter", "Videos evicted from the cache.", [({}, cache["evictions"])])
+    if state.transcode_cache is not None:
+        transcode = state.transcode_cache.stats()
+        out.add("transcode_ready", "gauge", "Pre-transcoded videos ready for playout.", [({}, transcode["ready"])])
+        out.add("transcode_pending", "gauge", "Videos waiting to be transcoded.", [({}, transcode["pending"])])
+    return out.render()
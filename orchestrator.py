@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime
+import config
+import state
+from streaming import graceful_switch
+from playout import filler_pool
+
+
+class Orchestrator:
+    """State machine choosing one channel's source: Twitch, YouTube filler or fallback.
+
+    A change in Twitch liveness must be seen SWITCH_CONFIRMATIONS times in
+    a row before the source switches, so a flapping stream doesn't churn
+    the pipeline. Polling speeds up while a change is being confirmed,
+    right after the channel goes offline and around expected go-live
+    times, and backs off while the channel stays offline. The loop also
+    wakes early when poke() is called (e.g. the channel was changed).
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.wake = threading.Event()
+        self.stopped = False
+        self.login = None  # Twitch channel currently followed
+        self.live = None  # confirmed liveness
+        self.pending = None  # observed value waiting for confirmation
+        self.pending_count = 0
+        self.pending_since = None
+        self.offline_since = None
+        self.offline_checks = 0
+        self.interval = config.CHECK_INTERVAL
+        self.go_live_times = deque(maxlen=7)  # (hour, minute) of recent go-lives
+        self.transitions = deque(maxlen=100)
+
+    def poke(self):
+        """Re-evaluate now instead of waiting for the next poll."""
+        self.wake.set()
+
+    def stop(self):
+        self.stopped = True
+        self.wake.set()
+
+    def _expected_soon(self, now, settings):
+        """True within SCHEDULE_WINDOW of a configured or learned go-live time."""
+        times = list(self.go_live_times)
+        for hhmm in settings.get("twitch_schedule", []):
+            try:
+                h, m = hhmm.split(":")
+                times.append((int(h), int(m)))
+            except ValueError:
+                continue
+        local = datetime.fromtimestamp(now)
+        minute_of_day = local.hour * 60 + local.minute
+        for h, m in times:
+            delta = abs(minute_of_day - (h * 60 + m))
+            if min(delta, 1440 - delta) * 60 <= config.SCHEDULE_WINDOW:
+                return True
+        return False
+
+    def _next_interval(self, now, settings):
+        if self.pending is not None:
+            return config.CHECK_INTERVAL_FAST
+        if self.live:
+            return config.CHECK_INTERVAL
+        if self.offline_since and now - self.offline_since < config.OFFLINE_FAST_WINDOW:
+            return config.CHECK_INTERVAL_FAST
+        if self._expected_soon(now, settings):
+            return config.CHECK_INTERVAL_FAST
+        # stably offline: back off exponentially up to the ceiling
+        return min(
+            config.CHECK_INTERVAL * 2 ** max(self.offline_checks // 4, 0),
+            config.CHECK_INTERVAL_MAX,
+        )
+
+    def _observe(self, live, now):
+        """Feed one observation; return True once a liveness change is confirmed."""
+        if self.live is None:
+            self.live = live  # first observation after start needs no confirmation
+            return True
+        if live == self.live:
+            self.pending, self.pending_count, self.pending_since = None, 0, None
+            return False
+        if self.pending != live:
+            self.pending, self.pending_count, self.pending_since = live, 0, now
+        self.pending_count += 1
+        if self.pending_count < config.SWITCH_CONFIRMATIONS:
+            return False
+        self.live = live
+        return True
+
+    def _desired_source(self):
+        if self.live:
+            return "twitch"
+        return "youtube" if filler_pool() else "fallback"
+
+    def _switch(self, source, now, detected_at):
+        prev = self.channel.current_source
+        supervisor = self.channel.supervisor
+        switches = supervisor.switches if supervisor else ()
+        # the deque is bounded, so a new entry shows as a new last item
+        last = switches[-1] if switches else None
+        start = time.time()
+        ok = graceful_switch(self.channel, source, login=self.login)
+        latest = switches[-1] if switches else None
+        self.transitions.append(
+            {
+                "from": prev,
+                "to": source,
+                "ok": ok,
+                "at": start,
+                "detection_latency": round(start - detected_at, 2),
+                "switch_duration": round(time.time() - start, 2),
+                # only if this switch got as far as starting a writer
+                "time_to_first_frame": latest["time_to_first_frame"]
+                if latest is not None and latest is not last
+                else None,
+            }
+        )
+
+    def tick(self):
+        now = time.time()
+        settings = self.channel.settings()
+        if settings is None:
+            return  # channel removed; the registry stops us
+        login = settings["twitch_channel"]
+        if login != self.login:
+            self.login = login
+            self.live = None
+            self.pending, self.pending_count, self.pending_since = None, 0, None
+        live = state.twitch_probe.is_live(login)
+        detected_at = self.pending_since or now
+        was_live = self.live
+        if self._observe(live, now):
+            if live:
+                if was_live is False:  # a go-live seen at startup tells us nothing
+                    local = datetime.fromtimestamp(now)
+                    self.go_live_times.append((local.hour, local.minute))
+                self.offline_since, self.offline_checks = None, 0
+            else:
+                # only a real live -> offline event warrants fast polling
+                self.offline_since = now if was_live else None
+                self.offline_checks = 0
+            self.pending, self.pending_count, self.pending_since = None, 0, None
+        elif not self.live:
+            self.offline_checks += 1
+
+        source = self._desired_source()
+        supervisor = self.channel.supervisor
+        # a writer that ended on purpose (the filler ran out) is replaced
+        # even if the same source is wanted again
+        if source != self.channel.current_source or (supervisor and supervisor.writer_ended):
+            self._switch(source, now, detected_at)
+        self.interval = self._next_interval(time.time(), settings)
+
+    def run(self):
+        while not self.stopped:
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"⚠️ [{self.channel.id}] Orchestrator tick failed: {e}")
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+    def stats(self):
+        return {
+            "twitch_channel": self.login,
+            "live": self.live,
+            "pending": self.pending,
+            "pending_count": self.pending_count,
+            "interval": self.interval,
+            "transitions": list(self.transitions)[-10:],
+        }
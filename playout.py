@@ -0,0 +1,295 @@
+import os
+import random
+import subprocess
+import threading
+import time
+from collections import deque
+import config
+import state
+from utils import get_config
+from profiles import (
+    output_video_args,
+    output_audio_args,
+    output_mux_args,
+    probe_codecs,
+    matches_output_profile,
+)
+from tsbuffer import TSSplicer
+
+
+def _video_id(path):
+    return os.path.basename(path).split(".")[0]
+
+
+def item_info(source):
+    """Title, duration (seconds, or None) and origin of a cached video"""
+    entry = state.video_index.get(_video_id(source)) if state.video_index else None
+    if entry is None:
+        return {"title": os.path.basename(source), "duration": None, "channel": None, "url": None}
+    return {
+        "title": entry["title"] or _video_id(source),
+        "duration": entry["duration"],
+        "channel": entry["channel"],
+        "url": entry["url"],
+    }
+
+
+# both keyed by (path, mtime), so a replaced file is looked at afresh
+_codecs = {}  # probe_codecs() of a downloaded file
+_unplayable = set()  # files that failed to open or produced no output
+_files_lock = threading.Lock()
+
+
+def _file_key(path):
+    try:
+        return path, os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def filler_pool():
+    """[(source, path to play)] for every cached video that is on disk and playable.
+
+    Re-read for each queued item: a video plays from its pre-transcode
+    once one is ready for the current settings, and from the download
+    until then, so finished transcodes join without a writer restart.
+    """
+    cfg = get_config()
+    cache = state.transcode_cache if cfg.get("youtube_transcode", True) else None
+    pool, present = [], set()
+    for source in list(state.youtube_cache):
+        path = (cache.lookup(source, cfg) if cache is not None else None) or source
+        key = _file_key(path)
+        if key is None:
+            continue
+        present.add(key)
+        if key not in _unplayable:
+            pool.append((source, path))
+    with _files_lock:
+        # forget files that were evicted or replaced
+        _unplayable.intersection_update(present)
+        for key in [k for k in _codecs if k not in present]:
+            del _codecs[key]
+    return pool
+
+
+def _mark_unplayable(path):
+    key = _file_key(path)
+    if key is not None:  # a file that is gone drops out of the pool anyway
+        with _files_lock:
+            _unplayable.add(key)
+
+
+def _channel_ready(path):
+    """True if a downloaded file's codecs can go to clients as they are"""
+    key = _file_key(path)
+    with _files_lock:
+        codecs = _codecs.get(key)
+    if codecs is None:
+        codecs = probe_codecs(path)
+        if key is not None:
+            with _files_lock:
+                _codecs[key] = codecs
+    return matches_output_profile(codecs)
+
+
+def _encode_args(level):
+    """Output profile encode with the YouTube quality settings"""
+    cfg = get_config()
+    return [
+        *output_video_args(crf=cfg.get("youtube_crf", config.OUTPUT_VIDEO_QUALITY), level=level),
+        *output_audio_args(cfg.get("youtube_audio_bitrate", config.OUTPUT_AUDIO_BITRATE)),
+    ]
+
+
+class _Reader:
+    """Channel-ready TS bytes of one queued item.
+
+    A pre-transcoded .ts file is read as is. A download whose codecs
+    match the output profile is remuxed to MPEG-TS; anything else (e.g.
+    AV1 or VP9 in mp4) is encoded with the output profile as it plays.
+    """
+
+    def __init__(self, path, level=None):
+        self.path = path
+        self.proc = None
+        if path.endswith(".ts"):
+            self._file = open(path, "rb")
+        else:
+            codec_args = ["-c", "copy"] if _channel_ready(path) else _encode_args(level)
+            self.proc = subprocess.Popen(
+                [
+                    "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error",
+                    "-i", path,
+                    *codec_args,
+                    *output_mux_args(),
+                    "pipe:1",
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            self._file = self.proc.stdout
+
+    def read(self):
+        return self._file.read(config.TS_READ_SIZE)
+
+    def close(self):
+        self._file.close()
+        if self.proc is not None:
+            if self.proc.poll() is None:
+                self.proc.terminate()
+            self.proc.wait()
+
+
+class Playout:
+    """Rolling filler schedule for one channel, played gaplessly by one writer.
+
+    The writer is a long-running ffmpeg reading MPEG-TS on stdin; a feeder
+    thread streams queued items into it back to back through a TSSplicer,
+    so pacing and timestamps run on unbroken across items and the next
+    item is already in the writer's input while the current one ends.
+
+    The queue is topped up to PLAYOUT_QUEUE_SIZE from filler_pool() each
+    time an item starts, so newly cached videos join without restarting
+    the writer and removed ones drop out. An item that fails to open or
+    plays nothing is left out of the pool from then on. Once nothing is
+    left to play, or PLAYOUT_MAX_FAILURES items in a row failed, the
+    writer is finished: its stdin is closed, it exits without a restart
+    and the orchestrator moves the channel on. Videos played within
+    PLAYOUT_NO_REPEAT seconds are skipped while anything else is
+    available; unplayed videos go first.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.upcoming = deque()
+        self.current = None  # {"source", "path", "started", ...item_info}
+        self.last_played = {}  # source -> time it last started
+        self.history = deque(maxlen=20)
+        self.items_played = 0
+        self.version = 0  # bumped whenever the current item or the queue changes
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        before = list(self.upcoming)
+        pool = dict(filler_pool())
+        # drop queued items whose file is gone or no longer in the pool
+        self.upcoming = deque(
+            (s, p) for s, p in self.upcoming if pool.get(s) == p and os.path.exists(p)
+        )
+        now = time.time()
+        while len(self.upcoming) < config.PLAYOUT_QUEUE_SIZE:
+            queued = {s for s, _ in self.upcoming}
+            if self.current is not None:
+                queued.add(self.current["source"])
+            free = [s for s in pool if s not in queued]
+            if not free:
+                if self.upcoming or not pool:
+                    break
+                free = list(pool)  # a single video: repeat it
+            fresh = [
+                s for s in free
+                if now - self.last_played.get(s, 0) >= config.PLAYOUT_NO_REPEAT
+            ]
+            unplayed = [s for s in fresh if s not in self.last_played]
+            if unplayed:
+                source = random.choice(unplayed)
+            elif fresh:
+                source = random.choice(fresh)
+            else:
+                source = min(free, key=lambda s: self.last_played[s])
+            self.upcoming.append((source, pool[source]))
+        if list(self.upcoming) != before:
+            self.version += 1
+        self.channel.playing_files = {p for _, p in self.upcoming} | (
+            {self.current["path"]} if self.current else set()
+        )
+
+    def _next(self):
+        with self._lock:
+            self._refill()
+            if not self.upcoming:
+                return None
+            source, path = self.upcoming.popleft()
+            self.current = {
+                "source": source,
+                "path": path,
+                "started": time.time(),
+                **item_info(source),
+            }
+            self.last_played[source] = self.current["started"]
+            self.history.append(self.current)
+            self.items_played += 1
+            self.version += 1
+            self._refill()
+            return self.current
+
+    def feed(self, proc, finish):
+        """Start streaming the queue into a just-started writer's stdin."""
+        threading.Thread(target=self._feed, args=(proc, finish), daemon=True).start()
+
+    def _end(self, finish, reason):
+        """Let the writer exit for good and have the orchestrator move on."""
+        print(f"⚠️ [{self.channel.id}] {reason}; ending filler")
+        finish()
+        if self.channel.orchestrator is not None:
+            self.channel.orchestrator.poke()
+
+    def _feed(self, proc, finish):
+        splicer = TSSplicer()
+        reader = None
+        failures = 0  # items in a row that played nothing
+        try:
+            with proc.stdin:
+                while proc.poll() is None:
+                    item = self._next()
+                    if item is None:
+                        self._end(finish, "Nothing left to play")
+                        break
+                    played = False
+                    try:
+                        reader = _Reader(item["path"], self.channel.encoder_level)
+                    except OSError as e:
+                        print(f"⚠️ [{self.channel.id}] Skipping {item['path']}: {e}")
+                    else:
+                        print(f"📼 [{self.channel.id}] Now playing: {item['title']}")
+                        splicer.splice()
+                        while True:
+                            data = reader.read()
+                            if not data:
+                                break
+                            played = True
+                            proc.stdin.write(splicer.process(data))
+                        reader.close()
+                        reader = None
+                    if played:
+                        failures = 0
+                        continue
+                    _mark_unplayable(item["path"])
+                    failures += 1
+                    if failures >= config.PLAYOUT_MAX_FAILURES:
+                        self._end(finish, f"{failures} items in a row failed to play")
+                        break
+        except (BrokenPipeError, ValueError):
+            pass  # the writer was stopped or replaced
+        finally:
+            if reader is not None:
+                reader.close()
+
+    def schedule(self):
+        """The current item and [(source, item_info)] of the items queued after it"""
+        with self._lock:
+            current = dict(self.current) if self.current else None
+            return current, [(s, item_info(s)) for s, _ in self.upcoming]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "now_playing": {k: v for k, v in self.current.items() if k != "path"}
+                if self.current
+                else None,
+                "upcoming": [
+                    {"source": s, **item_info(s)} for s, _ in list(self.upcoming)
+                ],
+                "items_played": self.items_played,
+            }
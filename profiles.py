@@ -0,0 +1,209 @@
+import hashlib
+import json
+import subprocess
+import config
+import state
+from encoders import EncoderProfile, video_args
+
+# used until (or unless) main probes the machine
+_default_encoder = EncoderProfile()
+
+
+def latency_profile():
+    """Name and settings of the selected latency profile (unknown names get standard)"""
+    name = config.LATENCY_PROFILE
+    if name not in config.LATENCY_PROFILES:
+        name = "standard"
+    return name, config.LATENCY_PROFILES[name]
+
+
+def latency_stats():
+    """The active latency profile and the delays measured on each channel, for /status.
+
+    ts_join is how far behind the newest output a /stream.ts client
+    joining now starts (it starts at the newest keyframe); hls_edge is
+    how far behind a player starting at the usual three segments from
+    the end of stream.m3u8 is.
+    """
+    name, profile = latency_profile()
+    measured = {}
+    for cid, ch in list(state.channels.items()):
+        ts_join = ch.ts_buffer.join_delay() if ch.ts_buffer else None
+        hls_edge = ch.hls_playlist.edge_delay() if ch.hls_playlist else None
+        measured[cid] = {
+            "ts_join": round(ts_join, 2) if ts_join is not None else None,
+            "hls_edge": round(hls_edge, 2) if hls_edge is not None else None,
+        }
+    return {"profile": name, **profile, "measured": measured}
+
+
+def pacing_args():
+    """Read a file or generated source at real time. Only writers pace; the
+    encoder behind them reads a FIFO that is already paced."""
+    return ["-re"]
+
+
+def live_input_args(url):
+    """Input options for a live source, which paces itself and must not be slowed down"""
+    _, profile = latency_profile()
+    args = ["-fflags", "+nobuffer", "-analyzeduration", str(profile["analyzeduration"])]
+    if ".m3u8" in url:
+        # start near the live edge instead of the default 3 segments back
+        args += ["-live_start_index", str(-profile["live_start_segments"])]
+    return args
+
+
+def encoder_profile():
+    """The probed EncoderProfile, or the unprobed default"""
+    return state.encoder_profile or _default_encoder
+
+
+def output_video_args(crf=None, level=None):
+    """Video encode args of the output profile, shared by every encoding stage.
+
+    level overrides the probed encoder level (a channel's output encoder
+    steps down from it when it falls behind).
+    """
+    return [
+        *encoder_profile().video_args(level=level, crf=crf),
+        *keyframe_args(),
+    ]
+
+
+def keyframe_args():
+    """Keyframes every keyframe_interval seconds of output, whatever the frame rate"""
+    interval = latency_profile()[1]["keyframe_interval"]
+    return ["-force_key_frames", f"expr:gte(t,n_forced*{interval})"]
+
+
+def offline_video_args(crf=None):
+    """Video encode args of background pre-transcodes: a fixed level, not the probed one"""
+    return [
+        *video_args(config.OUTPUT_VIDEO_CODEC, config.TRANSCODE_LEVEL, crf=crf),
+        *keyframe_args(),
+    ]
+
+
+def output_audio_args(bitrate=None):
+    return ["-c:a", config.OUTPUT_AUDIO_CODEC, "-b:a", bitrate or config.OUTPUT_AUDIO_BITRATE]
+
+
+def output_mux_args():
+    """MPEG-TS options for anything that feeds the ring directly"""
+    _, profile = latency_profile()
+    return [
+        "-f", "mpegts",
+        "-mpegts_flags", "resend_headers",
+        "-pat_period", "0.5",     # send PAT/PMT tables every 0.5s
+        "-pcr_period", "20",      # PCR interval (ms)
+        "-muxdelay", str(profile["mux_delay"]),
+        "-muxpreload", str(profile["mux_delay"]),
+    ]
+
+
+def encoder_input_args():
+    """Input options of the output encoder reading its channel FIFO"""
+    _, profile = latency_profile()
+    return ["-fflags", "+nobuffer", "-analyzeduration", str(profile["analyzeduration"])]
+
+
+def encoder_mux_args():
+    """Extra mux options of the output encoder only"""
+    _, profile = latency_profile()
+    return ["-muxrate", profile["muxrate"]] if profile["muxrate"] else []
+
+
+def probe_codecs(url):
+    """Return {"video": name, "audio": name} for the first streams of url"""
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-show_entries", "stream=codec_type,codec_name",
+        "-of", "json",
+        url,
+    ]
+    try:
+        out = subprocess.run(cmd, capture_output=True, timeout=15, check=True).stdout
+        streams = json.loads(out).get("streams", [])
+    except (subprocess.SubprocessError, OSError, ValueError) as e:
+        print(f"⚠️ ffprobe failed: {e}")
+        return {}
+    codecs = {}
+    for st in streams:
+        codecs.setdefault(st.get("codec_type"), st.get("codec_name"))
+    return codecs
+
+
+def matches_output_profile(codecs):
+    """True if a source can be stream-copied straight to clients"""
+    return all(codecs.get(k) == v for k, v in config.OUTPUT_CODEC_NAMES.items())
+
+
+def profile_fingerprint(extra=()):
+    """Short stable hash of the pre-transcode profile plus any extra settings"""
+    parts = [
+        *offline_video_args(),
+        latency_profile()[1]["keyframe_interval"],
+        config.OUTPUT_AUDIO_CODEC,
+        *extra,
+    ]
+    return hashlib.sha1(json.dumps(parts).encode()).hexdigest()[:10]
+
+
+def abr_enabled():
+    """True if channels encode the ABR ladder (it is served over HLS only)"""
+    return config.ABR_ENABLED and config.HLS_ENABLED
+
+
+def hls_cut_time():
+    """Seconds after which the HLS segmenters cut at the next keyframe.
+
+    In ABR mode every rung has keyframes forced on the same
+    keyframe_interval grid, which divides hls_segment_time; cutting a
+    little before it makes every segmenter cut at exactly those
+    keyframes, so segments line up across renditions.
+    """
+    segment_time = latency_profile()[1]["hls_segment_time"]
+    return segment_time - config.ABR_CUT_EARLY if abr_enabled() else segment_time
+
+
+def kbps(rate):
+    """Kilobits per second of an ffmpeg rate like 6000k"""
+    return int(str(rate).lower().rstrip("k"))
+
+
+def abr_filter_graph(sizes):
+    """Split the decoded video once and fit a copy into each rung's
+    (width, height) box, padded, as [abr0], [abr1], ..."""
+    splits = "".join(f"[s{i}]" for i in range(len(sizes)))
+    scales = [
+        f"[s{i}]scale={w}:{h}:force_original_aspect_ratio=decrease:force_divisible_by=2,"
+        f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1[abr{i}]"
+        for i, (w, h) in enumerate(sizes)
+    ]
+    return ";".join([f"[0:v]split={len(sizes)}{splits}", *scales])
+
+
+def abr_output_args(rung, level=None, top=False):
+    """Encode and mux args of one ladder output; the top rung is the main output"""
+    profile = encoder_profile()
+    args = [
+        *profile.video_args(level=level, scale=False),
+        "-profile:v", "high",  # as announced in the master playlist's CODECS
+        "-maxrate", rung["maxrate"],
+        "-bufsize", f"{2 * kbps(rung['maxrate'])}k",
+        # the same keyframe grid in every rung and nothing else, see hls_cut_time
+        *keyframe_args(),
+        *config.ENCODERS[profile.encoder]["no_scenecut"],
+        *output_audio_args(rung["audio_bitrate"]),
+        *output_mux_args(),
+    ]
+    return args + encoder_mux_args() if top else args
+
+
+def abr_bandwidth(rung, top=False):
+    """Peak bits per second of a rung, as announced in the master playlist"""
+    muxrate = latency_profile()[1]["muxrate"] if top else None
+    if muxrate:
+        return kbps(muxrate) * 1000
+    return (kbps(rung["maxrate"]) + kbps(rung["audio_bitrate"])) * 1000
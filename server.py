@@ -1,8 +1,13 @@
+import hashlib
 import os
-import time
 import socket
+import threading
+import time
+from collections import OrderedDict
 from flask import (
     Flask,
+    Response,
+    abort,
     send_from_directory,
     request,
     redirect,
@@ -12,15 +17,47 @@ from flask import (
 from werkzeug.utils import secure_filename
 import config
 import state
-from utils import load_config, save_config, get_twitch_user_info
-from youtube import fetch_youtube_videos
+from utils import get_config, update_config, get_twitch_user_info
+from youtube import refresh_youtube_once, download_channel, clear_youtube_cache
+from metrics import render_metrics
+from epg import render_guide
+from abr import render_master
+from profiles import latency_stats, encoder_profile
+from channels import (
+    PRIMARY_CHANNEL,
+    configured_channels,
+    channel_id_for,
+    primary_channel,
+    sync_channels,
+)
 
 app = Flask(__name__, template_folder="templates")
 app.config["UPLOAD_FOLDER"] = "static/logos"
 
 
+_local_ip = {"ip": None, "at": 0.0, "interfaces": None}
+_validators = OrderedDict()  # (route, base url or None) -> (etag, last modified), LRU
+_validators_lock = threading.Lock()
+_LOOPBACK_HOSTS = ("localhost", "127.0.0.1", "[::1]")
+
+
 def get_local_ip():
-    """Return LAN IP of this machine (not localhost)."""
+    """Return LAN IP of this machine (not localhost).
+
+    Probed once and kept until BASE_URL_PROBE_TTL passes or the set of
+    network interfaces changes (a VPN or adapter coming up).
+    """
+    try:
+        interfaces = socket.if_nameindex()
+    except OSError:
+        interfaces = None
+    now = time.monotonic()
+    if (
+        _local_ip["ip"] is not None
+        and interfaces == _local_ip["interfaces"]
+        and now - _local_ip["at"] < config.BASE_URL_PROBE_TTL
+    ):
+        return _local_ip["ip"]
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
         s.connect(("8.8.8.8", 80))  # doesn't actually send
@@ -29,40 +66,53 @@ def get_local_ip():
         ip = "127.0.0.1"
     finally:
         s.close()
+    _local_ip.update(ip=ip, at=now, interfaces=interfaces)
     return ip
 
-def fix_m3u8(path, base_url):
-    """Read an HLS playlist, rewrite with absolute URLs + Jellyfin-friendly tags."""
-    lines = []
-    with open(path, "r") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
 
-            # If it's a segment reference, make it absolute
-            if line.endswith(".ts") and not line.startswith("http"):
-                line = f"{base_url}/{line}"
-
-            lines.append(line)
-
-    # Ensure required tags
-    if not any(l.startswith("#EXT-X-PLAYLIST-TYPE") for l in lines):
-        lines.insert(3, "#EXT-X-PLAYLIST-TYPE:EVENT")  # after version/targetduration
-
-    # Fix target duration (round up to nearest int)
-    for l in lines:
-        if l.startswith("#EXTINF:"):
-            try:
-                dur = float(l.split(":")[1].split(",")[0])
-                target = int(dur + 0.999)  # ceil
-                break
-            except Exception:
-                target = 10
-    # Replace or insert targetduration
-    lines = [f"#EXT-X-TARGETDURATION:{target}" if l.startswith("#EXT-X-TARGETDURATION") else l for l in lines]
-
-    return "\n".join(lines) + "\n"
+def _configured_base_url():
+    configured = get_config().get("base_url") or config.BASE_URL
+    return configured.rstrip("/") if configured else None
+
+
+def base_url():
+    """Base URL for links handed to clients.
+
+    The configured base_url wins; otherwise the Host the request came in
+    on, so links match however the tuner reached us; a loopback Host is
+    swapped for the LAN IP so the links still work from other machines.
+    """
+    configured = _configured_base_url()
+    if configured:
+        return configured
+    host = request.host
+    name = host if host.endswith("]") else host.rsplit(":", 1)[0]
+    if name in _LOOPBACK_HOSTS:
+        port = host[len(name) + 1 :] or config.SERVER_PORT
+        host = f"{get_local_ip()}:{port}"
+    return f"{request.scheme}://{host}"
+
+
+def _conditional(name, base, body, mimetype, etag=None):
+    """Response with ETag/Last-Modified that answers revalidation with a 304.
+
+    Validators are kept per route, and per base URL only while that comes
+    from the request's Host; the least recently used ones are dropped.
+    """
+    etag = etag or hashlib.sha1(body).hexdigest()[:16]
+    key = (name, None if _configured_base_url() else base)
+    with _validators_lock:
+        previous = _validators.get(key)
+        modified = previous[1] if previous and previous[0] == etag else time.time()
+        _validators[key] = (etag, modified)
+        _validators.move_to_end(key)
+        while len(_validators) > 2 * config.BASE_URL_CACHE_SIZE:  # two routes per base
+            _validators.popitem(last=False)
+    resp = Response(body, mimetype=mimetype)
+    resp.set_etag(etag)
+    resp.last_modified = modified
+    resp.cache_control.no_cache = True  # always revalidate; unchanged bodies get a 304
+    return resp.make_conditional(request)
 
 
 # --- Static + HLS Routes ---
@@ -71,128 +121,277 @@ def static_files(filename):
     return send_from_directory("static", filename)
 
 
-@app.route("/<path:filename>")
-def hls_root(filename):
+def _channel(channel_id):
+    channel = state.channels.get(channel_id)
+    if channel is None:
+        abort(404)
+    return channel
+
+
+def _hls_file(channel, filename):
     if filename.endswith(".m3u8"):
         return send_from_directory(
-            config.HLS_DIR,
+            channel.hls_dir,
             filename,
             mimetype="application/vnd.apple.mpegurl",
         )
     elif filename.endswith(".ts"):
         return send_from_directory(
-            config.HLS_DIR,
+            channel.hls_dir,
             filename,
             mimetype="video/mp2t",
         )
-    return send_from_directory(config.HLS_DIR, filename)
+    return send_from_directory(channel.hls_dir, filename)
+
+
+def _stream_m3u8(channel, rendition=None):
+    """Serve the channel's pre-rendered rolling HLS playlist, or an ABR rendition's."""
+    playlist = channel.media_playlist(rendition)
+    if playlist is None:
+        return "HLS disabled", 404
+    return Response(
+        playlist.render(),
+        mimetype="application/vnd.apple.mpegurl",
+        headers={"Cache-Control": "no-cache"},
+    )
 
 
-@app.route("/stream.ts")
-def stream_ts():
-    return send_from_directory(
-        config.HLS_DIR,
-        "stream.ts",
+def _master_m3u8(channel):
+    """Serve the ABR master playlist over the channel's renditions."""
+    if not channel.renditions:
+        return "ABR disabled", 404
+    return Response(
+        render_master(channel),
+        mimetype="application/vnd.apple.mpegurl",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+def _timeshift_m3u8(channel):
+    """Serve the time-shift playlist; ?at=<unix time> or ?ago=<seconds> picks
+    where in the window playback starts."""
+    if channel.timeshift is None:
+        return "Time-shift disabled", 404
+    at = request.args.get("at", type=float)
+    ago = request.args.get("ago", type=float)
+    if ago is not None:
+        at = time.time() - ago
+    return Response(
+        channel.timeshift.render(at),
+        mimetype="application/vnd.apple.mpegurl",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+def _timeshift_segment(channel, filename):
+    opened = channel.timeshift.acquire(filename) if channel.timeshift else None
+    if opened is None:
+        abort(404)
+    f, size = opened
+    try:
+        with f:
+            data = f.read(size)
+    finally:
+        channel.timeshift.release(filename)
+    return Response(data, mimetype="video/mp2t")
+
+
+def _stream_ts(channel):
+    """Stream a live channel from its in-memory ring."""
+    if channel.ts_buffer is None:
+        return "Stream not started", 503
+    return Response(
+        channel.ts_buffer.follow(),
         mimetype="video/mp2t",
+        headers={"Cache-Control": "no-cache"},
     )
 
 
-@app.route("/playlist.m3u")
-def playlist():
-    cfg = load_config()
-    host_ip = get_local_ip()
-    base_url = f"http://{host_ip}:3000"
+@app.route("/channel/<channel_id>/stream.m3u8")
+def channel_m3u8(channel_id):
+    return _stream_m3u8(_channel(channel_id))
 
-    # Append ContentType hint so Jellyfin treats it as raw MPEG-TS
-    return f"""#EXTM3U
-#EXTINF:-1 tvg-id="twitch" tvg-name="{cfg['channel_name']}" group-title="Live",{cfg['channel_name']} Live
-{base_url}/stream.ts|ContentType=video/mp2t
-"""
 
+@app.route("/channel/<channel_id>/stream.ts")
+def channel_ts(channel_id):
+    return _stream_ts(_channel(channel_id))
 
-@app.route("/guide.xml")
-def guide():
-    cfg = load_config()
-    now = time.strftime("%Y%m%d%H%M%S")
-    host_ip = get_local_ip()
-    base_url = f"http://{host_ip}:3000"
 
-    logo_url = cfg.get("channel_logo", "")
-    if cfg.get("custom_logo"):
-        logo_url = base_url + logo_url
+@app.route("/channel/<channel_id>/master.m3u8")
+def channel_master_m3u8(channel_id):
+    return _master_m3u8(_channel(channel_id))
+
+
+@app.route("/channel/<channel_id>/<rendition>/stream.m3u8")
+def channel_rendition_m3u8(channel_id, rendition):
+    return _stream_m3u8(_channel(channel_id), rendition)
+
+
+@app.route("/channel/<channel_id>/timeshift.m3u8")
+def channel_timeshift_m3u8(channel_id):
+    return _timeshift_m3u8(_channel(channel_id))
+
 
-    # Match tvg-id from playlist.m3u
-    tvg_id = "twitch"
+@app.route("/channel/<channel_id>/timeshift/<filename>")
+def channel_timeshift_segment(channel_id, filename):
+    return _timeshift_segment(_channel(channel_id), filename)
+
+
+@app.route("/channel/<channel_id>/<path:filename>")
+def channel_hls(channel_id, filename):
+    return _hls_file(_channel(channel_id), filename)
+
+
+# the original single-channel URLs serve the primary channel
+@app.route("/<path:filename>")
+def hls_root(filename):
+    return _hls_file(_channel(PRIMARY_CHANNEL), filename)
+
+
+@app.route("/stream.m3u8")
+def stream_m3u8():
+    return _stream_m3u8(_channel(PRIMARY_CHANNEL))
+
+
+@app.route("/stream.ts")
+def stream_ts():
+    return _stream_ts(_channel(PRIMARY_CHANNEL))
 
-    return f"""<?xml version="1.0" encoding="UTF-8"?>
-<tv>
-  <channel id="{tvg_id}">
-    <display-name>{cfg['channel_name']}</display-name>
-    <icon src="{logo_url}"/>
-  </channel>
-  <programme start="{now}" channel="{tvg_id}">
-    <title>{state.current_source.title() if state.current_source else "Unknown"} Content</title>
-  </programme>
-</tv>"""
+
+@app.route("/master.m3u8")
+def master_m3u8():
+    return _master_m3u8(_channel(PRIMARY_CHANNEL))
+
+
+@app.route("/<rendition>/stream.m3u8")
+def rendition_m3u8(rendition):
+    return _stream_m3u8(_channel(PRIMARY_CHANNEL), rendition)
+
+
+@app.route("/timeshift.m3u8")
+def timeshift_m3u8():
+    return _timeshift_m3u8(_channel(PRIMARY_CHANNEL))
+
+
+@app.route("/timeshift/<filename>")
+def timeshift_segment(filename):
+    return _timeshift_segment(_channel(PRIMARY_CHANNEL), filename)
+
+
+@app.route("/playlist.m3u")
+def playlist():
+    cfg = get_config()
+    base = base_url()
+
+    lines = ["#EXTM3U"]
+    for ch in configured_channels(cfg):
+        # Append ContentType hint so Jellyfin treats it as raw MPEG-TS
+        lines.append(
+            f'#EXTINF:-1 tvg-id="{ch["id"]}" tvg-name="{ch["channel_name"]}" '
+            f'group-title="Live",{ch["channel_name"]} Live'
+        )
+        lines.append(f"{base}/channel/{ch['id']}/stream.ts|ContentType=video/mp2t")
+    body = ("\n".join(lines) + "\n").encode()
+    return _conditional("playlist", base, body, "audio/x-mpegurl")
+
+
+@app.route("/guide.xml")
+def guide():
+    base = base_url()
+    body, etag = render_guide(base)
+    return _conditional("guide", base, body, "application/xml", etag)
 
 
 @app.route("/revert_branding")
 def revert_branding():
-    cfg = load_config()
-    info = get_twitch_user_info(cfg["twitch_channel"])
+    info = get_twitch_user_info(get_config()["twitch_channel"])
     if info:
-        cfg["channel_name"] = info["display_name"]
-        cfg["channel_logo"] = info["profile_image_url"]
-        cfg["custom_logo"] = False
-        save_config(cfg)
+        update_config(lambda cfg: _apply_branding(cfg, info))
     return redirect("/")
 
 
+def _apply_branding(cfg, info):
+    cfg["channel_name"] = info["display_name"]
+    cfg["channel_logo"] = info["profile_image_url"]
+    cfg["custom_logo"] = False
+
+
 @app.route("/status")
 def status():
-    cfg = load_config()
-    return {"channel": cfg["twitch_channel"], "source": state.current_source}
+    return {
+        "channels": {cid: ch.stats() for cid, ch in list(state.channels.items())},
+        "twitch": state.twitch_probe.stats() if state.twitch_probe else None,
+        "latency": latency_stats(),
+        "encoder": encoder_profile().stats(),
+        "transcode": state.transcode_cache.stats() if state.transcode_cache else None,
+        "video_cache": state.video_cache.stats() if state.video_cache else None,
+        "downloads": [
+            e for e in list(state.download_status.values())
+            if e["status"] == "downloading"
+        ],
+    }
+
+
+@app.route("/metrics")
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/", methods=["GET", "POST"])
 def index():
-    cfg = load_config()
     if request.method == "POST":
-        # YouTube Channel Add
         new_yt_channel = request.form.get("yt_channel")
-        if new_yt_channel and new_yt_channel not in cfg["youtube_channels"]:
-            cfg["youtube_channels"].append(new_yt_channel)
-            save_config(cfg)
-
-        # Twitch Channel Change
         new_twitch_channel = request.form.get("twitch_channel")
-        if new_twitch_channel and new_twitch_channel != cfg["twitch_channel"]:
-            cfg["twitch_channel"] = new_twitch_channel
-            info = get_twitch_user_info(new_twitch_channel)
-            if info:
-                cfg["channel_name"] = info["display_name"]
-                cfg["channel_logo"] = info["profile_image_url"]
-                cfg["custom_logo"] = False
-            save_config(cfg)
-
-        # Channel Branding Change
         new_channel_name = request.form.get("channel_name")
-        if new_channel_name and new_channel_name != cfg["channel_name"]:
-            cfg["channel_name"] = new_channel_name
-            save_config(cfg)
 
-        # Logo Upload
+        # network and file work first, so the config update below stays short
+        info = None
+        if new_twitch_channel and new_twitch_channel != get_config()["twitch_channel"]:
+            info = get_twitch_user_info(new_twitch_channel)
+        logo_url = None
         if "channel_logo" in request.files:
             logo = request.files["channel_logo"]
             if logo.filename != "":
                 filename = secure_filename(logo.filename)
                 logo_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
                 logo.save(logo_path)
-                cfg["channel_logo"] = url_for(
-                    "static_files", filename=f"logos/{filename}"
-                )
+                logo_url = url_for("static_files", filename=f"logos/{filename}")
+
+        changed = set()
+
+        def apply(cfg):
+            changed.clear()
+            # YouTube Channel Add
+            if new_yt_channel and new_yt_channel not in cfg["youtube_channels"]:
+                cfg["youtube_channels"].append(new_yt_channel)
+                changed.add("youtube_channels")
+
+            # Twitch Channel Change
+            if new_twitch_channel and new_twitch_channel != cfg["twitch_channel"]:
+                cfg["twitch_channel"] = new_twitch_channel
+                if info:
+                    _apply_branding(cfg, info)
+                changed.add("twitch_channel")
+
+            # Channel Branding Change
+            if new_channel_name and new_channel_name != cfg["channel_name"]:
+                cfg["channel_name"] = new_channel_name
+
+            # Logo Upload
+            if logo_url:
+                cfg["channel_logo"] = logo_url
                 cfg["custom_logo"] = True
-                save_config(cfg)
+
+        update_config(apply)
+        if "youtube_channels" in changed:
+            state.jobs.submit(
+                "download", download_channel, new_yt_channel,
+                key=f"download:{new_yt_channel}",
+            )
+        if "twitch_channel" in changed:
+            primary = primary_channel()
+            if primary is not None and primary.orchestrator is not None:
+                primary.orchestrator.poke()
 
         # Cookie file upload
         if "cookies" in request.files:
@@ -204,6 +403,7 @@ def index():
 
         return redirect("/")
 
+    cfg = get_config()
     yt_list = ""
     for ch in cfg.get("youtube_channels", []):
         yt_list += f"""
@@ -231,11 +431,21 @@ def index():
     )
 
     logo_url = cfg.get("channel_logo", "")
+    primary = primary_channel()
+
+    channels = []
+    for ch in configured_channels(cfg):
+        running = state.channels.get(ch["id"])
+        channels.append(
+            dict(ch, source=running.current_source if running else None)
+        )
 
     return render_template(
         "index.html",
         cfg=cfg,
-        source=state.current_source,
+        source=primary.current_source if primary else None,
+        channels=channels,
+        primary_id=PRIMARY_CHANNEL,
         yt_list=yt_list,
         playlist_preview=playlist_preview,
         logo_url=logo_url,
@@ -244,41 +454,118 @@ def index():
 
 @app.route("/remove_channel/<channel>")
 def remove_channel(channel):
-    cfg = load_config()
-    if channel in cfg["youtube_channels"]:
-        cfg["youtube_channels"].remove(channel)
-        save_config(cfg)
+    removed = []
+
+    def apply(cfg):
+        removed.clear()
+        if channel in cfg["youtube_channels"]:
+            cfg["youtube_channels"].remove(channel)
+            removed.append(channel)
+
+    update_config(apply)
+    if removed:
         print(f"🗑️ Removed YouTube channel: {channel}")
     return redirect("/")
 
 
+@app.route("/add_channel", methods=["POST"])
+def add_channel():
+    """Add a Twitch channel as another Jellyfin channel with its own pipeline."""
+    login = request.form.get("twitch_channel", "").strip()
+    channel_id = channel_id_for(login)
+    if not channel_id or any(c["id"] == channel_id for c in configured_channels(get_config())):
+        return redirect("/")
+    info = get_twitch_user_info(login)
+    added = []
+
+    def apply(cfg):
+        added.clear()
+        if all(c["id"] != channel_id for c in configured_channels(cfg)):
+            cfg.setdefault("channels", []).append(
+                {
+                    "id": channel_id,
+                    "twitch_channel": login,
+                    "channel_name": info["display_name"] if info else login,
+                    "channel_logo": info["profile_image_url"] if info else None,
+                    "custom_logo": False,
+                }
+            )
+            added.append(channel_id)
+
+    update_config(apply)
+    if added:
+        print(f"➕ Added Twitch channel: {login}")
+        # starting a pipeline takes a few seconds; don't hold the request
+        threading.Thread(target=sync_channels, daemon=True).start()
+    return redirect("/")
+
+
+@app.route("/remove_twitch_channel/<channel_id>")
+def remove_twitch_channel(channel_id):
+    removed = []
+
+    def apply(cfg):
+        removed.clear()
+        kept = [c for c in cfg.get("channels", []) if c["id"] != channel_id]
+        if len(kept) != len(cfg.get("channels", [])):
+            cfg["channels"] = kept
+            removed.append(channel_id)
+
+    update_config(apply)
+    if removed:
+        print(f"🗑️ Removed Twitch channel: {channel_id}")
+        threading.Thread(target=sync_channels, daemon=True).start()
+    return redirect("/")
+
+
+def _job_response(job):
+    """JSON for API clients, back to the dashboard for form posts."""
+    if request.accept_mimetypes.best == "application/json":
+        return job, 202
+    return redirect("/")
+
+
 @app.route("/refresh_youtube", methods=["POST"])
 def refresh_youtube():
-    cfg = load_config()
-    state.youtube_cache, state.youtube_meta = fetch_youtube_videos(
-        cfg.get("youtube_channels", [])
-    )
-    print(f"🔄 Manual YouTube refresh: {len(state.youtube_cache)} videos")
-    return redirect("/")
+    # only one forced refresh is ever queued or running; repeats return the
+    # same job. Its own key keeps it from folding into a cache-first refresh.
+    job = state.jobs.submit("refresh", refresh_youtube_once, True, key="refresh:force")
+    return _job_response(job)
 
 
 @app.route("/clear_cache", methods=["POST"])
 def clear_cache():
-    for f in os.listdir(config.YOUTUBE_DIR):
-        try:
-            os.remove(os.path.join(config.YOUTUBE_DIR, f))
-        except Exception as e:
-            print("⚠️ Error deleting file:", f, e)
-    print("🗑️ YouTube cache cleared.")
-    return redirect("/")
+    job = state.jobs.submit("clear", clear_youtube_cache)
+    return _job_response(job)
+
+
+@app.route("/jobs")
+def jobs():
+    return {"jobs": state.jobs.list()}
+
+
+@app.route("/jobs/<int:job_id>")
+def job_status(job_id):
+    job = state.jobs.get(job_id)
+    if job is None:
+        return {"error": "unknown job"}, 404
+    return job
+
 
 @app.route("/update_transcode", methods=["POST"])
 def update_transcode():
-    cfg = load_config()
-    cfg["youtube_transcode"] = request.form.get("youtube_transcode") == "true"
-    cfg["youtube_crf"] = int(request.form.get("youtube_crf", 20))
-    cfg["youtube_audio_bitrate"] = request.form.get("youtube_audio_bitrate", "192k")
-    save_config(cfg)
+    settings = {
+        "youtube_transcode": request.form.get("youtube_transcode") == "true",
+        "twitch_passthrough": request.form.get("twitch_passthrough", "true") == "true",
+        "youtube_crf": int(request.form.get("youtube_crf", config.OUTPUT_VIDEO_QUALITY)),
+        "youtube_audio_bitrate": request.form.get(
+            "youtube_audio_bitrate", config.OUTPUT_AUDIO_BITRATE
+        ),
+    }
+    cfg = update_config(lambda c: c.update(settings))
+    if state.transcode_cache is not None:
+        # only entries whose settings key changed are re-encoded, in the background
+        state.transcode_cache.reconcile(state.youtube_cache, cfg)
     print(f"⚙️ Updated transcoding: {cfg}")
     return redirect("/")
 
@@ -1,4 +1,14 @@
-current_source = None
+import queue
+
 youtube_cache = []
 youtube_meta = []
-current_writer_proc = None
+transcode_cache = None
+video_index = None
+video_cache = None
+jobs = None
+twitch_probe = None
+encoder_profile = None  # encoders.EncoderProfile picked at startup
+channels = {}  # channel id -> channels.Channel, in config order
+download_progress = queue.Queue(maxsize=1000)  # yt-dlp progress events
+download_status = {}  # video id -> latest progress event, while downloading
+download_totals = {"files": 0, "bytes": 0, "seconds": 0.0}  # finished downloads
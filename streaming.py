@@ -1,222 +1,307 @@
-import subprocess
-import time
 import os
-from streamlink import Streamlink
+import threading
 import config
 import state
-from utils import stop_writer, load_config
-from youtube import build_youtube_playlist
+from utils import get_config
+from playout import Playout, filler_pool
+from tsbuffer import TSRingBuffer
+from hls import HLSPlaylist, HLSSegmenter
+from timeshift import TimeShiftBuffer
+from abr import Rendition, ladder_sizes
+from supervisor import Supervisor
+from profiles import (
+    latency_profile,
+    encoder_profile,
+    abr_enabled,
+    hls_cut_time,
+    abr_filter_graph,
+    abr_output_args,
+    pacing_args,
+    live_input_args,
+    encoder_input_args,
+    encoder_mux_args,
+    output_video_args,
+    output_audio_args,
+    output_mux_args,
+    probe_codecs,
+    matches_output_profile,
+)
 
 
-def start_ffmpeg():
-    """Start persistent FFmpeg writing MPEG-TS directly for Jellyfin"""
-    ffmpeg_cmd = [
+def _encoder_cpus(channel):
+    """This channel's share of the cores, so N encoders don't pile onto one CPU."""
+    if not config.ENCODER_PIN_CPUS or not hasattr(os, "sched_getaffinity"):
+        return None
+    cpus = sorted(os.sched_getaffinity(0))
+    ids = list(state.channels)
+    index = ids.index(channel.id) if channel.id in ids else 0
+    per = max(1, len(cpus) // max(len(ids), 1))
+    start = (index * per) % len(cpus)
+    return cpus[start : start + per]
+
+
+def _ladder_cmd(channel, threads, fds):
+    """One decode, split and scaled per rung; the top rung goes to stdout,
+    the others to the supervisor's extra pipes (fds)"""
+    outputs = []
+    for i, (rung, target) in enumerate(
+        zip(config.ABR_LADDER, ["pipe:1", *(f"pipe:{fd}" for fd in fds)])
+    ):
+        outputs += [
+            "-map", f"[abr{i}]",
+            "-map", "0:a:0?",
+            "-threads", str(threads),
+            *abr_output_args(rung, level=channel.encoder_level, top=i == 0),
+            target,
+        ]
+    return [
         "ffmpeg",
         "-y",
         "-hide_banner",
         "-loglevel", "info",
-        "-re",
-        "-i", config.PIPE_PATH,
-
-        # Video
-        "-c:v", "libx264",
-        "-preset", "veryfast",
-        "-tune", "zerolatency",   # good for live streaming
-        "-pix_fmt", "yuv420p",
-
-        # Audio
-        "-c:a", "aac",
-        "-b:a", "192k",
-
-        # MPEG-TS container options
-        "-f", "mpegts",
-        "-mpegts_flags", "resend_headers+initial_discontinuity",
-        "-muxrate", "8000k",      # optional: constant mux rate for IPTV
-        "-muxdelay", "0.7",       # reduce latency
-        "-muxpreload", "0.7",
-        "-pat_period", "0.5",     # send PAT/PMT tables every 0.5s
-        "-pcr_period", "20",      # PCR interval (ms)
-
-        os.path.join(config.HLS_DIR, "stream.ts"),
+        *encoder_input_args(),
+        "-i", channel.fifo_path,
+        "-filter_complex", abr_filter_graph(ladder_sizes(channel.encoder_level)),
+        *outputs,
     ]
 
-    log_file = open(config.FFMPEG_LOG, "a")
-    subprocess.Popen(ffmpeg_cmd, stdout=log_file, stderr=log_file)
-    print("🎬 Persistent FFmpeg started (MPEG-TS output, Jellyfin-friendly)")
-
 
-def write_twitch(channel):
-    stop_writer()
-    print(f"🔴 Writing Twitch stream for {channel}...")
-    session = Streamlink()
-    streams = session.streams(f"https://twitch.tv/{channel}")
-    if "best" not in streams:
-        print("⚠️ Twitch channel offline.")
-        return False
-    hls_url = streams["best"].url
-    ffmpeg_cmd = [
+def _encoder_cmd(channel, *fds):
+    threads = config.ENCODER_THREADS or len(_encoder_cpus(channel) or ())
+    if channel.renditions:
+        return _ladder_cmd(channel, threads, fds)
+    return [
         "ffmpeg",
         "-y",
-        "-re",
         "-hide_banner",
-        "-loglevel",
-        "info",
-        "-i",
-        hls_url,
-        "-c",
-        "copy",
-        "-f",
-        "mpegts",
-        config.PIPE_PATH,
+        "-loglevel", "info",
+        # no -re: the writer feeding the FIFO already runs at real time
+        *encoder_input_args(),
+        "-i", channel.fifo_path,
+        "-threads", str(threads),
+        *output_video_args(level=channel.encoder_level),
+        *output_audio_args(),
+        *output_mux_args(),
+        *encoder_mux_args(),
+        "pipe:1",
     ]
-    log_file = open(config.FFMPEG_LOG, "a")
-    state.current_writer_proc = subprocess.Popen(
-        ffmpeg_cmd, stdout=log_file, stderr=log_file
+
+
+def _encoder_behind(channel, speed):
+    """Step the channel's output encoder down a level; False at the bottom."""
+    profile = encoder_profile()
+    level = profile.step_down(channel.encoder_level)
+    if level is None:
+        print(f"⚠️ [{channel.id}] Encoder at {speed:.2f}x and already at its cheapest settings")
+        return False
+    channel.encoder_level = level
+    print(
+        f"🐢 [{channel.id}] Encoder at {speed:.2f}x, stepping down to "
+        f"{profile.describe(level)}"
     )
-    state.current_source = "twitch"
     return True
 
 
-def write_youtube():
-    stop_writer()
-    if not state.youtube_cache:
-        print("⚠️ No YouTube videos cached.")
-        return False
+def start_ffmpeg(channel):
+    """Start the channel's supervised persistent FFmpeg streaming MPEG-TS into its ring"""
+    if channel.ts_buffer is None:
+        channel.ts_buffer = TSRingBuffer()
+    if abr_enabled() and not channel.renditions:
+        channel.renditions = [Rendition(channel, rung) for rung in config.ABR_LADDER[1:]]
+    if channel.supervisor is None:
+        channel.supervisor = Supervisor(channel.fifo_path, channel.ts_buffer)
+        threading.Thread(target=channel.supervisor.run, daemon=True).start()
+    channel.supervisor.start_encoder(
+        lambda *fds: _encoder_cmd(channel, *fds),
+        cpus=lambda: _encoder_cpus(channel),
+        on_slow=lambda speed: _encoder_behind(channel, speed),
+        renditions=[r.ring for r in channel.renditions],
+    )
+    ladder = ""
+    if channel.renditions:
+        ladder = f", ABR {'/'.join(r['name'] for r in config.ABR_LADDER)}"
+    print(
+        f"🎬 [{channel.id}] Persistent FFmpeg started (MPEG-TS → in-memory ring, "
+        f"{encoder_profile().describe(channel.encoder_level)}, "
+        f"{latency_profile()[0]} latency{ladder})"
+    )
+
+
+def start_hls(channel):
+    """Start the rolling HLS segmenter on top of the channel's TS ring, and
+    one per lower ABR rendition"""
+    if not config.HLS_ENABLED or channel.hls_playlist is not None:
+        return
+    _, profile = latency_profile()
+    channel.hls_playlist = HLSPlaylist(
+        channel.hls_dir,
+        list_size=profile["hls_list_size"],
+        target_duration=profile["hls_segment_time"],
+    )
+    segmenter = HLSSegmenter(channel.ts_buffer, channel.hls_playlist, segment_time=hls_cut_time())
+    threading.Thread(target=segmenter.run, daemon=True).start()
+    for rendition in channel.renditions:
+        rendition.start()
+    print(
+        f"📼 [{channel.id}] HLS segmenter started ({profile['hls_segment_time']}s segments, "
+        f"{profile['hls_list_size']} in window)"
+    )
+
+
+def start_timeshift(channel):
+    """Start recording the channel's TS ring into its time-shift buffer"""
+    if not config.TIMESHIFT_ENABLED or channel.timeshift is not None:
+        return
+    channel.timeshift = TimeShiftBuffer(channel.timeshift_dir)
+    segmenter = HLSSegmenter(
+        channel.ts_buffer, channel.timeshift, segment_time=channel.timeshift.segment_time
+    )
+    threading.Thread(target=segmenter.run, daemon=True).start()
+    print(
+        f"⏪ [{channel.id}] Time-shift buffer started ({config.TIMESHIFT_MINUTES} min, "
+        f"{channel.timeshift.slot_count} slots)"
+    )
+
+
+def write_twitch(channel, login):
+    print(f"🔴 [{channel.id}] Writing Twitch stream for {login}...")
+    cfg = get_config()
+    passthrough = False
 
-    cfg = load_config()
-    playlist = build_youtube_playlist()
+    # resolved once per transition; the probe starts resolving as soon as it
+    # first sees the go-live, so this is usually a cache hit
+    hls_url = state.twitch_probe.resolve(login)
+    if hls_url is None:
+        print("⚠️ Twitch channel offline.")
+        return False
+    if cfg.get("twitch_passthrough", True):
+        passthrough = matches_output_profile(probe_codecs(hls_url))
 
-    if cfg.get("youtube_transcode", True):
-        ffmpeg_cmd = [
+    def build():
+        nonlocal hls_url
+        # a restart after a crash re-resolves in case the cached URL went stale
+        url, hls_url = hls_url or state.twitch_probe.resolve(login, fresh=True), None
+        if url is None:
+            print("⚠️ Twitch channel offline.")
+            return None
+        return [
             "ffmpeg",
             "-y",
-            "-re",
             "-hide_banner",
             "-loglevel",
             "info",
-            "-f",
-            "concat",
-            "-safe",
-            "0",
+            *live_input_args(url),
             "-i",
-            playlist,
-            "-c:v",
-            "libx264",
-            "-preset",
-            "veryfast",
-            "-crf",
-            str(cfg.get("youtube_crf", 20)),
-            "-c:a",
-            "aac",
-            "-b:a",
-            cfg.get("youtube_audio_bitrate", "192k"),
-            "-f",
-            "mpegts",
-            config.PIPE_PATH,
+            url,
+            "-c",
+            "copy",
+            *output_mux_args(),
+            "pipe:1",
         ]
-        print(
-            f"🎥 YouTube → transcoding (CRF {cfg.get('youtube_crf',20)}, {cfg.get('youtube_audio_bitrate','192k')} audio)"
-        )
+
+    if passthrough:
+        print("⚡ Twitch → passthrough (codecs match output profile, no re-encode)")
     else:
-        ffmpeg_cmd = [
+        print("🎥 Twitch → output encoder")
+    if not channel.supervisor.swap_writer("twitch", build, passthrough=passthrough):
+        return False
+    channel.playing_files = set()
+    channel.current_source = "twitch"
+    return True
+
+
+def write_youtube(channel):
+    pool = filler_pool()
+    if not pool:
+        print("⚠️ No YouTube videos cached.")
+        return False
+    ready = [p for _, p in pool if p.endswith(".ts")]
+    # every item leaves the playout channel-ready (pre-transcoded, remuxed
+    # or encoded once as it plays), so the writer bypasses the output encoder
+    passthrough = True
+
+    def build():
+        # one writer for the whole rotation: the playout feeds it item after
+        # item on stdin as a single continuous MPEG-TS stream
+        return [
             "ffmpeg",
             "-y",
-            "-re",
+            *pacing_args(),
             "-hide_banner",
             "-loglevel",
             "info",
             "-f",
-            "concat",
-            "-safe",
-            "0",
+            "mpegts",
             "-i",
-            playlist,
+            "pipe:0",
             "-c",
             "copy",
-            "-f",
-            "mpegts",
-            config.PIPE_PATH,
+            *output_mux_args(),
+            "pipe:1",
         ]
-        print("⚡ YouTube → remux (no re-encode)")
 
-    log_file = open(config.FFMPEG_LOG, "a")
-    state.current_writer_proc = subprocess.Popen(
-        ffmpeg_cmd, stdout=log_file, stderr=log_file
-    )
-    state.current_source = "youtube"
+    if ready:
+        print(f"⚡ YouTube → {len(ready)}/{len(pool)} videos pre-transcoded (stream copy)")
+    else:
+        print("⚡ YouTube → downloads (remuxed, or encoded as they play if the codecs differ)")
+
+    if channel.playout is None:
+        channel.playout = Playout(channel)
+    if not channel.supervisor.swap_writer(
+        "youtube", build, passthrough=passthrough, feed=channel.playout.feed
+    ):
+        return False
+    channel.current_source = "youtube"
     return True
 
 
-def write_fallback():
-    stop_writer()
-    ffmpeg_cmd = [
-        "ffmpeg",
-        "-y",
-        "-re",
-        "-hide_banner",
-        "-loglevel",
-        "info",
-        "-f",
-        "lavfi",
-        "-i",
-        "smptebars=size=1280x720:rate=30",
-        "-f",
-        "lavfi",
-        "-i",
-        "sine=frequency=1000:sample_rate=44100",
-        "-c:v",
-        "libx264",
-        "-preset",
-        "veryfast",
-        "-c:a",
-        "aac",
-        "-f",
-        "mpegts",
-        config.PIPE_PATH,
-    ]
-    log_file = open(config.FFMPEG_LOG, "a")
-    state.current_writer_proc = subprocess.Popen(
-        ffmpeg_cmd, stdout=log_file, stderr=log_file
-    )
-    state.current_source = "fallback"
+def write_fallback(channel):
+    """Bars and tone, encoded once with the output profile and sent as-is"""
+    def build():
+        return [
+            "ffmpeg",
+            "-y",
+            *pacing_args(),
+            "-hide_banner",
+            "-loglevel",
+            "info",
+            "-f",
+            "lavfi",
+            "-i",
+            "smptebars=size=1280x720:rate=30",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency=1000:sample_rate=44100",
+            *output_video_args(),
+            *output_audio_args(),
+            *output_mux_args(),
+            "pipe:1",
+        ]
+
+    if not channel.supervisor.swap_writer("fallback", build, passthrough=True):
+        return False
+    channel.playing_files = set()
+    channel.current_source = "fallback"
     return True
 
 
-def graceful_switch(new_source, channel=None):
-    """Insert fallback for a few seconds before switching sources"""
-    print("🟨 Graceful switch: inserting fallback...")
-    write_fallback()
-    time.sleep(3)  # 3s of bars/tone
+def graceful_switch(channel, new_source, login=None):
+    """Switch the channel's source without going off air.
 
+    The new writer starts alongside the current one and is spliced in at
+    its first keyframe; if it fails to start, the current source stays.
+    """
     if new_source == "twitch":
-        print("🔄 Switching to Twitch...")
-        write_twitch(channel)
+        print(f"🔄 [{channel.id}] Switching to Twitch...")
+        ok = write_twitch(channel, login)
     elif new_source == "youtube":
-        print("🔄 Switching to YouTube filler...")
-        write_youtube()
+        print(f"🔄 [{channel.id}] Switching to YouTube filler...")
+        ok = write_youtube(channel)
     else:
-        print("🔄 Staying on fallback...")
-        write_fallback()
-
-
-def orchestrator():
-    while True:
-        cfg = load_config()
-        channel = cfg.get("twitch_channel", "ludwig")
-        live = False
-        try:
-            session = Streamlink()
-            streams = session.streams(f"https://twitch.tv/{channel}")
-            live = "best" in streams
-        except Exception:
-            live = False
-
-        if live and state.current_source != "twitch":
-            graceful_switch("twitch", channel=channel)
-        elif not live:
-            if state.youtube_cache and state.current_source != "youtube":
-                graceful_switch("youtube")
-            elif not state.youtube_cache and state.current_source != "fallback":
-                graceful_switch("fallback")
-
-        time.sleep(config.CHECK_INTERVAL)
\ No newline at end of file
+        print(f"🔄 [{channel.id}] Switching to fallback...")
+        ok = write_fallback(channel)
+    if not ok and channel.current_source is None:
+        # nothing on air at all: bars are better than silence
+        ok = write_fallback(channel)
+    return ok
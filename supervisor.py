@@ -0,0 +1,589 @@
+import os
+import select
+import subprocess
+import threading
+import time
+from collections import deque
+import config
+from ffmpeg_io import ProcessOutput
+from tsbuffer import TSRingBuffer, TSSplicer
+
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def _cpu_seconds(pid):
+    """Return user+system CPU seconds of a process from /proc, or None."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLK_TCK
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _close_pipes(pipes):
+    for fds in pipes:
+        for fd in fds:
+            os.close(fd)
+
+
+class ManagedProcess:
+    """A child process that is restarted with exponential backoff."""
+
+    def __init__(
+        self, name, build_cmd, on_start=None, restart=True, cpus=None, feed=None, outputs=0
+    ):
+        self.name = name
+        self.build_cmd = build_cmd
+        # extra output pipes: build_cmd gets their write fds (for pipe:N),
+        # on_start finds the read ends in output_fds
+        self.outputs = outputs
+        self.output_fds = []
+        self.on_start = on_start
+        # callable given each started child and finish() to write its
+        # stdin, or None
+        self.feed = feed
+        self.restart = restart
+        self.output = None  # ProcessOutput of the current child
+        # callable returning the CPUs to pin the process to, or None
+        self.cpus = cpus
+        self.pinned = None
+        self.proc = None
+        self.restarts = 0
+        self.failures = 0
+        self.started_at = None
+        self.next_start = 0
+        self.backoff = config.SUPERVISOR_BACKOFF_MIN
+        self.last_exit = None
+
+    def spawn(self):
+        """Start the process; returns False if the command could not be built."""
+        pipes = [os.pipe() for _ in range(self.outputs)]
+        try:
+            cmd = self.build_cmd(*(w for _, w in pipes))
+        except Exception as e:
+            print(f"⚠️ {self.name}: failed to build command: {e}")
+            cmd = None
+        if not cmd:
+            _close_pipes(pipes)
+            self._schedule_retry()
+            return False
+        self.pinned = self.cpus() if self.cpus else None
+        output = ProcessOutput(self.name)
+        cmd, pass_fds = output.command(cmd)
+        if self.pinned:
+            # taskset sets the mask before exec, so every thread ffmpeg starts inherits it
+            cmd = ["taskset", "-c", ",".join(map(str, self.pinned)), *cmd]
+        try:
+            self.proc = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE if self.feed else None,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                pass_fds=(*pass_fds, *(w for _, w in pipes)),
+            )
+        except OSError as e:
+            output.abandon()
+            _close_pipes(pipes)
+            print(f"⚠️ {self.name}: failed to start: {e}")
+            self._schedule_retry()
+            return False
+        for _, w in pipes:
+            os.close(w)  # only the child writes
+        self.output_fds = [r for r, _ in pipes]
+        output.start(self.proc)
+        self.output = output
+        self.started_at = time.time()
+        if self.on_start:
+            self.on_start(self.proc)
+        if self.feed:
+            self.feed(self.proc, self.finish)
+        return True
+
+    def finish(self):
+        """The child is ending on purpose: let it exit without a restart."""
+        self.restart = False
+
+    @property
+    def ended(self):
+        """True once a finished child has exited."""
+        return not self.restart and (self.proc is None or self.proc.poll() is not None)
+
+    def _schedule_retry(self):
+        self.failures += 1
+        self.next_start = time.time() + self.backoff
+        self.backoff = min(self.backoff * 2, config.SUPERVISOR_BACKOFF_MAX)
+
+    def check(self):
+        """Restart the process if it died and its backoff has elapsed."""
+        if self.proc is not None:
+            code = self.proc.poll()
+            if code is None:
+                if time.time() - self.started_at > config.SUPERVISOR_STABLE_AFTER:
+                    self.backoff = config.SUPERVISOR_BACKOFF_MIN
+                return
+            self.last_exit = code
+            self.proc = None
+            if not self.restart:
+                return
+            if time.time() - self.started_at > config.SUPERVISOR_STABLE_AFTER:
+                self.backoff = config.SUPERVISOR_BACKOFF_MIN
+            print(f"⚠️ {self.name} exited ({code}); restarting in {self.backoff}s")
+            self._schedule_retry()
+            return
+        if self.restart and time.time() >= self.next_start:
+            if self.spawn():
+                self.restarts += 1
+
+    def stop(self):
+        self.restart = False
+        self.terminate()
+
+    def terminate(self):
+        """End the current child, leaving the restart policy as it is."""
+        proc, self.proc = self.proc, None
+        if proc and proc.poll() is None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+
+    def stats(self):
+        running = self.proc is not None and self.proc.poll() is None
+        return {
+            "name": self.name,
+            "running": running,
+            "pid": self.proc.pid if running else None,
+            "uptime": round(time.time() - self.started_at, 1) if running else 0,
+            "restarts": self.restarts,
+            "failures": self.failures,
+            "last_exit": self.last_exit,
+            "cpus": self.pinned,
+            **(self.output.stats() if self.output else {"progress": None, "stderr_tail": []}),
+        }
+
+    @property
+    def progress(self):
+        """Latest parsed -progress report of the current child, if any."""
+        return self.output.progress if self.output else None
+
+
+class Supervisor:
+    """Own the persistent encoder and the current writer.
+
+    The supervisor keeps its own handle on the FIFO open, so the encoder
+    never sees EOF when writers are swapped, and copies each writer's
+    stdout into the FIFO in whole TS packets so a killed writer cannot
+    leave a torn packet behind for the next one.
+
+    A passthrough writer already emits channel-ready MPEG-TS, so its
+    output bypasses the FIFO and the encoder and goes straight into the
+    TS ring. Exactly one producer feeds the ring at any time.
+
+    With an ABR ladder the encoder also writes each lower rendition to an
+    extra pipe, pumped into that rendition's own ring. Every source then
+    goes through the encoder, since a passthrough writer would leave the
+    ladder without input.
+
+    A new writer is started alongside the current one and only put on
+    air at its first keyframe. Both the FIFO and the ring are fed
+    through a TSSplicer, so timestamps and continuity counters run on
+    unbroken across writer changes and restarts.
+    """
+
+    def __init__(self, fifo_path, ring):
+        self.fifo_path = fifo_path
+        self.ring = ring
+        self.encoder = None
+        self.writer = None
+        self.source = None
+        self.passthrough = False
+        self.switches = deque(maxlen=20)
+        self.switch_totals = {}  # (source, ok) -> [count, seconds to first frame]
+        self.fifo_bytes = 0
+        self.fifo_wait = 0.0  # seconds writers spent blocked on a full FIFO
+        self.fifo_dropped = 0  # bytes dropped because the FIFO stayed full
+        self.speed = None  # encoder speed over the last check window
+        self.slowdowns = 0
+        self._on_slow = None
+        self._speed_window = (time.time(), 0.0)
+        self._encoder_pump = None
+        self.renditions = []  # rings of the encoder's extra outputs
+        self._rendition_splicers = []
+        self._rendition_pumps = []
+        self._fifo_fd = None
+        self._pump = None
+        self._stopped = False
+        self._lock = threading.RLock()
+        self._swap_lock = threading.Lock()
+        # lock order: _fifo_lock before _ring_lock, so a writer blocked on
+        # a full FIFO never stalls the encoder's pump into the ring
+        self._fifo_lock = threading.Lock()
+        self._ring_lock = threading.Lock()
+        self._ring_owner = "encoder"
+        self._fifo_owner = None
+        self._ring_splicer = TSSplicer()
+        self._fifo_splicer = TSSplicer()
+        self._cpu = {}  # mode -> {"cpu": seconds, "wall": seconds}
+        self._cpu_last = {}  # pid -> last cpu seconds
+        self._cpu_sampled = time.time()
+
+    def open_fifo(self):
+        # O_RDWR never blocks waiting for a peer and keeps the pipe alive
+        # for the encoder while no writer is attached
+        if self._fifo_fd is None:
+            # non-blocking, so a write waits on the FIFO only up to
+            # FIFO_WRITE_TIMEOUT (see _write_fifo)
+            self._fifo_fd = os.open(self.fifo_path, os.O_RDWR | os.O_NONBLOCK)
+
+    def start_encoder(self, build_cmd, cpus=None, on_slow=None, renditions=()):
+        """Start the output encoder. on_slow(speed) is called when it falls
+        behind; if it returns True the encoder is restarted with a freshly
+        built command. With renditions (one ring each), build_cmd is given
+        the fds of that many extra outputs."""
+        with self._lock:
+            self._on_slow = on_slow
+            self.renditions = list(renditions)
+            self._rendition_splicers = [TSSplicer() for _ in self.renditions]
+            self.open_fifo()
+            self.encoder = ManagedProcess(
+                "encoder",
+                build_cmd,
+                self._attach_encoder,
+                cpus=cpus,
+                outputs=len(self.renditions),
+            )
+            self.encoder.spawn()
+
+    def shutdown(self):
+        """Stop the writer and the encoder for good and release the FIFO."""
+        self._stopped = True
+        with self._lock:
+            self.stop_writer()
+            if self.encoder is not None:
+                self.encoder.stop()
+            with self._fifo_lock:
+                self._fifo_owner = None
+                if self._fifo_fd is not None:
+                    os.close(self._fifo_fd)
+                    self._fifo_fd = None
+
+    def _route(self, writer, passthrough):
+        """Point the ring (and the FIFO) at writer and splice it in."""
+        with self._fifo_lock, self._ring_lock:
+            owner = writer if passthrough else "encoder"
+            if self._ring_owner is not owner:
+                self._ring_owner = owner
+                self._ring_splicer.splice()
+            self._fifo_owner = None if passthrough else writer
+            if not passthrough:
+                self._fifo_splicer.splice()
+
+    def _feed(self, owner, data):
+        with self._ring_lock:
+            if self._ring_owner is owner:
+                self.ring.push(self._ring_splicer.process(data))
+
+    def _write_fifo(self, owner, data):
+        """Write to the encoder FIFO, waiting at most FIFO_WRITE_TIMEOUT.
+
+        A FIFO that stays full means the encoder is gone; the rest of the
+        data is dropped rather than holding _fifo_lock until it returns.
+        """
+        with self._fifo_lock:
+            if self._fifo_owner is not owner:
+                return
+            view = memoryview(self._fifo_splicer.process(data))
+            self.fifo_bytes += len(view)
+            start = time.monotonic()
+            deadline = start + config.FIFO_WRITE_TIMEOUT
+            while view:
+                try:
+                    view = view[os.write(self._fifo_fd, view):]
+                except BlockingIOError:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not select.select([], [self._fifo_fd], [], remaining)[1]:
+                        self.fifo_dropped += len(view)
+                        self._fifo_splicer.splice()  # what follows starts mid-stream
+                        break
+            self.fifo_wait += time.monotonic() - start
+
+    def _pump_to_ring(self, proc, owner):
+        """Forward a producer's stdout into the TS ring while it owns it."""
+        with proc.stdout:  # closed when the child exits, not left to the GC
+            fd = proc.stdout.fileno()
+            while True:
+                data = os.read(fd, config.TS_READ_SIZE)
+                if not data:
+                    break
+                self._feed(owner, data)
+
+    def _attach_encoder(self, proc):
+        with self._ring_lock:
+            if self._ring_owner == "encoder":
+                self._ring_splicer.splice()
+        self._encoder_pump = threading.Thread(
+            target=self._pump_to_ring, args=(proc, "encoder"), daemon=True
+        )
+        self._encoder_pump.start()
+        self._rendition_pumps = []
+        for fd, ring, splicer in zip(
+            self.encoder.output_fds, self.renditions, self._rendition_splicers
+        ):
+            splicer.splice()
+            pump = threading.Thread(
+                target=self._pump_rendition, args=(fd, ring, splicer), daemon=True
+            )
+            pump.start()
+            self._rendition_pumps.append(pump)
+
+    @staticmethod
+    def _pump_rendition(fd, ring, splicer):
+        """Forward one extra encoder output into its rendition's ring."""
+        try:
+            while True:
+                data = os.read(fd, config.TS_READ_SIZE)
+                if not data:
+                    break
+                ring.push(splicer.process(data))
+        finally:
+            os.close(fd)
+
+    def _pump_writer(self, proc, writer, passthrough, handover=None):
+        """Forward a writer's stdout to the ring (passthrough) or the FIFO.
+
+        With a handover the output is first staged until it contains a
+        keyframe; the pump then waits until swap_writer puts it on air.
+        """
+        with proc.stdout:
+            fd = proc.stdout.fileno()
+            send = self._feed if passthrough else self._write_fifo
+            if handover is not None:
+                stage = TSRingBuffer(config.SWITCH_STAGE_BYTES)
+                while handover["data"] is None:
+                    data = os.read(fd, config.TS_READ_SIZE)
+                    if not data:
+                        break
+                    stage.push(data)
+                    handover["data"] = stage.tail_from_sync()
+                handover["ready"].set()
+                handover["go"].wait()
+                if handover["abort"]:
+                    return
+            while True:
+                data = os.read(fd, config.TS_READ_SIZE)
+                if not data:
+                    break
+                send(writer, data)
+
+    def _start_pump(self, proc, writer, passthrough, handover=None):
+        pump = threading.Thread(
+            target=self._pump_writer,
+            args=(proc, writer, passthrough, handover),
+            daemon=True,
+        )
+        if handover is not None:
+            handover["thread"] = pump
+        else:
+            # restart after a crash: nothing to hand over from, splice straight in
+            self._route(writer, passthrough)
+            self._pump = pump
+        pump.start()
+
+    def stop_writer(self):
+        with self._lock:
+            if self.writer:
+                self.writer.stop()
+            if self._pump is not None:
+                self._pump.join(timeout=2)
+                self._pump = None
+            self.writer = None
+            self.source = None
+
+    def _record_switch(self, source, ok, started):
+        ttff = time.monotonic() - started
+        self.switches.append(
+            {
+                "source": source,
+                "ok": ok,
+                "at": round(time.time(), 2),
+                "time_to_first_frame": round(ttff, 2),
+            }
+        )
+        totals = self.switch_totals.setdefault((source, ok), [0, 0.0])
+        totals[0] += 1
+        totals[1] += ttff
+
+    def swap_writer(self, source, build_cmd, passthrough=False, feed=None):
+        """Start a new writer and splice it in at its first keyframe.
+
+        The current writer stays on air while the new one starts up, so
+        viewers never see a gap. With passthrough the writer's output is
+        already channel-ready and is fed to the ring directly instead of
+        through the encoder. Returns False, leaving the current writer in
+        place, if no keyframe arrives within SWITCH_TIMEOUT. feed, if
+        given, writes the writer's stdin (see ManagedProcess).
+        """
+        passthrough = passthrough and not self.renditions
+        with self._swap_lock:
+            started = time.monotonic()
+            handover = {
+                "ready": threading.Event(),
+                "go": threading.Event(),
+                "abort": False,
+                "data": None,
+                "thread": None,
+            }
+            writer = ManagedProcess(f"writer:{source}", build_cmd, feed=feed)
+            writer.on_start = lambda proc: self._start_pump(
+                proc, writer, passthrough, handover
+            )
+            ok = (
+                writer.spawn()
+                and handover["ready"].wait(config.SWITCH_TIMEOUT)
+                and handover["data"] is not None
+            )
+            if not ok:
+                handover["abort"] = True
+                handover["go"].set()
+                writer.stop()
+                self._record_switch(source, False, started)
+                print(f"⚠️ {source} produced no keyframe; keeping {self.source}")
+                return False
+
+            with self._lock:
+                old, old_pump = self.writer, self._pump
+                writer.on_start = lambda proc: self._start_pump(proc, writer, passthrough)
+                self._route(writer, passthrough)
+                self.writer, self._pump = writer, handover["thread"]
+                self.source, self.passthrough = source, passthrough
+            # outside _lock: a FIFO write can wait, and run() needs _lock to
+            # restart the encoder that drains it
+            (self._feed if passthrough else self._write_fifo)(writer, handover["data"])
+            handover["go"].set()
+            self._record_switch(source, True, started)
+            if old is not None:
+                old.stop()
+            if old_pump is not None:
+                old_pump.join(timeout=2)
+            return True
+
+    @property
+    def writer_ended(self):
+        """True if the writer on air has exited on purpose (see ManagedProcess.finish)"""
+        writer = self.writer
+        return writer is not None and writer.ended
+
+    @property
+    def mode(self):
+        if self.source is None:
+            return "idle"
+        return f"{self.source}:{'passthrough' if self.passthrough else 'encode'}"
+
+    def _sample_cpu(self):
+        """Attribute encoder + writer CPU time since the last sample to the current mode."""
+        now = time.time()
+        used = 0.0
+        last = {}
+        for managed in (self.encoder, self.writer):
+            if managed is None or managed.proc is None:
+                continue
+            pid = managed.proc.pid
+            total = _cpu_seconds(pid)
+            if total is None:
+                continue
+            used += total - self._cpu_last.get(pid, total)
+            last[pid] = total
+        self._cpu_last = last
+        entry = self._cpu.setdefault(self.mode, {"cpu": 0.0, "wall": 0.0})
+        entry["cpu"] += used
+        entry["wall"] += now - self._cpu_sampled
+        self._cpu_sampled = now
+
+    def _check_speed(self):
+        """Restart the encoder cheaper if it can't keep up with its writer.
+
+        Speed is taken from the encoder's -progress reports over the last
+        window. A starved encoder reports < 1x too, so it only counts as
+        behind if writers also spent part of the window blocked on a
+        full FIFO.
+        """
+        now = time.time()
+        since, waited_before = self._speed_window
+        self._speed_window = (now, self.fifo_wait)
+        encoder = self.encoder
+        if encoder is None or encoder.output is None or self.passthrough or self.source is None:
+            self.speed = None
+            return
+        reports = [
+            p for p in list(encoder.output.history)
+            if p["at"] >= since and p["out_time"] is not None
+        ]
+        if len(reports) < 2 or reports[-1]["at"] <= reports[0]["at"]:
+            return
+        self.speed = (reports[-1]["out_time"] - reports[0]["out_time"]) / (
+            reports[-1]["at"] - reports[0]["at"]
+        )
+        backlog = (self.fifo_wait - waited_before) / (now - since)
+        if (
+            self._on_slow is None
+            or self.speed >= config.ENCODER_MIN_SPEED
+            or backlog < config.ENCODER_BACKLOG_FRACTION
+        ):
+            return
+        self.slowdowns += 1
+        if not self._on_slow(self.speed):
+            self._on_slow = None  # nothing cheaper left to try
+            return
+        encoder.terminate()
+        for pump in (self._encoder_pump, *self._rendition_pumps):
+            if pump is not None:
+                pump.join(timeout=2)  # no stale output after the splice
+        if encoder.spawn():
+            encoder.restarts += 1
+        self._speed_window = (time.time(), self.fifo_wait)
+
+    def run(self):
+        """Supervision loop: restart crashed processes with backoff."""
+        next_sample = time.time() + config.CPU_SAMPLE_INTERVAL
+        next_speed_check = time.time() + config.ENCODER_SPEED_WINDOW
+        while not self._stopped:
+            with self._lock:
+                for managed in (self.encoder, self.writer):
+                    if managed is not None:
+                        managed.check()
+                if time.time() >= next_sample:
+                    self._sample_cpu()
+                    next_sample = time.time() + config.CPU_SAMPLE_INTERVAL
+                if time.time() >= next_speed_check:
+                    self._check_speed()
+                    next_speed_check = time.time() + config.ENCODER_SPEED_WINDOW
+            time.sleep(config.SUPERVISOR_INTERVAL)
+
+    def cpu_stats(self):
+        """Return CPU usage per pipeline mode, as cumulative seconds and percent of one core."""
+        return {
+            mode: {
+                "cpu_seconds": round(v["cpu"], 1),
+                "wall_seconds": round(v["wall"], 1),
+                "cpu_percent": round(100 * v["cpu"] / v["wall"], 1) if v["wall"] else 0.0,
+            }
+            for mode, v in self._cpu.items()
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "encoder": self.encoder.stats() if self.encoder else None,
+                "writer": self.writer.stats() if self.writer else None,
+                "source": self.source,
+                "mode": self.mode,
+                "cpu": self.cpu_stats(),
+                "encoder_speed": round(self.speed, 3) if self.speed is not None else None,
+                "slowdowns": self.slowdowns,
+                "fifo_dropped": self.fifo_dropped,
+                "splices": self._ring_splicer.splices,
+                "switches": list(self.switches)[-5:],
+            }
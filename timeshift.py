@@ -0,0 +1,203 @@
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+import config
+
+_SEGMENT_NAME = re.compile(r"^ts_(\d+)\.ts$")
+
+
+def _program_date_time(t):
+    ms = int((t % 1) * 1000)
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t)) + f".{ms:03d}Z"
+
+
+class _SlotWriter:
+    """Write handle of one segment going into a reused slot file."""
+
+    def __init__(self, path):
+        self._file = open(path, "r+b")  # in place: no truncate, no new blocks
+        self.size = 0
+        self.started = time.time()
+
+    def write(self, data):
+        self._file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        self._file.close()
+
+
+class TimeShiftBuffer:
+    """The last TIMESHIFT_MINUTES of a channel as HLS segments on disk.
+
+    Segments go into a fixed ring of slot files, preallocated once and
+    overwritten in place, so each write costs the same and the footprint
+    stays at slots x TIMESHIFT_SLOT_BYTES (a slot only grows if a segment
+    is ever larger). A few more slots than the playlist lists are kept so
+    a client can still fetch a segment that just left the playlist.
+    A slot that is still being read when its turn comes round gets a
+    fresh file instead; the readers keep the old one through their open
+    handles, however slow they are.
+
+    Each segment is indexed by the wall-clock time it was cut, and the
+    playlist carries that as EXT-X-PROGRAM-DATE-TIME; render(at) adds an
+    EXT-X-START so a player opens at a given time inside the window.
+    Segment names carry their sequence number, so a name whose slot has
+    since been reused 404s instead of serving other content.
+    """
+
+    def __init__(self, directory, minutes=None, segment_time=None):
+        self.directory = directory
+        self.segment_time = segment_time or config.TIMESHIFT_SEGMENT_TIME
+        minutes = minutes or config.TIMESHIFT_MINUTES
+        self.list_size = max(1, math.ceil(minutes * 60 / self.segment_time))
+        self.slot_count = self.list_size + config.TIMESHIFT_SPARE_SLOTS
+        self.target_duration = self.segment_time
+        self.segments = deque()  # (sequence, duration, started, discontinuity)
+        self.media_sequence = 0
+        self.discontinuity_sequence = 0
+        self._slots = [None] * self.slot_count  # (sequence, size) of the finished segment in each
+        self._writing = None
+        self._readers = [0] * self.slot_count  # open read handles per slot
+        self._lock = threading.Lock()
+        self._allocate()
+        self._rendered = self._render()
+
+    def _slot_path(self, slot):
+        return os.path.join(self.directory, f"slot_{slot}.ts")
+
+    @staticmethod
+    def _preallocate(f):
+        if os.fstat(f.fileno()).st_size >= config.TIMESHIFT_SLOT_BYTES:
+            return
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(f.fileno(), 0, config.TIMESHIFT_SLOT_BYTES)
+        else:
+            f.truncate(config.TIMESHIFT_SLOT_BYTES)
+
+    def _allocate(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for slot in range(self.slot_count):
+            with open(self._slot_path(slot), "ab") as f:
+                self._preallocate(f)
+
+    def _replace_slot(self, slot):
+        """Swap in a new file for a slot that is still being read."""
+        path = self._slot_path(slot)
+        with open(path + ".new", "wb") as f:
+            self._preallocate(f)
+        os.replace(path + ".new", path)
+
+    # --- segmenter side (see hls.HLSSegmenter) ---
+
+    def open_segment(self, index):
+        slot = index % self.slot_count
+        with self._lock:
+            self._slots[slot] = None  # its old segment is gone from here on
+            if self._readers[slot]:
+                self._replace_slot(slot)
+        self._writing = _SlotWriter(self._slot_path(slot))
+        return f"ts_{index}.ts", self._writing
+
+    def add_segment(self, filename, duration, discontinuity=False):
+        sequence = int(_SEGMENT_NAME.match(filename).group(1))
+        writer, self._writing = self._writing, None
+        with self._lock:
+            self._slots[sequence % self.slot_count] = (sequence, writer.size)
+            self.segments.append((sequence, duration, writer.started, discontinuity))
+            self.target_duration = max(self.target_duration, math.ceil(duration))
+            while len(self.segments) > self.list_size:
+                _, _, _, disc = self.segments.popleft()
+                self.media_sequence += 1
+                if disc:
+                    self.discontinuity_sequence += 1
+            self._rendered = self._render()
+
+    def remove_file(self, filename):
+        """A partial segment was dropped; its slot simply gets reused."""
+        self._writing = None
+
+    # --- serving side ---
+
+    def acquire(self, filename):
+        """Open a finished segment for reading: (file, size), or None.
+
+        Its slot is not written in place until release(filename).
+        """
+        m = _SEGMENT_NAME.match(filename)
+        if m is None:
+            return None
+        sequence = int(m.group(1))
+        slot = sequence % self.slot_count
+        with self._lock:
+            held = self._slots[slot]
+            if held is None or held[0] != sequence:
+                return None
+            f = open(self._slot_path(slot), "rb")
+            self._readers[slot] += 1
+        return f, held[1]
+
+    def release(self, filename):
+        slot = int(_SEGMENT_NAME.match(filename).group(1)) % self.slot_count
+        with self._lock:
+            self._readers[slot] -= 1
+
+    def window(self):
+        """(first, last) wall-clock time covered, or None while empty"""
+        with self._lock:
+            if not self.segments:
+                return None
+            _, duration, started, _ = self.segments[-1]
+            return self.segments[0][2], started + duration
+
+    def offset_of(self, t):
+        """Seconds into the playlist at which wall-clock time t plays.
+
+        Times before the window clamp to its start; None at or past the
+        live edge.
+        """
+        with self._lock:
+            position = 0.0
+            for _, duration, started, _ in self.segments:
+                if t < started + duration:
+                    return position + max(0.0, t - started)
+                position += duration
+        return None
+
+    def _render(self):
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}",
+            f"#EXT-X-MEDIA-SEQUENCE:{self.media_sequence}",
+        ]
+        if self.discontinuity_sequence:
+            lines.append(f"#EXT-X-DISCONTINUITY-SEQUENCE:{self.discontinuity_sequence}")
+        for sequence, duration, started, discontinuity in self.segments:
+            if discontinuity:
+                lines.append("#EXT-X-DISCONTINUITY")
+            lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{_program_date_time(started)}")
+            lines.append(f"#EXTINF:{duration:.3f},")
+            lines.append(f"timeshift/ts_{sequence}.ts")
+        return ("\n".join(lines) + "\n").encode()
+
+    def render(self, at=None):
+        """Playlist bytes; with at (wall-clock seconds), start playback there."""
+        body = self._rendered
+        offset = self.offset_of(at) if at is not None else None
+        if offset is None:
+            return body
+        head, rest = body.split(b"\n", 1)
+        return head + f"\n#EXT-X-START:TIME-OFFSET={offset:.3f},PRECISE=YES\n".encode() + rest
+
+    def stats(self):
+        window = self.window()
+        return {
+            "segments": len(self.segments),
+            "window_seconds": round(window[1] - window[0], 1) if window else 0,
+            "slots": self.slot_count,
+            "disk_bytes": self.slot_count * config.TIMESHIFT_SLOT_BYTES,
+        }
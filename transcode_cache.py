@@ -0,0 +1,156 @@
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import config
+from ffmpeg_io import ProcessOutput
+from profiles import offline_video_args, output_audio_args, output_mux_args, profile_fingerprint
+
+
+def _video_id(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class TranscodeCache:
+    """Channel-ready MPEG-TS copies of downloaded YouTube videos.
+
+    Each video is encoded once, in the background, into
+    <id>.<key>.ts where key covers youtube_crf, youtube_audio_bitrate and
+    the fixed pre-transcode profile. Playback of a ready entry is pure stream copy;
+    changing a setting only re-encodes entries whose key changed.
+    """
+
+    def __init__(self, directory, workers=None, in_use=None):
+        self.directory = directory
+        # callable returning paths the writer still has to read
+        self.in_use = in_use or (lambda: ())
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or config.TRANSCODE_WORKERS,
+            thread_name_prefix="transcode",
+        )
+        self._pending = {}  # path -> future
+        self._running = {}  # path -> ProcessOutput of the ffmpeg encoding it
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(cfg):
+        return profile_fingerprint(
+            (
+                cfg.get("youtube_crf", config.OUTPUT_VIDEO_QUALITY),
+                cfg.get("youtube_audio_bitrate", config.OUTPUT_AUDIO_BITRATE),
+            )
+        )
+
+    def path_for(self, source, cfg):
+        return os.path.join(self.directory, f"{_video_id(source)}.{self.key(cfg)}.ts")
+
+    def lookup(self, source, cfg):
+        """Return the ready TS path for source, or None if not transcoded yet."""
+        path = self.path_for(source, cfg)
+        return path if os.path.exists(path) else None
+
+    def _entries(self):
+        """Yield (video_id, key, path) for every finished cache file."""
+        for f in os.listdir(self.directory):
+            parts = f.split(".")
+            if len(parts) == 3 and parts[2] == "ts":
+                yield parts[0], parts[1], os.path.join(self.directory, f)
+
+    def _remove(self, path):
+        """Delete a cache file unless the current writer is playing it."""
+        if path in self.in_use():
+            return
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _transcode(self, source, target, cfg):
+        tmp = target + ".part"
+        cmd = [
+            "ffmpeg",
+            "-y",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-i",
+            source,
+            *offline_video_args(crf=cfg.get("youtube_crf", config.OUTPUT_VIDEO_QUALITY)),
+            *output_audio_args(cfg.get("youtube_audio_bitrate", config.OUTPUT_AUDIO_BITRATE)),
+            *output_mux_args(),
+            tmp,
+        ]
+        output = ProcessOutput(f"transcode:{os.path.basename(target)}")
+        cmd, pass_fds = output.command(cmd)
+        cmd = ["nice", "-n", "10", *cmd]  # stay behind the live encoders
+        try:
+            try:
+                proc = subprocess.Popen(
+                    cmd,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,
+                    pass_fds=pass_fds,
+                )
+            except OSError:
+                output.abandon()
+                raise
+            output.start(proc)
+            with self._lock:
+                self._running[target] = output
+            returncode = proc.wait()
+            if returncode != 0:
+                print(f"⚠️ Transcode failed ({returncode}): {source}")
+                return None
+            os.replace(tmp, target)
+            print(f"🎞️ Transcoded for playout: {os.path.basename(target)}")
+            # drop copies made with older settings now the new one is ready
+            vid, key = _video_id(source), self.key(cfg)
+            for other_id, other_key, path in self._entries():
+                if other_id == vid and other_key != key:
+                    self._remove(path)
+            return target
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            with self._lock:
+                self._pending.pop(target, None)
+                self._running.pop(target, None)
+
+    def submit(self, source, cfg):
+        """Queue a background transcode of source unless it is ready or queued."""
+        target = self.path_for(source, cfg)
+        with self._lock:
+            if target in self._pending or os.path.exists(target):
+                return
+            self._pending[target] = self._executor.submit(
+                self._transcode, source, target, dict(cfg)
+            )
+
+    def reconcile(self, sources, cfg):
+        """Transcode missing entries and drop ones whose source is gone or
+        whose key no longer matches the settings."""
+        if not cfg.get("youtube_transcode", True):
+            return
+        wanted, key = {_video_id(s) for s in sources}, self.key(cfg)
+        for vid, entry_key, path in list(self._entries()):
+            if vid not in wanted or entry_key != key:
+                self._remove(path)
+        for source in sources:
+            self.submit(source, cfg)
+
+    def clear(self):
+        for _, _, path in list(self._entries()):
+            self._remove(path)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+            running = {
+                os.path.basename(path): output.progress
+                for path, output in self._running.items()
+            }
+        return {
+            "ready": sum(1 for _ in self._entries()),
+            "pending": pending,
+            "running": running,
+        }
@@ -0,0 +1,445 @@
+import threading
+from collections import deque
+import config
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+TS_NULL_PID = 0x1FFF
+TS_CLOCK_WRAP = 1 << 33  # PTS/DTS/PCR base are 33-bit, 90 kHz
+SPLICE_GAP = 3003  # one frame at 29.97 fps, between the last old and first new timestamp
+
+
+def _resync(data):
+    """Drop bytes until two consecutive TS sync bytes line up."""
+    i = data.find(bytes([TS_SYNC_BYTE]))
+    while i != -1:
+        nxt = i + TS_PACKET_SIZE
+        if nxt >= len(data) or data[nxt] == TS_SYNC_BYTE:
+            return data[i:]
+        i = data.find(bytes([TS_SYNC_BYTE]), i + 1)
+    return b""
+
+
+def _parse_pcr(pkt, off):
+    """Return the 90 kHz PCR base of the packet at off."""
+    b = pkt[off + 6 : off + 11]
+    return (b[0] << 25) | (b[1] << 17) | (b[2] << 9) | (b[3] << 1) | (b[4] >> 7)
+
+
+def _pmt_pid(pkt, off):
+    """Return the PMT PID of the first program listed in a PAT packet."""
+    p = off + 4
+    if pkt[off + 3] & 0x20:
+        p += 1 + pkt[off + 4]
+    p += 1 + pkt[p]  # pointer field
+    section_len = ((pkt[p + 1] & 0x0F) << 8) | pkt[p + 2]
+    end = min(p + 3 + section_len - 4, off + TS_PACKET_SIZE)
+    i = p + 8
+    while i + 4 <= end:
+        program = (pkt[i] << 8) | pkt[i + 1]
+        if program != 0:
+            return ((pkt[i + 2] & 0x1F) << 8) | pkt[i + 3]
+        i += 4
+    return None
+
+
+def _read_ts(buf, i):
+    """Decode a 33-bit PES timestamp (PTS or DTS) starting at i."""
+    return (
+        ((buf[i] >> 1) & 0x07) << 30
+        | buf[i + 1] << 22
+        | (buf[i + 2] >> 1) << 15
+        | buf[i + 3] << 7
+        | buf[i + 4] >> 1
+    )
+
+
+def _write_ts(buf, i, ts):
+    """Encode ts in place, keeping the 4-bit prefix and marker bits."""
+    buf[i] = (buf[i] & 0xF0) | ((ts >> 29) & 0x0E) | 1
+    buf[i + 1] = (ts >> 22) & 0xFF
+    buf[i + 2] = ((ts >> 14) & 0xFE) | 1
+    buf[i + 3] = (ts >> 7) & 0xFF
+    buf[i + 4] = ((ts << 1) & 0xFE) | 1
+
+
+def _write_pcr(buf, off, base):
+    """Replace the PCR base of the packet at off, keeping its extension."""
+    buf[off + 6] = (base >> 25) & 0xFF
+    buf[off + 7] = (base >> 17) & 0xFF
+    buf[off + 8] = (base >> 9) & 0xFF
+    buf[off + 9] = (base >> 1) & 0xFF
+    buf[off + 10] = ((base & 1) << 7) | (buf[off + 10] & 0x7F)
+
+
+def _later(a, b):
+    """True if 33-bit timestamp a is after b, allowing for wrap-around."""
+    return 0 < (a - b) % TS_CLOCK_WRAP < TS_CLOCK_WRAP // 2
+
+
+class TSSplicer:
+    """Join MPEG-TS from successive producers into one continuous stream.
+
+    After splice(), the next producer's PCR/PTS/DTS are shifted so they
+    carry on from the last values written, and continuity counters are
+    renumbered per PID throughout, so players see a single program with
+    no discontinuity. Producers must share the same PIDs, which every
+    ffmpeg mpegts muxer here does.
+    """
+
+    def __init__(self):
+        self.splices = 0
+        self._cc = {}  # pid -> last continuity counter written
+        self._offset = 0
+        self._pending = False
+        self._last_pcr = None
+        self._last_ts = None  # newest PTS/DTS written on any PID
+        self._carry = b""
+
+    def splice(self):
+        """Rebase the timeline at the next timestamp; call on a producer change."""
+        self._pending = True
+        self._carry = b""
+        self.splices += 1
+
+    def _rebase(self, pcr, ts):
+        # pick the offset that keeps both clocks moving forward
+        offsets = []
+        if pcr is not None and self._last_pcr is not None:
+            offsets.append((self._last_pcr + SPLICE_GAP - pcr) % TS_CLOCK_WRAP)
+        if ts is not None and self._last_ts is not None:
+            offsets.append((self._last_ts + SPLICE_GAP - ts) % TS_CLOCK_WRAP)
+        offset = offsets[0] if offsets else 0
+        for other in offsets[1:]:
+            if _later(other, offset):
+                offset = other
+        self._offset = offset
+        self._pending = False
+
+    def _packet(self, buf, off):
+        b1, b3 = buf[off + 1], buf[off + 3]
+        pid = ((b1 & 0x1F) << 8) | buf[off + 2]
+        if pid == TS_NULL_PID:
+            return
+        p = off + 4
+        pcr_at = None
+        if b3 & 0x20:
+            adaptation_len = buf[off + 4]
+            if adaptation_len:
+                flags = buf[off + 5]
+                if flags & 0x80:
+                    buf[off + 5] = flags & 0x7F  # discontinuity_indicator
+                if flags & 0x10:
+                    pcr_at = off
+            p += 1 + adaptation_len
+        pts_at = dts_at = None
+        if (
+            b1 & 0x40
+            and b3 & 0x10
+            and p + 19 <= off + TS_PACKET_SIZE
+            and buf[p] == 0
+            and buf[p + 1] == 0
+            and buf[p + 2] == 1
+            and buf[p + 6] & 0xC0 == 0x80  # PES with an optional header
+        ):
+            pts_dts = buf[p + 7] >> 6
+            if pts_dts & 0x02:
+                pts_at = p + 9
+                if pts_dts == 0x03:
+                    dts_at = p + 14
+
+        if self._pending and (pcr_at is not None or pts_at is not None):
+            self._rebase(
+                _parse_pcr(buf, pcr_at) if pcr_at is not None else None,
+                _read_ts(buf, dts_at or pts_at) if pts_at is not None else None,
+            )
+        if pcr_at is not None:
+            pcr = (_parse_pcr(buf, pcr_at) + self._offset) % TS_CLOCK_WRAP
+            _write_pcr(buf, pcr_at, pcr)
+            self._last_pcr = pcr
+        for at in (pts_at, dts_at):
+            if at is None:
+                continue
+            ts = (_read_ts(buf, at) + self._offset) % TS_CLOCK_WRAP
+            _write_ts(buf, at, ts)
+            if self._last_ts is None or _later(ts, self._last_ts):
+                self._last_ts = ts
+
+        last = self._cc.get(pid)
+        if last is None:
+            cc = b3 & 0x0F
+        elif b3 & 0x10:
+            cc = (last + 1) & 0x0F
+        else:
+            cc = last  # packets without payload don't advance the counter
+        buf[off + 3] = (b3 & 0xF0) | cc
+        self._cc[pid] = cc
+
+    def process(self, data):
+        """Return the whole TS packets in data, rewritten onto the output timeline."""
+        data = self._carry + data
+        if data and data[0] != TS_SYNC_BYTE:
+            data = _resync(data)
+        usable = len(data) - len(data) % TS_PACKET_SIZE
+        self._carry = data[usable:]
+        buf = bytearray(data[:usable])
+        for off in range(0, usable, TS_PACKET_SIZE):
+            self._packet(buf, off)
+        return bytes(buf)
+
+
+class TSRingBuffer:
+    """Bounded in-memory ring of 188-byte aligned MPEG-TS chunks.
+
+    One producer pushes encoder output; any number of clients follow the
+    live edge, each starting at the newest keyframe with a fresh PAT/PMT.
+    """
+
+    def __init__(self, max_bytes=config.TS_BUFFER_BYTES):
+        self.max_bytes = max_bytes
+        self._chunks = deque()  # (data, syncs) per sequence number
+        self._base = 0  # sequence number of self._chunks[0]
+        self._bytes = 0
+        self._cond = threading.Condition()
+        self._carry = b""
+        self._pat = None
+        self._pmt = None
+        self._pmt_pid = None
+        self._pcr_pid = None
+        self._pcr = None
+        self._last_sync = None  # (seq, offset, pcr, header)
+        self._listeners = []
+        self.total_bytes = 0
+        self.clients = 0  # readers following the live edge
+        self.bytes_sent = 0  # bytes handed to those readers
+        self.closed = False
+
+    @property
+    def next_seq(self):
+        return self._base + len(self._chunks)
+
+    def _scan(self, chunk):
+        """Track PAT/PMT/PCR and return keyframe entry points in chunk."""
+        syncs = []
+        for off in range(0, len(chunk), TS_PACKET_SIZE):
+            b1 = chunk[off + 1]
+            pid = ((b1 & 0x1F) << 8) | chunk[off + 2]
+            if b1 & 0x40:
+                if pid == 0:
+                    self._pat = chunk[off : off + TS_PACKET_SIZE]
+                    self._pmt_pid = _pmt_pid(chunk, off)
+                elif pid == self._pmt_pid:
+                    self._pmt = chunk[off : off + TS_PACKET_SIZE]
+            if not (chunk[off + 3] & 0x20) or chunk[off + 4] == 0:
+                continue
+            flags = chunk[off + 5]
+            if flags & 0x10:
+                if self._pcr_pid is None:
+                    self._pcr_pid = pid
+                if pid == self._pcr_pid:
+                    self._pcr = _parse_pcr(chunk, off)
+            # ffmpeg flags keyframes with random_access_indicator; only trust
+            # it on the PCR PID (the video stream) so audio frames don't count
+            if flags & 0x40 and pid == self._pcr_pid and self._pat and self._pmt:
+                syncs.append((off, self._pcr, self._pat + self._pmt))
+        return syncs
+
+    def push(self, data):
+        """Append raw encoder output, keeping only whole TS packets."""
+        data = self._carry + data
+        if data and data[0] != TS_SYNC_BYTE:
+            data = _resync(data)
+        usable = len(data) - len(data) % TS_PACKET_SIZE
+        self._carry = data[usable:]
+        if not usable:
+            return
+        chunk = data[:usable]
+        syncs = self._scan(chunk)
+
+        with self._cond:
+            seq = self.next_seq
+            self._chunks.append((chunk, syncs))
+            self._bytes += usable
+            self.total_bytes += usable
+            if syncs:
+                off, pcr, header = syncs[-1]
+                self._last_sync = (seq, off, pcr, header)
+            while self._bytes > self.max_bytes and len(self._chunks) > 1:
+                old, _ = self._chunks.popleft()
+                self._bytes -= len(old)
+                self._base += 1
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for fn in listeners:
+            fn()
+
+    def join_delay(self):
+        """Seconds between the newest keyframe, where a joining reader
+        starts, and the newest PCR; None before the first keyframe."""
+        with self._cond:
+            if self._last_sync is None or self._last_sync[2] is None or self._pcr is None:
+                return None
+            return ((self._pcr - self._last_sync[2]) % TS_CLOCK_WRAP) / 90000
+
+    def add_listener(self, fn):
+        """Call fn() from the producer thread after every push and on close.
+
+        Lets readers that can't block on the condition (e.g. asyncio
+        clients) wait for new data.
+        """
+        with self._cond:
+            self._listeners.append(fn)
+
+    def remove_listener(self, fn):
+        with self._cond:
+            if fn in self._listeners:
+                self._listeners.remove(fn)
+
+    def tail_from_sync(self):
+        """Return everything from the newest keyframe on, headed by PAT/PMT.
+
+        Used to stage a starting writer's output; None until the first
+        keyframe has been seen.
+        """
+        with self._cond:
+            if self._last_sync is None:
+                return None
+            entry = self._entry_point()
+            if entry is None:
+                return None
+            seq, first, _ = entry
+            rest = [data for data, _ in list(self._chunks)[seq - self._base :]]
+            return b"".join([first, *rest, self._carry])
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for fn in listeners:
+            fn()
+
+    def _entry_point(self):
+        """Return (next_seq, data, syncs) for a reader joining at the live edge."""
+        seq, off, _, header = self._last_sync
+        if seq < self._base:
+            return None
+        data, syncs = self._chunks[seq - self._base]
+        shift = len(header) - off
+        syncs = [(o + shift, pcr, h) for o, pcr, h in syncs if o >= off]
+        return seq + 1, header + data[off:], syncs
+
+    def _wait_entry(self, timeout):
+        with self._cond:
+            entry = None
+            while entry is None:
+                if self.closed:
+                    return None
+                if self._last_sync is not None:
+                    entry = self._entry_point()
+                if entry is None:
+                    self._cond.wait(timeout)
+            return entry
+
+    def chunks(self, timeout=10):
+        """Yield (data, syncs, discontinuity) per chunk from the newest keyframe.
+
+        syncs lists (offset, pcr, header) keyframe entry points within data.
+        discontinuity is True whenever the reader had to (re)join the live
+        edge, so consumers such as the HLS segmenter can mark the gap.
+        """
+        entry = self._wait_entry(timeout)
+        if entry is None:
+            return
+        seq, data, syncs = entry
+        yield data, syncs, True
+
+        while True:
+            with self._cond:
+                while seq >= self.next_seq:
+                    if self.closed:
+                        return
+                    self._cond.wait(timeout)
+                if seq < self._base:
+                    entry = self._entry_point()
+                    if entry is None:
+                        seq = self.next_seq
+                        continue
+                    seq, data, syncs = entry
+                    jumped = True
+                else:
+                    data, syncs = self._chunks[seq - self._base]
+                    seq += 1
+                    jumped = False
+            yield data, syncs, jumped
+
+    def attach(self):
+        with self._cond:
+            self.clients += 1
+
+    def detach(self):
+        with self._cond:
+            self.clients -= 1
+
+    def entry(self):
+        """Non-blocking: (next_seq, data) to join the live edge, or None yet."""
+        with self._cond:
+            if self._last_sync is None:
+                return None
+            entry = self._entry_point()
+            if entry is None:
+                return None
+            self.bytes_sent += len(entry[1])
+            return entry[:2]
+
+    def read(self, seq, batch_bytes=256 * 1024):
+        """Non-blocking read for a reader at seq; returns (next_seq, data).
+
+        data is empty when nothing new has arrived. A reader that fell out
+        of the ring is moved to the newest keyframe.
+        """
+        with self._cond:
+            if seq < self._base:
+                entry = self._entry_point()
+                if entry is None:
+                    return self.next_seq, b""
+                self.bytes_sent += len(entry[1])
+                return entry[0], entry[1]
+            parts, size = [], 0
+            while seq < self.next_seq and size < batch_bytes:
+                data, _ = self._chunks[seq - self._base]
+                parts.append(data)
+                size += len(data)
+                seq += 1
+            if not parts:
+                return seq, b""
+            self.bytes_sent += size
+            return seq, parts[0] if len(parts) == 1 else b"".join(parts)
+
+    def follow(self, batch_bytes=256 * 1024, timeout=10):
+        """Yield TS bytes for one client, starting at the newest keyframe.
+
+        A client that falls out of the ring skips ahead to the newest
+        keyframe instead of stalling the producer or other clients.
+        """
+        entry = self._wait_entry(timeout)
+        if entry is None:
+            return
+        seq, first, _ = entry
+        self.attach()
+        try:
+            with self._cond:
+                self.bytes_sent += len(first)
+            yield first
+
+            while True:
+                with self._cond:
+                    while seq >= self.next_seq:
+                        if self.closed:
+                            return
+                        self._cond.wait(timeout)
+                seq, out = self.read(seq, batch_bytes)
+                if out:
+                    yield out
+        finally:
+            self.detach()
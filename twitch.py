@@ -0,0 +1,124 @@
+import threading
+import time
+from streamlink import Streamlink
+import config
+
+GQL_URL = "https://gql.twitch.tv/gql"
+# public client id used by the Twitch web player (and by Streamlink)
+GQL_CLIENT_ID = "kimne78kx3ncx6brgo4mv6wki5h1ko"
+GQL_STREAM_QUERY = """
+query($login: String!) {
+  user(login: $login) {
+    stream { id title type createdAt game { name } }
+  }
+}
+"""
+
+
+class TwitchProbe:
+    """Long-lived Twitch probe built around one Streamlink session.
+
+    Liveness is a single small GQL request over the session's pooled
+    HTTP connection. Stream variants are only resolved once a channel is
+    live: the probe that first sees a go-live starts resolving in the
+    background, while the orchestrator is still confirming it, and the
+    playlist URL is cached so the writer can use it directly. Later
+    probes of the same broadcast leave it alone; the writer re-resolves
+    itself when it restarts.
+    """
+
+    def __init__(self):
+        self.session = Streamlink()
+        self.last_latency = None  # seconds taken by the last liveness check
+        self.probes = 0
+        self.probe_seconds = 0.0
+        self.stream_info = {}  # channel -> {"title", "category", "started_at"} while live
+        self._resolved = {}  # channel -> (playlist url, expires at)
+        self._prefetching = set()
+        self._seen_live = set()  # channels whose go-live was already prefetched
+        self._lock = threading.Lock()
+
+    def _query_stream(self, channel):
+        res = self.session.http.post(
+            GQL_URL,
+            json={"query": GQL_STREAM_QUERY, "variables": {"login": channel}},
+            headers={"Client-ID": GQL_CLIENT_ID},
+            timeout=config.TWITCH_PROBE_TIMEOUT,
+        )
+        res.raise_for_status()
+        user = (res.json().get("data") or {}).get("user")
+        return (user or {}).get("stream")
+
+    def is_live(self, channel):
+        """Cheap liveness check; falls back to a full resolve if GQL fails."""
+        start = time.monotonic()
+        try:
+            stream = self._query_stream(channel)
+            live = bool(stream) and stream.get("type") == "live"
+            if live:
+                self.stream_info[channel] = {
+                    "title": stream.get("title"),
+                    "category": (stream.get("game") or {}).get("name"),
+                    "started_at": stream.get("createdAt"),
+                }
+                if channel not in self._seen_live:
+                    self._seen_live.add(channel)
+                    self._prefetch(channel)
+        except Exception as e:
+            print(f"⚠️ Twitch GQL probe failed ({e}); resolving streams instead")
+            live = self.resolve(channel) is not None
+        self.last_latency = time.monotonic() - start
+        self.probes += 1
+        self.probe_seconds += self.last_latency
+        if not live:
+            self.stream_info.pop(channel, None)
+            self._seen_live.discard(channel)
+            self.invalidate(channel)
+        return live
+
+    def resolve(self, channel, fresh=False):
+        """Return the best variant's playlist URL, cached for TWITCH_URL_TTL."""
+        now = time.time()
+        with self._lock:
+            cached = self._resolved.get(channel)
+            if cached and not fresh and cached[1] > now:
+                return cached[0]
+        try:
+            streams = self.session.streams(f"https://twitch.tv/{channel}")
+        except Exception as e:
+            print(f"⚠️ Twitch resolve failed: {e}")
+            return None
+        if "best" not in streams:
+            return None
+        url = streams["best"].url
+        with self._lock:
+            self._resolved[channel] = (url, now + config.TWITCH_URL_TTL)
+        return url
+
+    def _prefetch(self, channel):
+        """Resolve channel in the background unless a resolve is under way."""
+        with self._lock:
+            if channel in self._prefetching:
+                return
+            self._prefetching.add(channel)
+
+        def run():
+            try:
+                self.resolve(channel)
+            finally:
+                with self._lock:
+                    self._prefetching.discard(channel)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def invalidate(self, channel):
+        with self._lock:
+            self._resolved.pop(channel, None)
+
+    def stats(self):
+        return {
+            "probe_latency_ms": round(self.last_latency * 1000)
+            if self.last_latency is not None
+            else None,
+            "live": dict(self.stream_info),
+        }
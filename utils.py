@@ -1,27 +1,28 @@
 import os
-import subprocess
+import copy
 import json
+import shutil
+import threading
 import time
 import state
 import config
 import requests
+from ffmpeg_io import reset_log
 
 
 def cleanup():
     """Ensure dirs exist and clear old files"""
+    # per-channel HLS dirs and FIFOs are recreated as channels start
+    for path in (config.HLS_DIR, config.PIPE_DIR):
+        if os.path.exists(path):
+            shutil.rmtree(path)
     os.makedirs(config.HLS_DIR, exist_ok=True)
+    os.makedirs(config.PIPE_DIR, exist_ok=True)
     os.makedirs(config.YOUTUBE_DIR, exist_ok=True)
+    os.makedirs(config.TRANSCODE_DIR, exist_ok=True)
     os.makedirs(os.path.join("static", "logos"), exist_ok=True)
 
-    for f in os.listdir(config.HLS_DIR):
-        os.remove(os.path.join(config.HLS_DIR, f))
-
-    if os.path.exists(config.PIPE_PATH):
-        os.remove(config.PIPE_PATH)
-    os.mkfifo(config.PIPE_PATH)
-
-    if os.path.exists(config.FFMPEG_LOG):
-        os.remove(config.FFMPEG_LOG)
+    reset_log()
 
     print("🧹 Cleanup complete. Fresh HLS dir, pipe, and log file ready.")
 
@@ -40,63 +41,119 @@ def get_twitch_user_info(username):
         return None
 
 
-def load_config():
-    if not os.path.exists(config.CONFIG_FILE):
-        info = get_twitch_user_info("ludwig")
-        return {
-            "youtube_channels": [],
-            "twitch_channel": "ludwig",
-            "channel_name": info["display_name"] if info else "ludwig",
-            "channel_logo": info["profile_image_url"] if info else None,
-            "custom_logo": False,
-            "youtube_transcode": True,
-            "youtube_crf": 20,
-            "youtube_audio_bitrate": "192k",
-        }
-    with open(config.CONFIG_FILE) as f:
-        cfg = json.load(f)
-        # ensure defaults exist
-        cfg.setdefault("youtube_channels", [])
-        cfg.setdefault("twitch_channel", "ludwig")
-        if "channel_name" not in cfg or not cfg.get("channel_name"):
-            info = get_twitch_user_info(cfg["twitch_channel"])
-            cfg["channel_name"] = (
-                info["display_name"] if info else cfg["twitch_channel"]
-            )
-        if "channel_logo" not in cfg or not cfg.get("channel_logo"):
-            info = get_twitch_user_info(cfg["twitch_channel"])
+def _with_defaults(cfg):
+    """Fill in missing settings; Twitch branding is only looked up when absent"""
+    cfg.setdefault("youtube_channels", [])
+    cfg.setdefault("twitch_channel", "ludwig")
+    cfg.setdefault("channels", [])  # Twitch channels beyond the primary one
+    if not cfg.get("channel_name") or not cfg.get("channel_logo"):
+        info = get_twitch_user_info(cfg["twitch_channel"])
+        if not cfg.get("channel_name"):
+            cfg["channel_name"] = info["display_name"] if info else cfg["twitch_channel"]
+        if not cfg.get("channel_logo"):
             cfg["channel_logo"] = info["profile_image_url"] if info else None
-        cfg.setdefault("custom_logo", False)
-        cfg.setdefault("youtube_transcode", True)
-        cfg.setdefault("youtube_crf", 20)
-        cfg.setdefault("youtube_audio_bitrate", "192k")
-        return cfg
-
-
-def save_config(cfg):
-    with open(config.CONFIG_FILE, "w") as f:
-        json.dump(cfg, f, indent=2)
-
-
-def stop_writer():
-    """Kill current writer if running"""
-    if state.current_writer_proc and state.current_writer_proc.poll() is None:
-        state.current_writer_proc.terminate()
+    cfg.setdefault("custom_logo", False)
+    cfg.setdefault("youtube_transcode", True)
+    cfg.setdefault("twitch_passthrough", True)
+    cfg.setdefault("youtube_crf", config.OUTPUT_VIDEO_QUALITY)
+    cfg.setdefault("youtube_audio_bitrate", config.OUTPUT_AUDIO_BITRATE)
+    return cfg
+
+
+class ConfigStore:
+    """config.json held in memory and shared by Flask threads and the orchestrator.
+
+    The file is re-read only when its mtime changes, and that is checked at
+    most once per CONFIG_RELOAD_INTERVAL, so a read is normally just an
+    attribute lookup. Changes go through update(), which writes a temp
+    file and renames it into place.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._cfg = None
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _mtime_now(self):
         try:
-            state.current_writer_proc.wait(timeout=2)
-        except subprocess.TimeoutExpired:
-            state.current_writer_proc.kill()
-    state.current_writer_proc = None
-
-
-def wait_for_playlist(timeout=30):
-    """Wait until HLS playlist exists"""
-    playlist = os.path.join(config.HLS_DIR, "stream.m3u8")
-    start = time.time()
-    while time.time() - start < timeout:
-        if os.path.exists(playlist) and os.path.getsize(playlist) > 0:
-            print("✅ HLS playlist ready:", playlist)
-            return True
-        time.sleep(0.5)
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def get(self):
+        """Return the shared config dict. Treat it as read-only."""
+        now = time.monotonic()
+        if self._cfg is not None and now - self._checked < config.CONFIG_RELOAD_INTERVAL:
+            return self._cfg
+        with self._lock:
+            return self._reload()
+
+    def _reload(self):
+        """Re-read the file if it changed; call with the lock held."""
+        mtime = self._mtime_now()
+        if self._cfg is None or mtime != self._mtime:
+            cfg = {}
+            if mtime is not None:
+                with open(self.path) as f:
+                    cfg = json.load(f)
+            self._cfg = _with_defaults(cfg)
+            self._mtime = mtime
+        self._checked = time.monotonic()
+        return self._cfg
+
+    def _write(self, cfg):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(cfg, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._cfg = copy.deepcopy(cfg)
+        self._mtime = self._mtime_now()
+        self._checked = time.monotonic()
+
+    def update(self, fn):
+        """Read-modify-write under the lock: fn edits a fresh copy in place,
+        which is saved if it changed. Returns the resulting config.
+
+        Concurrent updates apply one after the other, so none is lost;
+        keep slow work (network calls, uploads) out of fn.
+        """
+        with self._lock:
+            current = self._reload()
+            cfg = copy.deepcopy(current)
+            fn(cfg)
+            if cfg != current:
+                self._write(cfg)
+            return cfg
+
+
+_config_store = ConfigStore(config.CONFIG_FILE)
+
+
+def get_config():
+    """Shared, cached config for read-only use on hot paths"""
+    return _config_store.get()
+
+
+def update_config(fn):
+    """Apply fn to the config and save it atomically with respect to other updates"""
+    return _config_store.update(fn)
+
+
+def playing_files():
+    """Files any channel's writer still has to read"""
+    return set().union(*(c.playing_files for c in list(state.channels.values())))
+
+
+def wait_for_playlist(channel, timeout=30):
+    """Wait until the channel's rolling HLS playlist has its first segment"""
+    if channel.hls_playlist is None:
+        return False
+    if channel.hls_playlist.ready.wait(timeout):
+        print(f"✅ HLS playlist ready: /channel/{channel.id}/stream.m3u8")
+        return True
     print("⚠️ Timeout waiting for HLS playlist.")
     return False
\ No newline at end of file
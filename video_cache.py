@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+import config
+
+
+def _video_id(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class VideoCache:
+    """Size- and age-bounded LRU store for downloaded videos.
+
+    Last use is tracked in each file's atime (set explicitly, so mount
+    options don't matter) and eviction runs across all channels at once.
+    Videos in the current playlist are pinned and never evicted.
+    """
+
+    def __init__(self, directory, max_bytes=None, max_age=None):
+        self.directory = directory
+        self.max_bytes = max_bytes or config.YOUTUBE_CACHE_MAX_BYTES
+        self.max_age = max_age or config.YOUTUBE_CACHE_MAX_AGE
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._pinned = set()
+        self._lock = threading.Lock()
+
+    def path(self, video_id):
+        return os.path.join(self.directory, f"{video_id}.mp4")
+
+    def touch(self, path):
+        """Mark a cached file as just used without changing its mtime."""
+        try:
+            st = os.stat(path)
+            os.utime(path, (time.time(), st.st_mtime))
+        except OSError:
+            pass
+
+    def lookup(self, video_id):
+        """Return the cached path for video_id, or None on a miss."""
+        path = self.path(video_id)
+        with self._lock:
+            if os.path.exists(path):
+                self.hits += 1
+                self.touch(path)
+                return path
+            self.misses += 1
+            return None
+
+    def pin(self, paths):
+        """Protect the given files (the current playlist) from eviction."""
+        with self._lock:
+            self._pinned = {_video_id(p) for p in paths}
+        for p in paths:
+            self.touch(p)
+
+    def _entries(self):
+        for f in os.listdir(self.directory):
+            if not f.endswith(".mp4"):
+                continue
+            path = os.path.join(self.directory, f)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            yield _video_id(f), path, st
+
+    def _remove(self, path, reason):
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"⚠️ Failed to evict {os.path.basename(path)}: {e}")
+            return 0
+        self.evictions += 1
+        print(f"🗑️ Evicted cached video ({reason}): {os.path.basename(path)}")
+        return 1
+
+    def evict(self):
+        """Drop expired files, then least recently used ones until under quota."""
+        now = time.time()
+        with self._lock:
+            entries = [e for e in self._entries() if e[0] not in self._pinned]
+            total = sum(st.st_size for _, _, st in self._entries())
+            kept = []
+            for vid, path, st in entries:
+                if now - st.st_mtime > self.max_age:
+                    if self._remove(path, "expired"):
+                        total -= st.st_size
+                else:
+                    kept.append((vid, path, st))
+            kept.sort(key=lambda e: e[2].st_atime)
+            for vid, path, st in kept:
+                if total <= self.max_bytes:
+                    break
+                if self._remove(path, "over quota"):
+                    total -= st.st_size
+
+    def stats(self):
+        size = sum(st.st_size for _, _, st in self._entries())
+        with self._lock:
+            return {
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+                "pinned": len(self._pinned),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
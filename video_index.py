@@ -0,0 +1,101 @@
+import sqlite3
+import threading
+import time
+
+
+class VideoIndex:
+    """Persistent SQLite index of YouTube channel → video entries.
+
+    Entries are stored newest-first per channel (higher position = newer),
+    so a refresh only has to list uploads until it reaches a known id.
+    """
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS videos (
+                    id TEXT PRIMARY KEY,
+                    channel TEXT NOT NULL,
+                    title TEXT,
+                    duration INTEGER,
+                    upload_date TEXT,
+                    is_short INTEGER NOT NULL DEFAULT 0,
+                    url TEXT,
+                    position INTEGER NOT NULL,
+                    added_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS videos_channel ON videos (channel, position)"
+            )
+
+    def known_ids(self, channel):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM videos WHERE channel = ?", (channel,)
+            ).fetchall()
+        return {r["id"] for r in rows}
+
+    def add_entries(self, channel, entries):
+        """Insert newly listed entries, given newest first."""
+        if not entries:
+            return
+        with self._lock, self._conn:
+            top = self._conn.execute(
+                "SELECT COALESCE(MAX(position), 0) FROM videos WHERE channel = ?",
+                (channel,),
+            ).fetchone()[0]
+            now = time.time()
+            for i, e in enumerate(reversed(entries), start=1):
+                self._conn.execute(
+                    """INSERT OR IGNORE INTO videos
+                    (id, channel, title, duration, upload_date, is_short, url, position, added_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (
+                        e["id"],
+                        channel,
+                        e.get("title"),
+                        e.get("duration"),
+                        e.get("upload_date"),
+                        int(bool(e.get("is_short"))),
+                        e.get("url"),
+                        top + i,
+                        now,
+                    ),
+                )
+
+    def update(self, video_id, **fields):
+        """Fill in details learned later, e.g. from the full extraction on download."""
+        fields = {k: v for k, v in fields.items() if v is not None}
+        if not fields:
+            return
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE videos SET {cols} WHERE id = ?", (*fields.values(), video_id)
+            )
+
+    def recent(self, channel, limit, min_duration=60, max_duration=10800):
+        """Newest non-short entries of a channel within the duration bounds.
+
+        Entries whose duration the flat listing did not give are kept.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT * FROM videos
+                WHERE channel = ? AND is_short = 0
+                AND (duration IS NULL OR duration BETWEEN ? AND ?)
+                ORDER BY position DESC LIMIT ?""",
+                (channel, min_duration, max_duration, limit),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def get(self, video_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM videos WHERE id = ?", (video_id,)
+            ).fetchone()
+        return dict(row) if row else None
@@ -1,12 +1,13 @@
 # youtube.py
 import os
-import random
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from yt_dlp import YoutubeDL
 import config
 import state
-from utils import load_config
+from utils import get_config, playing_files
+from downloader import RateLimiter, progress_hook
 
 # Setup yt-dlp debug logger
 log_dir = config.BASE_DIR
@@ -52,6 +53,26 @@ def _channel_url(channel: str) -> str:
         return f"https://www.youtube.com/@{channel}/videos"
 
 
+def _format_duration(seconds):
+    if not seconds:
+        return "unknown"
+    seconds = int(seconds)
+    return f"{seconds//60}m{seconds%60}s"
+
+
+def _video_meta(video_id, path):
+    """Playlist metadata for a cached file, from the channel index when known."""
+    entry = state.video_index.get(video_id) if state.video_index else None
+    if entry is None:
+        return {"title": os.path.basename(path), "duration": "unknown", "url": None, "path": path}
+    return {
+        "title": entry["title"] or video_id,
+        "duration": _format_duration(entry["duration"]),
+        "url": entry["url"],
+        "path": path,
+    }
+
+
 def load_cached_videos(max_videos=5):
     """Return up to N most recent cached YouTube videos with metadata."""
     files = [
@@ -62,133 +83,200 @@ def load_cached_videos(max_videos=5):
     files.sort(key=lambda f: os.path.getmtime(f), reverse=True)
     files = files[:max_videos]
 
-    meta = []
-    for f in files:
-        meta.append(
-            {
-                "title": os.path.basename(f),
-                "duration": "unknown",
-                "url": None,
-                "path": f,
-            }
-        )
+    meta = [_video_meta(os.path.splitext(os.path.basename(f))[0], f) for f in files]
     return files, meta
 
 
-def fetch_youtube_videos(channels, max_videos=5, rate_limit=10):
-    """Fetch the latest N valid YouTube uploads, respecting cache, rate limit, and cleanup."""
-    ydl_opts = {
+def _ydl_opts(max_videos, channel):
+    opts = {
         "format": "bv*[ext=mp4]+ba[ext=m4a]/b[ext=mp4]/best",
         "merge_output_format": "mp4",
         "outtmpl": os.path.join(config.YOUTUBE_DIR, "%(id)s.%(ext)s"),
         "cachedir": os.path.join(config.BASE_DIR, "yt_dlp_cache"),
         "playlistend": max_videos * 5,
+        "extract_flat": "in_playlist",
         "logger": YTDLPLogger(),
-        "progress_hooks": [lambda d: logging.info(f"yt-dlp: {d}")],
+        "progress_hooks": [progress_hook(channel)],
         "match_filter": "!is_short",
+        # resume interrupted downloads from their .part files
+        "continuedl": True,
+        "nopart": False,
+        "retries": 5,
+        "fragment_retries": 5,
     }
-
     cookie_file = os.path.join(config.BASE_DIR, "cookies.txt")
     if os.path.exists(cookie_file):
-        ydl_opts["cookiefile"] = cookie_file
+        opts["cookiefile"] = cookie_file
+    return opts
+
+
+def _flat_entry(e):
+    url = e.get("url") or f"https://www.youtube.com/watch?v={e['id']}"
+    return {
+        "id": e["id"],
+        "title": e.get("title"),
+        "duration": int(e["duration"]) if e.get("duration") else None,
+        "upload_date": e.get("upload_date"),
+        "is_short": "/shorts/" in url,
+        "url": url,
+    }
 
-    ydl = YoutubeDL(ydl_opts)
+
+def _list_new_entries(ydl, url, channel, max_entries):
+    """List uploads newest-first until reaching one the index already has."""
+    known = state.video_index.known_ids(channel)
+    info = ydl.extract_info(url, download=False, process=False)
+    new = []
+    for e in info.get("entries") or []:
+        if not e or not e.get("id"):
+            continue
+        if e["id"] in known:
+            break
+        new.append(_flat_entry(e))
+        if len(new) >= max_entries:
+            break
+    return new
+
+
+def _fetch_channel(channel, max_videos, limiter):
+    """Fetch and download the latest N valid uploads of one channel."""
     downloaded, meta = [], []
+    try:
+        ydl = YoutubeDL(_ydl_opts(max_videos, channel))
+        url = _channel_url(channel)
+        print(f"📺 Checking {url} for new uploads...")
+        logging.info(f"Fetching from {url}")
+
+        limiter.acquire(url, channel)
+        new = _list_new_entries(ydl, url, channel, max_videos * 5)
+        state.video_index.add_entries(channel, new)
+        print(f"🗂️ {channel}: {len(new)} new entries indexed")
+
+        # Latest N in the 1 min – 3 hrs range, straight from the index
+        valid_entries = state.video_index.recent(channel, max_videos)
+
+        for e in valid_entries:
+            video_id = e["id"]
+            path = state.video_cache.lookup(video_id)
+
+            if path is None:
+                path = state.video_cache.path(video_id)
+                print(f"⬇️ Downloading {e.get('title') or 'Unknown'}...")
+                logging.info(f"Downloading {e.get('title')} ({e['url']})")
+                limiter.acquire(e["url"], channel)
+                info = ydl.extract_info(e["url"], download=True)
+                if info:
+                    state.video_index.update(
+                        video_id,
+                        title=info.get("title"),
+                        duration=info.get("duration"),
+                        upload_date=info.get("upload_date"),
+                        url=info.get("webpage_url"),
+                    )
+            else:
+                print(f"✅ Already cached: {e.get('title') or 'Unknown'}")
+                logging.info(f"Already cached: {e.get('title')}")
+
+            downloaded.append(path)
+            meta.append(_video_meta(video_id, path))
+    except Exception:
+        import traceback
+
+        print(f"⚠️ YouTube fetch error ({channel})")
+        logging.exception("YouTube fetch error")
+        traceback.print_exc()
+    return downloaded, meta
 
-    for channel in channels:
-        try:
-            url = _channel_url(channel)
-            print(f"📺 Fetching last {max_videos} valid videos for {url}...")
-            logging.info(f"Fetching from {url}")
-
-            info = ydl.extract_info(url, download=False)
-            entries = info.get("entries") or []
-
-            # Filter by duration and take only the latest N
-            valid_entries = []
-            for e in entries:
-                if not e:
-                    continue
-                duration = e.get("duration", 0)
-                if 60 <= duration <= 10800:  # 1 min – 3 hrs
-                    valid_entries.append(e)
-                if len(valid_entries) >= max_videos:
-                    break
-
-            keep_ids = [e["id"] for e in valid_entries]
-
-            for e in valid_entries:
-                video_id = e["id"]
-                path = os.path.join(config.YOUTUBE_DIR, f"{video_id}.mp4")
-
-                if not os.path.exists(path):
-                    print(f"⬇️ Downloading {e.get('title', 'Unknown')}...")
-                    logging.info(f"Downloading {e.get('title')} ({e['webpage_url']})")
-                    ydl.download([e["webpage_url"]])
-                    time.sleep(rate_limit)  # rate limit between downloads
-                else:
-                    print(f"✅ Already cached: {e.get('title', 'Unknown')}")
-                    logging.info(f"Already cached: {e.get('title')}")
-
-                downloaded.append(path)
-                meta.append(
-                    {
-                        "title": e.get("title", "Unknown"),
-                        "duration": f"{e['duration']//60}m{e['duration']%60}s",
-                        "url": e.get("webpage_url"),
-                        "path": path,
-                    }
-                )
-
-            # Cleanup: remove old cached files not in keep_ids
-            for f in os.listdir(config.YOUTUBE_DIR):
-                if f.endswith(".mp4"):
-                    vid_id, _ = os.path.splitext(f)
-                    if vid_id not in keep_ids:
-                        old_path = os.path.join(config.YOUTUBE_DIR, f)
-                        try:
-                            os.remove(old_path)
-                            print(f"🗑️ Removed old cached video: {f}")
-                            logging.info(f"Removed old cached video: {f}")
-                        except Exception as e:
-                            logging.warning(f"Failed to remove {f}: {e}")
-
-        except Exception:
-            import traceback
-
-            print("⚠️ YouTube fetch error")
-            logging.exception("YouTube fetch error")
-            traceback.print_exc()
+
+def fetch_youtube_videos(channels, max_videos=5, rate_limit=10):
+    """Fetch the latest N valid YouTube uploads of all channels in parallel.
+
+    Channels run on a bounded worker pool, so a refresh takes about as long
+    as the slowest channel. Requests are spaced by token buckets per channel
+    (one download per rate_limit seconds) and per host.
+    """
+    limiter = RateLimiter(channel_interval=rate_limit)
+    downloaded, meta = [], []
+    with ThreadPoolExecutor(
+        max_workers=config.YOUTUBE_DOWNLOAD_WORKERS, thread_name_prefix="yt-dlp"
+    ) as pool:
+        results = list(
+            pool.map(lambda ch: _fetch_channel(ch, max_videos, limiter), channels)
+        )
+    for files, entries in results:
+        downloaded += files
+        meta += entries
 
     return downloaded, meta
 
 
+def _set_playlist(files, meta):
+    """Publish a new filler playlist and update the caches that depend on it."""
+    state.youtube_cache, state.youtube_meta = files, meta
+    # Older videos stay cached until the LRU store needs the space, so a
+    # video dropping out of the playlist is not downloaded again if it
+    # comes back. The playlist itself is pinned against eviction.
+    state.video_cache.pin(files)
+    state.video_cache.evict()
+    if state.transcode_cache is not None:
+        state.transcode_cache.reconcile(files, get_config())
+    for channel in list(state.channels.values()):
+        if channel.orchestrator is not None:
+            channel.orchestrator.poke()  # filler may now replace the fallback
+
+
+def refresh_youtube_once(force=False):
+    """One refresh pass (cache-first unless forced); runs as a job."""
+    cfg = get_config()
+
+    # 1. Load cached files first
+    cached, cached_meta = load_cached_videos(max_videos=5)
+    if cached and not force:
+        _set_playlist(cached, cached_meta)
+        print(f"⚡ Using {len(cached)} cached videos (no fetch needed)")
+    else:
+        # 2. If not enough cached, fetch from YouTube
+        _set_playlist(*fetch_youtube_videos(cfg.get("youtube_channels", []), max_videos=5))
+        print(f"✅ YouTube cache refreshed: {len(state.youtube_cache)} videos")
+    return {"videos": len(state.youtube_cache)}
+
+
+def download_channel(channel):
+    """Fetch a newly added channel and merge its videos into the playlist."""
+    files, meta = fetch_youtube_videos([channel], max_videos=5)
+    known = set(state.youtube_cache)
+    new = [(f, m) for f, m in zip(files, meta) if f not in known]
+    _set_playlist(
+        state.youtube_cache + [f for f, _ in new],
+        state.youtube_meta + [m for _, m in new],
+    )
+    return {"videos": len(new)}
+
+
+def clear_youtube_cache():
+    """Delete cached videos, except files a channel's writer still has to read."""
+    playing = playing_files()
+    removed = 0
+    for f in os.listdir(config.YOUTUBE_DIR):
+        path = os.path.join(config.YOUTUBE_DIR, f)
+        if path in playing or not os.path.isfile(path):
+            continue
+        try:
+            os.remove(path)
+            removed += 1
+        except Exception as e:
+            print("⚠️ Error deleting file:", f, e)
+    if state.transcode_cache is not None:
+        state.transcode_cache.clear()
+    kept = [(f, m) for f, m in zip(state.youtube_cache, state.youtube_meta) if os.path.exists(f)]
+    state.youtube_cache = [f for f, _ in kept]
+    state.youtube_meta = [m for _, m in kept]
+    print(f"🗑️ YouTube cache cleared ({removed} files, {len(playing)} in use kept).")
+    return {"removed": removed, "kept": len(playing)}
+
+
 def refresh_youtube_cache():
-    """Background thread: refresh YouTube cache hourly (cache-first + cleanup)."""
+    """Background thread: queue an hourly YouTube refresh (cache-first + cleanup)."""
     while True:
-        cfg = load_config()
-
-        # 1. Load cached files first
-        cached, cached_meta = load_cached_videos(max_videos=5)
-        if cached:
-            state.youtube_cache, state.youtube_meta = cached, cached_meta
-            print(f"⚡ Using {len(cached)} cached videos (no fetch needed)")
-        else:
-            # 2. If not enough cached, fetch from YouTube
-            state.youtube_cache, state.youtube_meta = fetch_youtube_videos(
-                cfg.get("youtube_channels", []), max_videos=5
-            )
-            print(f"✅ YouTube cache refreshed: {len(state.youtube_cache)} videos")
-
+        state.jobs.submit("refresh", refresh_youtube_once)
         time.sleep(config.YOUTUBE_REFRESH)
-
-
-def build_youtube_playlist():
-    """Build a randomized playlist file from cached YouTube videos."""
-    playlist_path = os.path.join(config.YOUTUBE_DIR, "playlist.txt")
-    with open(playlist_path, "w") as f:
-        if not state.youtube_cache:
-            return playlist_path
-        for v in random.sample(state.youtube_cache, len(state.youtube_cache)):
-            f.write(f"file '{v}'\n")
-    return playlist_path
\ No newline at end of file